@@ -0,0 +1,226 @@
+"""Offline benchmarks of the hot paths of the client, with a regression check against a stored baseline.
+
+Micro-benchmarks time the signing, encoding and validation functions and `EmailageClient.request` over a canned
+response. Macro-benchmarks send GET and POST queries from several threads to :class:`emailage.stub_server.StubServer`
+and report throughput and latency percentiles. Every result is a duration, so lower is better.
+
+Run from the repository root:
+
+    $ python benchmarks/hotpaths_bench.py                              # micro and macro
+    $ python benchmarks/hotpaths_bench.py --micro --save baseline.json
+    $ python benchmarks/hotpaths_bench.py --micro --compare baseline.json --threshold 0.2
+
+With --compare the exit status is 1 when any result is slower than the baseline by more than the threshold.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import threading
+import time
+import timeit
+
+import requests
+from mock import Mock
+
+from emailage import signature, validation
+from emailage.client import EmailageClient, HttpMethods, _url_encode_dict
+from emailage.stub_server import StubServer
+
+
+_now = getattr(time, 'perf_counter', time.time)
+
+URL = 'https://api.emailage.com/emailagevalidator/'
+HMAC_KEY = 'consumer_token&'
+RESPONSE_BODY = json.dumps({
+    'query': {'email': 'test%2bemailage%40example.com', 'queryType': 'EmailAgeVerification', 'count': 1,
+              'results': [{'email': 'test+emailage@example.com', 'EAScore': '512', 'EAAdvice': 'Moderate Fraud Risk',
+                           'EARiskBand': 'Fraud Score 301 to 600', 'EARiskBandID': '3',
+                           'EAReason': 'Limited History for Email', 'EAReasonID': '8'}]},
+    'responseStatus': {'status': 'success', 'errorCode': '0', 'description': ''}
+}).encode('utf_8_sig')
+
+
+def _signed_params():
+    params = dict(format='json', query='test+emailage@example.com', urid='8c3e1a0f', firstname='Johann Paulus',
+                  lastname='van der Grift', phone='+14805559163')
+    return signature.add_oauth_entries_to_fields_dict('consumer_secret', params, nonce='f0e9d8c7', timestamp=1600000000)
+
+
+def _deterministic_generators():
+    # Seeded nonces and a fixed timestamp, so that every run signs the same requests
+    rand = random.Random(0)
+    signature.set_generators(
+        nonce=signature.NonceGenerator(random_bytes=lambda size: bytes(bytearray(rand.getrandbits(8)
+                                                                                 for _ in range(size)))),
+        timestamp=signature.TimestampClock(clock=lambda: 1600000000))
+
+
+def _per_call(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def _offline_client(http_method):
+    response = Mock(spec=requests.Response)
+    response.status_code = 200
+    response.content = RESPONSE_BODY
+    client = EmailageClient('consumer_secret', 'consumer_token', http_method=http_method)
+    client.session = Mock(spec=requests.Session)
+    client.session.get.return_value = client.session.post.return_value = response
+    return client
+
+
+def micro(number):
+    _deterministic_generators()
+    params = _signed_params()
+    signer = signature.Signer(HMAC_KEY, 'GET', URL)
+    get_client, post_client = _offline_client(HttpMethods.GET), _offline_client(HttpMethods.POST)
+    cases = [
+        ('signature.create', lambda: signature.create('GET', URL, params, HMAC_KEY)),
+        ('signature.Signer.sign', lambda: signer.sign(params)),
+        ('signature.add_oauth_entries_to_fields_dict', lambda: signature.add_oauth_entries_to_fields_dict(
+            'consumer_secret', {})),
+        ('signature.NonceGenerator', signature.NonceGenerator()),
+        ('signature.normalize_query_parameters', lambda: signature.normalize_query_parameters(params)),
+        ('client._url_encode_dict', lambda: _url_encode_dict(params)),
+        ('client._assemble_quoted_pairs', lambda: EmailageClient._assemble_quoted_pairs(params)),
+        ('validation.assert_ip ipv4', lambda: validation.assert_ip('174.70.13.43')),
+        ('validation.assert_ip ipv6', lambda: validation.assert_ip('2001:db8:a0b:12f0::1')),
+        ('validation.assert_email', lambda: validation.assert_email('test+emailage@example.com')),
+        ('EmailageClient.request GET', lambda: get_client.request('', query='test+emailage@example.com')),
+        ('EmailageClient.request POST', lambda: post_client.request('', query='test+emailage@example.com')),
+    ]
+    return dict(('micro.' + name, _per_call(func, number)) for name, func in cases)
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def _load(client, threads, requests_per_thread):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        own = []
+        for _ in range(requests_per_thread):
+            started_at = _now()
+            client.query('test+emailage@example.com')
+            own.append(_now() - started_at)
+        with lock:
+            latencies.extend(own)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started_at = _now()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    return _now() - started_at, sorted(latencies)
+
+
+def _serve(port_queue, options):
+    stub = StubServer('consumer_secret', 'consumer_token', **options)
+    port_queue.put(stub.url)
+    stub.serve_forever()
+
+
+def macro(threads, requests_per_thread, stub_options):
+    # The stub runs in its own process so that it does not compete with the client for the GIL
+    url_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(url_queue, stub_options))
+    server.daemon = True
+    server.start()
+    domain = url_queue.get(timeout=10)
+    results = {}
+    try:
+        for http_method in [HttpMethods.GET, HttpMethods.POST]:
+            client = EmailageClient('consumer_secret', 'consumer_token', http_method=http_method,
+                                    pool_maxsize=threads)
+            client.set_api_domain(domain)
+            _load(client, threads, 10)  # warm up the connection pool
+
+            elapsed, latencies = _load(client, threads, requests_per_thread)
+            prefix = 'macro.{}.'.format(http_method.lower())
+            results[prefix + 'seconds_per_request'] = elapsed / len(latencies)
+            results[prefix + 'p50'] = _percentile(latencies, 0.5)
+            results[prefix + 'p99'] = _percentile(latencies, 0.99)
+    finally:
+        server.terminate()
+        server.join()
+    return results
+
+
+def _format_duration(seconds):
+    return '{:>12.3f} us'.format(seconds * 1e6)
+
+
+def report(results, baseline=None, threshold=0.0):
+    """ Prints the results next to the baseline ones, if any
+
+        :return: names of the results slower than the baseline by more than `threshold`
+    """
+    regressions = []
+    for name in sorted(results):
+        line = '{:<44} {}'.format(name, _format_duration(results[name]))
+        if name.endswith('seconds_per_request'):
+            line += ' {:>8.0f} req/s'.format(1 / results[name])
+        if baseline and name in baseline:
+            ratio = results[name] / baseline[name]
+            regressed = ratio > 1 + threshold
+            line += ' {} {:>+8.1f}%{}'.format(_format_duration(baseline[name]), (ratio - 1) * 100,
+                                            '  REGRESSION' if regressed else '')
+            if regressed:
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--micro', action='store_true', help='run the micro-benchmarks only')
+    parser.add_argument('--macro', action='store_true', help='run the macro-benchmarks only')
+    parser.add_argument('--number', type=int, default=2000, help='calls per micro-benchmark repetition')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent threads of the macro-benchmarks')
+    parser.add_argument('--requests', type=int, default=250, help='requests per thread of the macro-benchmarks')
+    parser.add_argument('--latency', type=float, default=0.0, help='median latency of the stub API in seconds')
+    parser.add_argument('--latency-sigma', type=float, default=0.0, help='shape of the log-normal stub latency')
+    parser.add_argument('--save', metavar='FILE', help='store the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results with a stored baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='tolerated slowdown relative to the baseline, 0.25 by default')
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    run_all = not args.micro and not args.macro
+
+    results = {}
+    if args.micro or run_all:
+        results.update(micro(args.number))
+    if args.macro or run_all:
+        results.update(macro(args.threads, args.requests,
+                             dict(latency=args.latency, latency_sigma=args.latency_sigma)))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    regressions = report(results, baseline, args.threshold)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+    if regressions:
+        print('{} result(s) regressed by more than {:.0%}: {}'.format(len(regressions), args.threshold,
+                                                                      ', '.join(regressions)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Compares the HTTP/1.1 and HTTP/2 transports of the client under concurrency, against the local stub server.
+
+Threads send queries to :class:`emailage.stub_server.StubServer`, whose latency is log-normal so that some requests are
+much slower than the median. HTTP/1.1 needs one connection per request in flight, and opens and discards connections
+once the threads outnumber `--pool-maxsize`; HTTP/2 multiplexes the requests over a few connections (h2c, since the
+stub serves plain HTTP). The connections opened, the throughput and the latency percentiles of each transport are
+reported.
+
+Requires the optional `httpcore[asyncio,http2]` dependency. Run from the repository root:
+
+    $ python benchmarks/http2_bench.py
+    $ python benchmarks/http2_bench.py --threads 128 --pool-maxsize 4 --latency 0.05 --latency-sigma 0.8
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import sys
+
+from hotpaths_bench import _load, _percentile, _serve
+
+from emailage.client import EmailageClient, HttpMethods, Transports
+
+
+TRANSPORTS = [Transports.HTTP1, Transports.H2C]
+
+
+def run(transport, domain, http_method, threads, requests_per_thread, pool_maxsize):
+    """ :return: (seconds per request, p50, p90, p99, connections created, connections open) """
+    client = EmailageClient('consumer_secret', 'consumer_token', http_method=http_method, transport=transport,
+                            pool_maxsize=pool_maxsize)
+    client.set_api_domain(domain)
+    elapsed, latencies = _load(client, threads, requests_per_thread)
+    stats = client.pool_stats()
+    client.session.close()
+    return (elapsed / len(latencies), _percentile(latencies, 0.5), _percentile(latencies, 0.9),
+            _percentile(latencies, 0.99), stats.created, stats.in_use + stats.idle)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--threads', type=int, default=64, help='concurrent threads, 64 by default')
+    parser.add_argument('--requests', type=int, default=50, help='requests per thread, 50 by default')
+    parser.add_argument('--pool-maxsize', type=int, default=8, help='connections kept per host, 8 by default')
+    parser.add_argument('--latency', type=float, default=0.02, help='median latency of the stub API in seconds')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='shape of the log-normal stub latency')
+    parser.add_argument('--http-method', default=HttpMethods.GET, choices=[HttpMethods.GET, HttpMethods.POST])
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+
+    # The stub runs in its own process so that it does not compete with the client for the GIL
+    url_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(url_queue, dict(latency=args.latency,
+                                                                          latency_sigma=args.latency_sigma)))
+    server.daemon = True
+    server.start()
+    domain = url_queue.get(timeout=10)
+    try:
+        print('{} threads x {} {} requests, pool_maxsize={}'.format(args.threads, args.requests, args.http_method,
+                                                                   args.pool_maxsize))
+        print('{:<10} {:>10} {:>10} {:>10} {:>10} {:>9} {:>6}'.format('transport', 'req/s', 'p50 ms', 'p90 ms',
+                                                                     'p99 ms', 'created', 'open'))
+        for transport in TRANSPORTS:
+            seconds, p50, p90, p99, created, open_connections = run(transport, domain, args.http_method,
+                                                                    args.threads, args.requests, args.pool_maxsize)
+            print('{:<10} {:>10.0f} {:>10.1f} {:>10.1f} {:>10.1f} {:>9} {:>6}'.format(
+                transport, 1 / seconds, p50 * 1e3, p90 * 1e3, p99 * 1e3, created, open_connections))
+    finally:
+        server.terminate()
+        server.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Measures the cold import time of the package modules, with a budget check.
+
+Every import is timed in a fresh interpreter, so nothing is cached in `sys.modules`, and the median of the runs is
+reported along with the heavy dependencies it loaded. The exit status is 1 when an import exceeds its budget, or when
+`import emailage` or `import emailage.client` loads one of the HTTP stack modules, which must wait until the first
+request is sent.
+
+Run from the repository root:
+
+    $ python benchmarks/import_bench.py
+    $ python benchmarks/import_bench.py --repeat 21 --budget emailage=5 --budget emailage.client=20
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import subprocess
+import sys
+
+
+MODULES = ['emailage', 'emailage.validation', 'emailage.signature', 'emailage.client', 'emailage.aio']
+
+# Modules which `import emailage` and `import emailage.client` must not load
+HTTP_STACK = ['requests', 'urllib3', 'ssl', 'aiohttp']
+
+# Modules checked for the HTTP stack modules they load
+DEFERRED = ['emailage', 'emailage.client']
+
+DEFAULT_BUDGETS = {'emailage': 0.01, 'emailage.client': 0.03}
+
+_PROBE = '''
+import json, sys, time
+started_at = time.perf_counter() if hasattr(time, 'perf_counter') else time.time()
+try:
+    __import__({module!r})
+except ImportError as exc:
+    print(json.dumps({{'error': str(exc)}}))
+    sys.exit(0)
+elapsed = (time.perf_counter() if hasattr(time, 'perf_counter') else time.time()) - started_at
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def measure(module, repeat):
+    """ :return: (median seconds, heavy modules loaded) of importing `module` in `repeat` fresh interpreters,
+        or (None, error message) if it cannot be imported
+    """
+    durations = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', _PROBE.format(module=module, heavy=HTTP_STACK)])
+        result = json.loads(output.decode('utf_8').strip().splitlines()[-1])
+        if 'error' in result:
+            return None, result['error']
+        durations.append(result['seconds'])
+        loaded = result['loaded']
+    return sorted(durations)[len(durations) // 2], loaded
+
+
+def _parse_budget(value):
+    module, separator, milliseconds = value.partition('=')
+    if not separator:
+        raise argparse.ArgumentTypeError('expected MODULE=MILLISECONDS, got {!r}'.format(value))
+    return module, float(milliseconds) / 1000
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('modules', nargs='*', default=MODULES, help='modules to import, the package ones by default')
+    parser.add_argument('--repeat', type=int, default=11, help='fresh interpreters per module, 11 by default')
+    parser.add_argument('--budget', action='append', type=_parse_budget, default=[], metavar='MODULE=MS',
+                        help='maximum median import time of a module in milliseconds; emailage=10 and '
+                             'emailage.client=30 by default')
+    parser.add_argument('--save', metavar='FILE', help='store the median import times')
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    budgets = dict(DEFAULT_BUDGETS)
+    budgets.update(args.budget)
+
+    results = {}
+    failures = []
+    for module in args.modules:
+        seconds, loaded = measure(module, args.repeat)
+        if seconds is None:
+            print('{:<24} {:>12}  ({})'.format(module, 'skipped', loaded))
+            continue
+        results[module] = seconds
+
+        line = '{:<24} {:>9.2f} ms'.format(module, seconds * 1e3)
+        if module in budgets:
+            line += '  budget {:>7.2f} ms'.format(budgets[module] * 1e3)
+            if seconds > budgets[module]:
+                line += '  OVER BUDGET'
+                failures.append('{} takes {:.2f} ms to import'.format(module, seconds * 1e3))
+        if loaded:
+            line += '  loads ' + ', '.join(loaded)
+        print(line)
+        if module in DEFERRED and loaded:
+            failures.append('import {} loads {}'.format(module, ', '.join(loaded)))
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2, sort_keys=True)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
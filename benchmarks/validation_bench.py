@@ -0,0 +1,87 @@
+"""Compares the cost of the parser-based validation with the regular expressions it replaced.
+
+Run from the repository root:
+
+    $ python benchmarks/validation_bench.py
+"""
+from __future__ import print_function
+
+import re
+import sys
+import timeit
+
+from emailage import validation
+
+
+# The patterns used by emailage.validation up to 1.2.2
+LEGACY_EMAIL_RE = r'^[^@\s]+@([^@\s]+\.)+[^@\s]+$'
+LEGACY_IPV4_RE = r'^([3-9]\d?|2(?:5[0-5]|[0-4]?\d)?|1\d{0,2})((\.([3-9]\d?|2(?:5[0-5]|[0-4]?\d)?|1\d{0,2}|0)){3})$'
+_LEGACY_LS32 = ('(?:[0-9A-Fa-f]{1,4}:[0-9A-Fa-f]{1,4}|(?:(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\\.){3}'
+                '(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5]))')
+LEGACY_IPV6_RE = ('^(?:(?:[0-9A-Fa-f]{1,4}:){6}' + _LEGACY_LS32 +
+                  '|::(?:[0-9A-Fa-f]{1,4}:){5}' + _LEGACY_LS32 +
+                  '|(?:[0-9A-Fa-f]{1,4})?::(?:[0-9A-Fa-f]{1,4}:){4}' + _LEGACY_LS32 +
+                  '|(?:[0-9A-Fa-f]{1,4}:[0-9A-Fa-f]{1,4})?::(?:[0-9A-Fa-f]{1,4}:){3}' + _LEGACY_LS32 +
+                  '|(?:(?:[0-9A-Fa-f]{1,4}:){,2}[0-9A-Fa-f]{1,4})?::(?:[0-9A-Fa-f]{1,4}:){2}' + _LEGACY_LS32 +
+                  '|(?:(?:[0-9A-Fa-f]{1,4}:){,3}[0-9A-Fa-f]{1,4})?::[0-9A-Fa-f]{1,4}:' + _LEGACY_LS32 +
+                  '|(?:(?:[0-9A-Fa-f]{1,4}:){,4}[0-9A-Fa-f]{1,4})?::' + _LEGACY_LS32 +
+                  '|(?:(?:[0-9A-Fa-f]{1,4}:){,5}[0-9A-Fa-f]{1,4})?::[0-9A-Fa-f]{1,4}'
+                  '|(?:(?:[0-9A-Fa-f]{1,4}:){,6}[0-9A-Fa-f]{1,4})?::)$')
+
+
+def legacy_assert_email(email):
+    if not re.match(LEGACY_EMAIL_RE, email):
+        raise ValueError('{} is not a valid email address.'.format(email))
+
+
+def legacy_assert_ip(ip):
+    if not re.match(LEGACY_IPV4_RE, ip) and not re.match(LEGACY_IPV6_RE, ip):
+        raise ValueError('{} is not a valid IP address.'.format(ip))
+
+
+def _per_call(func, value, number):
+    def call():
+        try:
+            func(value)
+        except ValueError:
+            pass
+    return min(timeit.repeat(call, number=number, repeat=3)) / number
+
+
+def _report(label, before, after):
+    print('{:<44} {:>12.3f} us {:>12.3f} us {:>9.1f}x'.format(label, before * 1e6, after * 1e6, before / after))
+
+
+def main(number=20000):
+    print('{:<44} {:>15} {:>15} {:>10}'.format('case', 'before', 'after', 'speedup'))
+
+    for label, value in [('email valid', 'test+emailage@example.com'),
+                         ('email invalid', 'test+example.com')]:
+        _report(label, _per_call(legacy_assert_email, value, number),
+                _per_call(validation.assert_email, value, number))
+
+    for label, value in [('ipv4 valid', '174.70.13.43'),
+                         ('ipv4 invalid', '192.168.1.1:443'),
+                         ('ipv6 valid', '2001:db8:a0b:12f0::1'),
+                         ('ipv6 invalid', '1200::AB00:1234::2552:7777:1313')]:
+        _report(label, _per_call(legacy_assert_ip, value, number),
+                _per_call(validation.assert_ip, value, number))
+
+    # Dotted hosts followed by a rejecting character make the nested quantifier of the legacy email pattern
+    # try every way of splitting the host into labels: the cost doubles with every label
+    for labels in (12, 16, 20):
+        value = 'a@' + 'a.' * labels + '@'
+        _report('adversarial email, {} labels'.format(labels), _per_call(legacy_assert_email, value, 1),
+                _per_call(validation.assert_email, value, 1))
+
+    value = 'a@' + 'a.' * 100000 + '@'
+    print('{:<44} {:>15} {:>12.3f} us'.format('adversarial email, 100000 labels', 'n/a',
+                                              _per_call(validation.assert_email, value, 10) * 1e6))
+
+    value = '1:' * 50000 + ':'
+    _report('adversarial ip, 100000 chars', _per_call(legacy_assert_ip, value, 10),
+            _per_call(validation.assert_ip, value, 10))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
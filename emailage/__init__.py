@@ -8,7 +8,17 @@ if sys.version_info < PYTHON_VERSION:  # pragma: no cover (manual test)
     sys.exit("Python {}.{}+ is required.".format(*PYTHON_VERSION))
 
 
-from emailage.client import TlsVersions
-protocols = TlsVersions()
+def __getattr__(name):
+    # `protocols` needs emailage.client, which `import emailage` alone does not load
+    if name == 'protocols':
+        from emailage.client import TlsVersions
+        global protocols
+        protocols = TlsVersions()
+        return protocols
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+if sys.version_info < (3, 7):  # pragma: no cover (module __getattr__ is not supported)
+    protocols = __getattr__('protocols')
 
 
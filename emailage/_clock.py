@@ -0,0 +1,6 @@
+"""Clock of the modules measuring intervals, such as timeouts, backoffs and rates"""
+import time
+
+
+# Not moved by changes of the system time, on the platforms which have a monotonic clock
+now = getattr(time, 'monotonic', time.time)
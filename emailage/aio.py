@@ -0,0 +1,326 @@
+"""asyncio-native counterpart of :class:`emailage.client.EmailageClient`
+
+Requires Python 3.5+ and the optional `aiohttp` dependency (``pip install emailage-official[async]``).
+"""
+import asyncio
+
+import aiohttp
+from yarl import URL
+
+from emailage import deadline as deadlines, json_backends, validation
+from emailage.cache import cache_key
+from emailage.client import ApiDomains, HttpMethods, ResponseModes, TlsVersions, _BaseClient, _create_ssl_context
+from emailage.retry import ErrorResponse
+from emailage.singleflight import FlightStats
+
+
+class AsyncSingleFlight(object):
+    """ asyncio counterpart of :class:`emailage.singleflight.SingleFlight`
+
+        The first coroutine asking for a key runs the call as a task; coroutines asking for the same key while it is
+        in flight await that task. Cancelling one of the waiters does not cancel the call for the others.
+
+        :Example:
+
+        >>> import asyncio
+        >>> from emailage.aio import AsyncSingleFlight
+        >>> async def main():
+        ...     flights = AsyncSingleFlight()
+        ...     async def fetch():
+        ...         await asyncio.sleep(0.01)
+        ...         return 'response'
+        ...     responses = await asyncio.gather(*[flights.do('test@example.com', fetch) for _ in range(3)])
+        ...     return responses, flights.stats
+        >>> asyncio.run(main())
+        (['response', 'response', 'response'], FlightStats(calls=1, coalesced=2, in_flight=0))
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._executed = 0
+        self._coalesced = 0
+
+    async def do(self, key, coroutine_function):
+        """ Awaits `coroutine_function()` unless a call for `key` is already in flight, in which case it awaits that one
+
+            :param key: hashable identity of the call
+            :param coroutine_function: function without arguments returning the coroutine making the call
+            :return: the result of the call
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(coroutine_function())
+            task.add_done_callback(lambda done_task: self._forget(key, done_task))
+            self._executed += 1
+        else:
+            self._coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Marks the exception as retrieved when every waiter was cancelled
+            task.exception()
+
+    @property
+    def stats(self):
+        return FlightStats(self._executed, self._coalesced, len(self._tasks))
+
+
+class AsyncEmailageClient(_BaseClient):
+    """ Proxy to the Emailage API for asyncio applications
+
+        Every in-flight request is a coroutine; all requests issued by one client share a single connection pool.
+        Signing and argument validation are identical to :class:`emailage.client.EmailageClient`.
+    """
+    def __init__(
+        self,
+        secret,
+        token,
+        sandbox=False,
+        tls_version=TlsVersions.TLSv1_2,
+        timeout=None,
+        http_method='GET',
+        connection_limit=100,
+        json_backend=json_backends.STDLIB,
+        response_mode=ResponseModes.DICT,
+        coalesce=False
+    ):
+        """ Creates an instance of the AsyncEmailageClient using the specified credentials and environment
+
+            :param secret: Consumer secret, e.g. SID or API key.
+            :param token: Consumer token.
+            :param sandbox:
+                (Optional) Whether to use a sandbox instead of a production server. Uses production by default
+            :param tls_version: (Optional) Uses TLS version 1.2 by default (TlsVersions.TLSv1_2 | TlsVersions.TLSv1_1)
+            :param timeout: (Optional) The total timeout in seconds to be used for sent requests
+            :param http_method: (Optional) The HTTP method (GET or POST) to be used for sending requests
+            :param connection_limit: (Optional) Maximum number of simultaneously open connections in the shared pool
+            :param json_backend:
+                (Optional) Decoder of the responses, see :func:`emailage.json_backends.get_loads`
+            :param response_mode: (Optional) Return dicts (default) or :class:`emailage.response.QueryResult` objects
+            :param coalesce:
+                (Optional) Coroutines querying what an in-flight query of the client already asks await and share its
+                response instead of sending their own
+
+            :type secret: str
+            :type token: str
+            :type sandbox: bool
+            :type tls_version: see :class:`TlsVersions`
+            :type timeout: float
+            :type http_method: see :class:`HttpMethods`
+            :type connection_limit: int
+            :type json_backend: str | callable
+            :type response_mode: see :class:`emailage.client.ResponseModes`
+            :type coalesce: bool
+
+            :Example:
+
+            >>> import asyncio
+            >>> from emailage.aio import AsyncEmailageClient
+            >>> async def main():
+            ...     async with AsyncEmailageClient('consumer_secret', 'consumer_token', sandbox=True) as client:
+            ...         return await client.query(('useremail@example.co.uk', '192.168.1.1'), urid='some_id')
+            >>> fraud_report = asyncio.run(main())
+        """
+        self._init_settings(secret, token, http_method)
+        self.sandbox = sandbox
+        self.timeout = timeout
+        self._signers = {}
+        self.connection_limit = connection_limit
+        self._json_loads = json_backends.get_loads(json_backend)
+        self.response_mode = response_mode
+        self.singleflight = AsyncSingleFlight() if coalesce else None
+        self.session = None
+        self._tls_version = tls_version
+        self.set_api_domain((sandbox and ApiDomains.sandbox or ApiDomains.production), tls_version)
+        self.set_http_method(http_method)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """ Closes the underlying connection pool. The client opens a new pool if it is used afterwards.
+
+            :return: None
+        """
+        if self.session is not None:
+            session, self.session = self.session, None
+            await session.close()
+
+    def set_api_domain(self, domain, tls_version=TlsVersions.TLSv1_2):
+        """ Explicitly set the API domain to use for a session of the client, typically used in testing scenarios.
+            The connection pool, which keeps connections per host, is kept unless the TLS version changes.
+
+            :param domain: API domain to use for the session
+            :param tls_version: (Optional) Uses TLS version 1.2 by default (TlsVersions.TLSv1_2 | TlsVersions.TLSv1_1)
+            :return: None
+
+            :type domain: str see :class: `ApiDomains`
+            :type tls_version: see :class: `TlsVersions`
+        """
+        if tls_version != self._tls_version and self.session is not None and not self.session.closed:
+            raise RuntimeError('close() the client before changing the TLS version')
+        self._update_settings(domain=domain)
+        self._tls_version = tls_version
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connection_limit,
+                                             ssl=_create_ssl_context(self._tls_version))
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 headers={'Content-Type': 'application/json'})
+        return self.session
+
+    async def _within(self, deadline, awaitable):
+        """ Awaits `awaitable`, cancelling it and raising :class:`emailage.deadline.DeadlineExceeded` at `deadline` """
+        if deadline is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, deadline.remaining())
+        except asyncio.TimeoutError:
+            # The timeout of the client raises the same error
+            deadline.check('the response arrived')
+            raise
+
+    async def request(self, endpoint, deadline=None, **params):
+        """ Base coroutine to generate requests for the Emailage validator and flagging APIs
+
+            :param endpoint: API endpoint to send the request ( '' | '/flag' )
+            :param deadline:
+                (Optional) Seconds, or :class:`emailage.deadline.Deadline`, after which the request is cancelled and
+                :class:`emailage.deadline.DeadlineExceeded` is raised
+            :param params: keyword-argument list of parameters to send with the request
+            :return: JSON dict of the response generated by the API
+
+            :type endpoint: str
+            :type deadline: float | :class:`emailage.deadline.Deadline`
+            :type params: kwargs
+        """
+        deadline = deadlines.effective(deadline)
+        if deadline is not None:
+            deadline.check('signing')
+        return await self._within(deadline, self._request(endpoint, params))
+
+    async def _request(self, endpoint, params):
+        settings = self._settings
+        url = settings.domain + '/emailagevalidator' + endpoint + '/'
+        api_params = dict(
+            format='json',
+            **params
+        )
+
+        request_params = {}
+        if self.timeout is not None:
+            request_params['timeout'] = aiohttp.ClientTimeout(total=self.timeout)
+
+        session = self._get_session()
+        if settings.http_method == HttpMethods.GET:
+            params_qs = self._signed_query_string(HttpMethods.GET, url, api_params, settings=settings)
+            response_context = session.get(URL(url + '?' + params_qs, encoded=True), **request_params)
+        else:
+            signed_url, payload = self._signed_url_and_payload(url, api_params, settings=settings)
+            response_context = session.post(URL(signed_url, encoded=True), data=payload, **request_params)
+
+        async with response_context as response:
+            if not response.ok:
+                raise ErrorResponse('No response received for request', response.status)
+            content = await response.read()
+
+        return self._decode(content)
+
+    async def query(self, query, deadline=None, **params):
+        """ Base query coroutine providing support for email, IP address, and optional additional parameters
+
+            :param query: RFC2822-compliant Email, RFC791-compliant IP, or both
+            :param deadline:
+                (Optional) Seconds, or :class:`emailage.deadline.Deadline`, after which the query is cancelled and
+                :class:`emailage.deadline.DeadlineExceeded` is raised; the earliest enclosing
+                :class:`emailage.deadline.time_budget` applies as well
+            :param params: keyword-argument form for parameters such as urid, first_name, last_name, etc.
+            :return: JSON dict of the response generated by the API
+
+            :type query: str | (str, str)
+            :type deadline: float | :class:`emailage.deadline.Deadline`
+            :type params: kwargs
+        """
+        params = self._query_params(query, params)
+        deadline = deadlines.effective(deadline)
+        if self.singleflight is None:
+            return await self.request('', **(params if deadline is None else dict(params, deadline=deadline)))
+        # Only the wait of this caller is bounded, the coalesced call goes on for the others
+        return await self._within(deadline, self.singleflight.do(cache_key(query, params)[0],
+                                                                 lambda: self.request('', **params)))
+
+    async def query_email(self, email, **params):
+        """Query a risk score information for the provided email address.
+
+            :param email: RFC2822-compliant Email
+            :param params: (Optional) keyword-argument form for parameters such as urid, first_name, last_name, etc.
+            :return: JSON dict of the response generated by the API
+        """
+        validation.assert_email(email)
+        return await self.query(email, **params)
+
+    async def query_ip_address(self, ip, **params):
+        """Query a risk score information for the provided IP address.
+
+            :param ip: RFC791-compliant IP
+            :param params: (Optional) keyword-argument form for parameters such as urid, first_name, last_name, etc.
+            :return: JSON dict of the response generated by the API
+        """
+        validation.assert_ip(ip)
+        return await self.query(ip, **params)
+
+    async def query_email_and_ip_address(self, email, ip, **params):
+        """Query a risk score information for the provided combination of an Email and IP address
+
+            :param email: RFC2822-compliant Email
+            :param ip: RFC791-compliant IP
+            :param params: (Optional) keyword-argument form for parameters such as urid, first_name, last_name, etc.
+            :return: JSON dict of the response generated by the API
+        """
+        validation.assert_email(email)
+        validation.assert_ip(ip)
+        return await self.query((email, ip), **params)
+
+    async def flag(self, flag, query, fraud_code=None):
+        """ Base coroutine used to flag an email address as fraud, good, or neutral
+
+            :param flag: type of flag you wish to associate with the identifier ( 'fraud' | 'good' | 'neutral' )
+            :param query: Email to be flagged
+            :param fraud_code:
+                (Optional) Required if flag is 'fraud', one of the IDs in `emailage.client.EmailageClient.FRAUD_CODES`
+            :return: JSON dict of the confirmation response generated by the API
+        """
+        params = self._flag_params(flag, query, fraud_code)
+        return await self.request('/flag', **params)
+
+    async def flag_as_fraud(self, query, fraud_code):
+        """Mark an email address as fraud.
+
+            :param query: Email to be flagged
+            :param fraud_code: Reason for the email to be marked as fraud; one of the IDs in `EmailageClient.FRAUD_CODES`
+            :return: JSON dict of the confirmation response generated by the API
+        """
+        return await self.flag('fraud', query, fraud_code)
+
+    async def flag_as_good(self, query):
+        """Mark an email address as good.
+
+            :param query: Email to be flagged
+            :return: JSON dict of the confirmation response generated by the API
+        """
+        return await self.flag('good', query)
+
+    async def remove_flag(self, query):
+        """Unflag an email address that was marked as good or fraud previously.
+
+            :param query: Email to be flagged
+            :return: JSON dict of the confirmation response generated by the API
+        """
+        return await self.flag('neutral', query)
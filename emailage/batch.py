@@ -0,0 +1,254 @@
+"""Concurrent execution of many API calls over one client"""
+import pickle
+
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from emailage.deadline import current_deadline, time_budget
+
+
+class BatchResult(namedtuple('BatchResult', ['query', 'response', 'error'])):
+    """ Outcome of one item of a batch: either the API `response` or the `error` raised while processing the item
+
+        :Example:
+
+        >>> from emailage.batch import BatchResult
+        >>> result = BatchResult('test@example.com', None, ValueError('test@example.com is not valid'))
+        >>> result.ok
+        False
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def split_item(item, common_params):
+    """ Splits a batch item into the query and the keyword parameters to send with it
+
+        :param item: an email, an IP, an (email, IP) tuple or a dict holding 'query' and per-item parameters
+        :param common_params: parameters sent with every item; per-item parameters take precedence
+        :return: tuple of (query, params)
+
+        :type item: str | (str, str) | dict
+        :type common_params: dict
+
+        :Example:
+
+        >>> from emailage.batch import split_item
+        >>> split_item({'query': 'test@example.com', 'urid': 'r1'}, {'user_email': 'me@example.com'})[0]
+        'test@example.com'
+    """
+    params = dict(common_params)
+    if isinstance(item, dict):
+        item = dict(item)
+        query = item.pop('query')
+        params.update(item)
+    else:
+        query = item
+    return query, params
+
+
+def run_queries(client, items, max_workers, common_params):
+    """ Runs `client.query` for every item on a thread pool and collects the results in input order
+
+        :param client: client whose session is shared by all the worker threads
+        :param items: iterable of batch items, see :func:`split_item`
+        :param max_workers: number of concurrent requests
+        :param common_params: parameters sent with every item
+        :return: list of :class:`BatchResult`, one per item, in input order
+    """
+    # The worker threads do not see the time budget of the caller
+    budget = current_deadline()
+
+    def run_one(item):
+        query = item
+        try:
+            query, params = split_item(item, common_params)
+            if budget is None:
+                return BatchResult(query, client.query(query, **params), None)
+            with time_budget(budget):
+                return BatchResult(query, client.query(query, **params), None)
+        except Exception as exc:
+            return BatchResult(query, None, exc)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        return list(executor.map(run_one, items))
+    finally:
+        executor.shutdown(wait=True)
+
+
+def imap_unordered(func, items, max_workers, max_pending=None):
+    """ Applies `func` to every item on a thread pool and yields the results as they complete
+
+        Items are pulled from `items` only while fewer than `max_pending` calls are in flight, so arbitrarily long
+        iterables are processed in constant memory. `func` is expected to report its own errors in its result.
+
+        :param func: function applied to every item
+        :param items: iterable of items, consumed lazily
+        :param max_workers: number of concurrent calls
+        :param max_pending: (Optional) maximum number of submitted calls not yet yielded, twice `max_workers` by default
+        :return: generator of the results of `func`, in completion order
+
+        :Example:
+
+        >>> from emailage.batch import imap_unordered
+        >>> sorted(imap_unordered(lambda x: x * x, range(5), max_workers=2))
+        [0, 1, 4, 9, 16]
+    """
+    max_pending = max_pending or 2 * max_workers
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = set()
+    try:
+        for item in items:
+            pending.add(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+# Task of the current worker process of :func:`imap_processes`, and the threads running it
+_worker_task = None
+_worker_executor = None
+
+
+def _init_worker(task_factory, threads):
+    global _worker_task, _worker_executor
+    _worker_task = task_factory()
+    _worker_executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+
+
+def _run_chunk(chunk):
+    if _worker_executor is None:
+        return [_worker_task(item) for item in chunk]
+    return list(_worker_executor.map(_worker_task, chunk))
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def imap_processes(task_factory, items, processes=None, threads=1, chunk_size=64, max_pending=None):
+    """ Applies a task to every item on a pool of processes and yields the results in input order
+
+        Each worker process calls `task_factory` once at start-up to build its task, e.g. a client and its
+        connection pool, then runs it on `threads` threads over chunks of `chunk_size` items. At most `max_pending`
+        chunks are in flight, so arbitrarily long iterables are processed in constant memory.
+        The task is expected to report its own errors in its result, and its results must be picklable.
+
+        :param task_factory: picklable function without arguments returning the function applied to every item
+        :param items: iterable of picklable items, consumed lazily
+        :param processes: (Optional) number of worker processes, the number of CPUs by default
+        :param threads: (Optional) number of concurrent calls within each process
+        :param chunk_size: (Optional) number of items sent to a worker at once
+        :param max_pending: (Optional) maximum number of submitted chunks not yet yielded, twice `processes` by default
+        :return: generator of the results of the task, in input order
+
+        :Example:
+
+        >>> from emailage.batch import imap_processes
+        >>> from functools import partial
+        >>> from operator import methodcaller
+        >>> list(imap_processes(partial(methodcaller, 'upper'), ['a', 'b', 'c'], processes=2))
+        ['A', 'B', 'C']
+    """
+    import multiprocessing  # only needed by the process pool, and slow to import
+
+    processes = processes or multiprocessing.cpu_count()
+    max_pending = max_pending or 2 * processes
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(task_factory, threads))
+    pending = deque()
+    completed = False
+    try:
+        for chunk in _chunks(items, chunk_size):
+            pending.append(pool.apply_async(_run_chunk, (chunk,)))
+            if len(pending) >= max_pending:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+        completed = True
+    finally:
+        if completed:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+
+def picklable_error(error):
+    """ :return: `error` if it can be sent to another process, otherwise a `RuntimeError` naming it """
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError('{}: {}'.format(type(error).__name__, error))
+
+
+class _QueryTask(object):
+    """Picklable factory of the task of :func:`run_queries_in_processes`"""
+
+    def __init__(self, config, common_params):
+        self.config = config
+        self.common_params = common_params
+
+    def __call__(self):
+        client = self.config.client
+
+        def run_one(item):
+            query = item
+            try:
+                query, params = split_item(item, self.common_params)
+                return BatchResult(query, client.query(query, **params), None)
+            except Exception as exc:
+                return BatchResult(query, None, picklable_error(exc))
+        return run_one
+
+
+def run_queries_in_processes(config, items, processes=None, threads=1, common_params=None, chunk_size=64):
+    """ Runs `query` for every item on a pool of processes, each with its own client, and collects the results
+
+        Validation, signing, decoding and the handling of results then run on all the cores instead of one. To share
+        one request budget between the processes, give the config a
+        :class:`emailage.ratelimit.SharedTokenBucket` as `rate_limiter`.
+
+        :param config: settings of the client built in each worker process
+        :param items: iterable of picklable batch items, see :func:`split_item`
+        :param processes: (Optional) number of worker processes, the number of CPUs by default
+        :param threads: (Optional) number of concurrent requests within each process
+        :param common_params: (Optional) parameters sent with every item
+        :param chunk_size: (Optional) number of items sent to a worker at once
+        :return: list of :class:`BatchResult`, one per item, in input order; errors which cannot be pickled are
+            replaced with a `RuntimeError` naming them
+
+        :type config: :class:`emailage.config.ClientConfig`
+
+        :Example:
+
+        >>> from emailage.batch import run_queries_in_processes
+        >>> from emailage.config import ClientConfig
+        >>> from emailage.ratelimit import SharedTokenBucket
+        >>> config = ClientConfig('consumer_secret', 'consumer_token', rate_limiter=SharedTokenBucket(rate=100))
+        >>> results = run_queries_in_processes(config, emails, processes=4, threads=8)
+    """
+    task_factory = _QueryTask(config, common_params or {})
+    return list(imap_processes(task_factory, items, processes, threads, chunk_size))
@@ -0,0 +1,297 @@
+"""Command line entry point scoring or flagging CSV and JSONL files in bulk
+
+Input rows are read one at a time, sent with bounded concurrency, and every result is written as soon as it
+completes, so memory use does not depend on the size of the file. Results are written as JSON lines by default::
+
+    {"row": 1, "query": "test@example.com", "response": {...}}
+    {"row": 2, "query": ["test+example.com", "1.2.3.4"], "error": "ValueError: test+example.com is not ..."}
+
+`row` is the 1-based position of the record in the input; results come out in completion order, or in input order
+with --processes, which spreads the rows over worker processes sharing the --rate budget.
+
+:Example:
+
+    $ export EMAILAGE_SECRET=... EMAILAGE_TOKEN=...
+    $ emailage-bulk query orders.csv -o scores.jsonl --email-column customer_email --ip-column ip \\
+          --param order_id=urid --param first_name=firstname --workers 16 --cache ~/.cache/emailage.sqlite3
+    $ emailage-bulk query orders.csv -o scores.jsonl --processes 4 --workers 8 --rate 100
+    $ emailage-bulk flag chargebacks.csv -o flags.jsonl --flag fraud --fraud-code-column reason_code
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+
+from emailage import batch
+from emailage.client import ApiDomains, EmailageClient, HttpMethods
+from emailage.ratelimit import SharedTokenBucket, TokenBucket
+from emailage.sqlite_cache import SQLiteResponseCache
+
+
+JSONL = 'jsonl'
+CSV = 'csv'
+
+_CSV_OUTPUT_FIELDS = ['row', 'query', 'error', 'response']
+
+
+def _detect_format(path, explicit_format):
+    if explicit_format:
+        return explicit_format
+    return CSV if path.lower().endswith('.csv') else JSONL
+
+
+def _open(path, mode):
+    if path == '-':
+        stream = sys.stdin if 'r' in mode else sys.stdout
+        return io.open(stream.fileno(), mode, encoding='utf_8', newline='', closefd=False)
+    return io.open(path, mode, encoding='utf_8_sig' if 'r' in mode else 'utf_8', newline='')
+
+
+def _parsed_csv(stream):
+    reader = csv.DictReader(stream)
+    while True:
+        try:
+            yield next(reader)
+        except StopIteration:
+            return
+        except csv.Error as exc:
+            yield exc
+
+
+def _parsed_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield exc
+
+
+def read_records(stream, input_format):
+    """ Yields (row number, record dict) for every record of a CSV file with a header line or of a JSONL file
+
+        A record which cannot be parsed is yielded as the exception of the parser, so that it is reported as a failed
+        row while the following records are still read.
+
+        :param stream: text stream to read from
+        :param input_format: 'csv' or 'jsonl'
+        :return: generator of tuples (row number, record or exception)
+    """
+    records = _parsed_csv(stream) if input_format == CSV else _parsed_jsonl(stream)
+    for row_number, record in enumerate(records, 1):
+        yield row_number, record
+
+
+class ResultWriter(object):
+    """Writes results as JSON lines, or as CSV with the response encoded as JSON"""
+
+    def __init__(self, stream, output_format):
+        self._stream = stream
+        self._csv = None
+        if output_format == CSV:
+            self._csv = csv.DictWriter(stream, _CSV_OUTPUT_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, row_number, query, response=None, error=None):
+        result = dict(row=row_number, query=query)
+        if error is not None:
+            result['error'] = '{}: {}'.format(type(error).__name__, error)
+        else:
+            result['response'] = response
+
+        if self._csv is None:
+            self._stream.write(json.dumps(result) + '\n')
+        else:
+            if type(query) is tuple:
+                result['query'] = '+'.join(query)
+            if 'response' in result:
+                result['response'] = json.dumps(result['response'])
+            self._csv.writerow(result)
+
+
+def _value(record, column):
+    value = record.get(column) if column else None
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _parse_param_mappings(mappings):
+    params = []
+    for mapping in mappings:
+        column, separator, api_param = mapping.partition('=')
+        params.append((column, api_param if separator else column))
+    return params
+
+
+def query_task(client, args):
+    """ :return: function scoring one (row number, record) pair and returning (row number, query, response, error) """
+    param_mappings = _parse_param_mappings(args.param)
+
+    def run(numbered_record):
+        row_number, record = numbered_record
+        query = None
+        try:
+            if isinstance(record, Exception):
+                raise record
+            email, ip = _value(record, args.email_column), _value(record, args.ip_column)
+            if email and ip:
+                query = (email, ip)
+            else:
+                query = email or ip
+            if query is None:
+                raise ValueError('row {} has neither an email nor an IP address'.format(row_number))
+
+            params = dict((api_param, _value(record, column)) for column, api_param in param_mappings)
+            params = dict((name, value) for name, value in params.items() if value is not None)
+            if client.cache is not None:
+                params['use_cache'] = True
+            return row_number, query, client.query(query, **params), None
+        except Exception as exc:
+            return row_number, query, None, exc
+    return run
+
+
+def flag_task(client, args):
+    """ :return: function flagging one (row number, record) pair and returning (row number, query, response, error) """
+
+    def run(numbered_record):
+        row_number, record = numbered_record
+        email = None
+        try:
+            if isinstance(record, Exception):
+                raise record
+            email = _value(record, args.email_column)
+            flag = _value(record, args.flag_column) or args.flag
+            fraud_code = _value(record, args.fraud_code_column) or args.fraud_code
+            if email is None:
+                raise ValueError('row {} has no email address'.format(row_number))
+            if flag is None:
+                raise ValueError('row {} has no flag'.format(row_number))
+            if fraud_code is not None:
+                fraud_code = int(fraud_code)
+            return row_number, email, client.flag(flag.lower(), email, fraud_code), None
+        except Exception as exc:
+            return row_number, email, None, exc
+    return run
+
+
+def _credentials(args):
+    secret = args.secret or os.environ.get('EMAILAGE_SECRET')
+    token = args.token or os.environ.get('EMAILAGE_TOKEN')
+    if not secret or not token:
+        raise SystemExit('Set the API credentials with --secret and --token, '
+                         'or with EMAILAGE_SECRET and EMAILAGE_TOKEN')
+    return secret, token
+
+
+def build_client(args):
+    """ :return: :class:`EmailageClient` configured from the command line arguments and the environment """
+    secret, token = _credentials(args)
+    rate_limiter = TokenBucket(args.rate) if args.rate else None
+    cache = None
+    if getattr(args, 'cache', None):
+        cache = SQLiteResponseCache(args.cache, ttl=args.cache_ttl, max_entries=args.cache_size)
+    client = EmailageClient(secret, token, sandbox=args.sandbox, timeout=args.timeout, http_method=args.http_method,
+                            pool_maxsize=args.workers, rate_limiter=rate_limiter, cache=cache)
+    if args.domain:
+        client.set_api_domain(args.domain)
+    return client
+
+
+class ProcessTask(object):
+    """ Picklable factory of the task run by each worker process with --processes
+
+        :param args: parsed command line arguments
+        :param rate_limiter: (Optional) :class:`emailage.ratelimit.SharedTokenBucket` replacing the per-client one
+    """
+
+    def __init__(self, args, rate_limiter=None):
+        self.args = args
+        self.rate_limiter = rate_limiter
+
+    def __call__(self):
+        client = build_client(self.args)
+        client.rate_limiter = self.rate_limiter
+        task = query_task(client, self.args) if self.args.command == 'query' else flag_task(client, self.args)
+
+        def run(numbered_record):
+            row_number, query, response, error = task(numbered_record)
+            return row_number, query, response, error if error is None else batch.picklable_error(error)
+        return run
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='emailage-bulk', description='Score or flag CSV and JSONL files in bulk.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('input', help="input file, or '-' for stdin")
+    common.add_argument('-o', '--output', default='-', help="output file, or '-' for stdout (default)")
+    common.add_argument('--input-format', choices=[CSV, JSONL], help='detected from the file extension by default')
+    common.add_argument('--output-format', choices=[CSV, JSONL], default=JSONL)
+    common.add_argument('--email-column', default='email', help="column holding the email (default 'email')")
+    common.add_argument('--workers', type=int, default=8, help='requests in flight at once (default 8)')
+    common.add_argument('--rate', type=float, help='maximum requests per second')
+    common.add_argument('--processes', type=int,
+                        help='spread the rows over worker processes, each running --workers requests at once; '
+                             'results are then written in input order')
+    common.add_argument('--secret', help='API secret, $EMAILAGE_SECRET by default')
+    common.add_argument('--token', help='API token, $EMAILAGE_TOKEN by default')
+    common.add_argument('--sandbox', action='store_true', help='target {}'.format(ApiDomains.sandbox))
+    common.add_argument('--domain', help='target another API domain')
+    common.add_argument('--http-method', choices=[HttpMethods.GET, HttpMethods.POST], default=HttpMethods.GET)
+    common.add_argument('--timeout', type=float, help='timeout of each request in seconds')
+
+    query = commands.add_parser('query', parents=[common], help='score every row')
+    query.add_argument('--ip-column', default='ip', help="column holding the IP address (default 'ip')")
+    query.add_argument('--param', action='append', default=[], metavar='COLUMN[=API_PARAM]',
+                       help='send a column as an extra API parameter, e.g. order_id=urid; repeatable')
+    query.add_argument('--cache', metavar='FILE',
+                       help='SQLite file of recent responses, reused across runs to skip queries already scored')
+    query.add_argument('--cache-ttl', type=float, default=24 * 3600,
+                       help='seconds a cached response is reused (default one day)')
+    query.add_argument('--cache-size', type=int, default=1000000, help='maximum cached responses (default 1000000)')
+
+    flag = commands.add_parser('flag', parents=[common], help='flag the email of every row')
+    flag.add_argument('--flag', choices=['fraud', 'good', 'neutral'], help='flag applied to every row')
+    flag.add_argument('--flag-column', help='column holding the flag of the row, takes precedence over --flag')
+    flag.add_argument('--fraud-code', type=int, help='fraud code applied to every row, see EmailageClient.FRAUD_CODES')
+    flag.add_argument('--fraud-code-column', help='column holding the fraud code, takes precedence over --fraud-code')
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    if args.processes:
+        _credentials(args)
+        task = ProcessTask(args, SharedTokenBucket(args.rate) if args.rate else None)
+    else:
+        client = build_client(args)
+        task = query_task(client, args) if args.command == 'query' else flag_task(client, args)
+
+    processed = failed = 0
+    with _open(args.input, 'r') as input_stream, _open(args.output, 'w') as output_stream:
+        writer = ResultWriter(output_stream, args.output_format)
+        records = read_records(input_stream, _detect_format(args.input, args.input_format))
+        if args.processes:
+            results = batch.imap_processes(task, records, args.processes, threads=args.workers)
+        else:
+            results = batch.imap_unordered(task, records, args.workers)
+        for row_number, query, response, error in results:
+            writer.write(row_number, query, response, error)
+            processed += 1
+            failed += error is not None
+
+    print('{} rows processed, {} failed'.format(processed, failed), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Caching of query responses on the client side"""
+import json
+import threading
+
+from collections import OrderedDict, namedtuple
+
+from emailage._clock import now as _now
+
+
+# Parameters which are unique per request or per record and therefore never part of a cache key
+_IGNORED_PARAMS = frozenset(['query', 'format', 'urid'])
+
+
+CacheStats = namedtuple('CacheStats', ['hits', 'misses', 'evictions', 'expirations', 'size'])
+
+
+def _normalize(value):
+    return str(value).strip().lower()
+
+
+def cache_key(query, params):
+    """ Builds the cache key and the invalidation tag for a query
+
+        The key is made of the normalized query and the extra parameters; `urid` and the OAuth1.0 fields are
+        excluded because they are unique per record or per request. The tag is the normalized email of the query,
+        if any, so that flagging an email can invalidate every cached response that mentions it.
+
+        :param query: RFC2822-compliant Email, RFC791-compliant IP, or both
+        :param params: parameters sent with the query
+        :return: tuple of (key, tag)
+
+        :type query: str | (str, str)
+        :type params: dict
+
+        :Example:
+
+        >>> from emailage.cache import cache_key
+        >>> cache_key(('Test@Example.com ', '1.2.3.4'), {'urid': 'r1', 'firstname': 'Johann'})
+        ('[["test@example.com","1.2.3.4"],[["firstname","Johann"]]]', 'test@example.com')
+    """
+    if type(query) is tuple:
+        parts = [_normalize(part) for part in query]
+    else:
+        parts = [_normalize(query)]
+    tag = parts[0] if '@' in parts[0] else None
+
+    extra = sorted((str(name), str(value)) for name, value in params.items()
+                   if name not in _IGNORED_PARAMS and not name.startswith('oauth_'))
+    key = json.dumps([parts, extra], separators=(',', ':'))
+    return key, tag
+
+
+class ResponseCache(object):
+    """ Thread-safe in-memory cache of API responses with TTL expiry and LRU eviction
+
+        Cached responses are shared between callers and must not be mutated.
+
+        :Example:
+
+        >>> from emailage.cache import ResponseCache
+        >>> cache = ResponseCache(ttl=60, max_entries=2)
+        >>> cache.put('k1', {'score': 1}, tag='test@example.com')
+        >>> cache.get('k1')
+        {'score': 1}
+        >>> cache.invalidate('test@example.com')
+        1
+        >>> cache.get('k1') is None
+        True
+    """
+
+    def __init__(self, ttl=300, max_entries=10000, clock=_now):
+        """ :param ttl: Seconds a response stays valid after it was stored
+            :param max_entries: Maximum number of stored responses; the least recently used one is evicted first
+            :param clock: (Optional) Function returning the current time in seconds
+
+            :type ttl: float
+            :type max_entries: int
+        """
+        if max_entries < 1:
+            raise ValueError('max_entries must be a positive integer. {} is given.'.format(max_entries))
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._hits = self._misses = self._evictions = self._expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """ :return: the cached response for `key`, or None if there is no fresh entry """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            value, tag, expires_at = entry
+            if expires_at <= self._clock():
+                self._remove(key)
+                self._expirations += 1
+                self._misses += 1
+                return None
+            # Re-inserting moves the key to the most recently used end
+            del self._entries[key]
+            self._entries[key] = entry
+            self._hits += 1
+            return value
+
+    def put(self, key, value, tag=None):
+        """ Stores `value` under `key`, evicting the least recently used entries when the cache is full
+
+            :param tag: (Optional) value passed to :meth:`invalidate` to drop this entry
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, tag, self._clock() + self.ttl)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def invalidate(self, tag):
+        """ Drops every entry stored with `tag`
+
+            :return: number of dropped entries
+        """
+        with self._lock:
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        """ Drops every entry; the counters are kept """
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    @property
+    def stats(self):
+        """ :return: :class:`CacheStats` snapshot of the counters and the current size """
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, self._expirations, len(self._entries))
+
+    def _remove(self, key):
+        value, tag, expires_at = self._entries.pop(key)
+        if tag is not None:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
@@ -1,39 +1,47 @@
-import json
-import ssl
-import sys
-import urllib
+import threading
 
-from requests import Session
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.poolmanager import PoolManager
+from collections import OrderedDict, namedtuple
 
-from emailage import signature, validation
-from emailage.signature import safety_quote
+from emailage import deadline as deadlines, json_backends, metrics, signature, validation
+from emailage.cache import cache_key
+from emailage.ratelimit import RateLimitExceeded
+from emailage.retry import ErrorResponse, RequestCancelled
+from emailage.response import QueryResult
+from emailage.singleflight import SingleFlight
 
 
-use_urllib_quote = hasattr(urllib, 'quote')
-
-
-if use_urllib_quote:
-    def _url_encode_dict(qs_dict):
-        return '&'.join(map(lambda pair: '='.join([urllib.quote(str(pair[0]), ''), urllib.quote(str(pair[1]), '')]),
-                            sorted(qs_dict.items())))
-elif sys.version_info >= (3, 5):
-    # Python >= 3.5
-    def _url_encode_dict(qs_dict):
-        return urllib.parse.urlencode(qs_dict, quote_via=urllib.parse.quote)
-else:
-    # Python 3.x - 3.4
-    def _url_encode_dict(qs_dict):
-        return '&'.join(map(lambda pair: '='.join([urllib.parse.quote(str(pair[0]), ''),
-                                                   urllib.parse.quote(str(pair[1]), '')]),
-                            sorted(qs_dict.items())))
+def _url_encode_dict(qs_dict):
+    return signature.EncodedParams(qs_dict).wire()
 
 
 class TlsVersions:
     """An enumeration of the TLS versions supported by the Emailage API"""
-    TLSv1_1 = ssl.PROTOCOL_TLSv1_1
-    TLSv1_2 = ssl.PROTOCOL_TLSv1_2
+    # Equal to ssl.PROTOCOL_TLSv1_1 and ssl.PROTOCOL_TLSv1_2; `ssl` is only imported once a connection is opened
+    TLSv1_1 = 4
+    TLSv1_2 = 5
+
+
+def _create_ssl_context(tls_version):
+    """Builds a verifying SSL context pinned to the requested TLS version, mirroring `EmailageClient.Adapter`"""
+    import ssl
+    context = ssl.create_default_context()
+    pinned_version = {
+        TlsVersions.TLSv1_1: ssl.TLSVersion.TLSv1_1,
+    }.get(tls_version, ssl.TLSVersion.TLSv1_2)
+    context.minimum_version = pinned_version
+    context.maximum_version = pinned_version
+    return context
+
+
+class Transports:
+    """HTTP transports the client can send its requests with"""
+    HTTP1 = 'http/1.1'
+    # Negotiated through ALPN, falling back to HTTP/1.1 for servers which do not offer it
+    HTTP2 = 'h2'
+    # HTTP/2 without TLS nor negotiation, for plain-HTTP servers known to speak it such as the stub server
+    H2C = 'h2c'
+    # HTTP/2 when the optional `httpcore[asyncio,http2]` dependency is installed, HTTP/1.1 otherwise
+    AUTO = 'auto'
 
 
 class ApiDomains:
@@ -48,8 +56,23 @@ class HttpMethods:
     POST = 'POST'
 
 
-class EmailageClient:
-    """ Primary proxy to the Emailage API for end-users of the package"""
+class ResponseModes:
+    """Shapes in which the client returns responses"""
+    DICT = 'dict'
+    OBJECT = 'object'
+
+
+class ClientSettings(namedtuple('ClientSettings', ['secret', 'token', 'hmac_key', 'domain', 'http_method'])):
+    """ Immutable snapshot of the credentials, API domain and HTTP method a request is sent with
+
+        Each request reads the snapshot of its client once, so that concurrent calls of `set_credentials`,
+        `set_api_domain` or `set_http_method` never mix the old and new settings in one request.
+    """
+    __slots__ = ()
+
+
+class _BaseClient(object):
+    """Credential, signing and argument handling shared by the synchronous and asyncio clients"""
     FRAUD_CODES = {
         1: 'Card Not Present Fraud',
         2: 'Customer Dispute (Chargeback)',
@@ -62,18 +85,182 @@ class EmailageClient:
         9: 'Other'
     }
 
-    class Adapter(HTTPAdapter):
-        def __init__(self, tls_version=TlsVersions.TLSv1_2):
-            self._tls_version = tls_version
-            self.poolmanager = None
-            super(EmailageClient.Adapter, self).__init__()
+    def _init_settings(self, secret, token, http_method):
+        self._settings_lock = threading.Lock()
+        self._settings = ClientSettings(secret, token, token + '&', None, http_method.upper())
+
+    def _update_settings(self, **changes):
+        if 'token' in changes:
+            changes['hmac_key'] = changes['token'] + '&'
+        # Writers are serialized; readers pick up the old or the new snapshot, never a mix of both
+        with self._settings_lock:
+            self._settings = self._settings._replace(**changes)
+
+    @property
+    def settings(self):
+        """ :return: :class:`ClientSettings` the next request will be sent with """
+        return self._settings
+
+    @property
+    def secret(self):
+        return self._settings.secret
+
+    @property
+    def token(self):
+        return self._settings.token
+
+    @property
+    def hmac_key(self):
+        return self._settings.hmac_key
+
+    @property
+    def domain(self):
+        return self._settings.domain
+
+    def set_credentials(self, secret, token):
+        """ Explicitly set the authentication credentials to be used when generating a request in the current session.
+            Useful when you want to change credentials after initial creation of the client.
+
+            The change is atomic: requests in flight complete with the former credentials, and the connection pool
+            is kept.
+
+            :param secret: Consumer secret, e.g. SID or API key
+            :param token: Consumer token
+            :return: None
+
+        """
+        self._update_settings(secret=secret, token=token)
+        self._signers = {}
+
+    def set_http_method(self, http_method):
+        """ Explicitly set the Http method (GET or POST) through which you will be sending the request. This method
+            will be used for any future calls made with this instance of the client until another method is specified
+
+            :param http_method: HttpMethod to use for sending requests
+            :return: None
 
-        def init_poolmanager(self, connections, maxsize, block=False):
-            self.poolmanager = PoolManager(
-                num_pools=connections,
-                maxsize=maxsize,
-                block=block,
-                ssl_version=self._tls_version)
+            :type http_method: str see :class: `HttpMethods`
+
+            :Example:
+
+            >>> from emailage.client import EmailageClient, HttpMethods
+            >>> client = EmailageClient('consumer_secret', 'consumer_token')
+            >>> client.set_http_method(HttpMethods.POST)
+            >>> client.http_method
+            'POST'
+        """
+        if not http_method:
+            raise TypeError('http_method must be a string with the value GET or SET')
+
+        if not http_method.upper() == HttpMethods.GET and not http_method.upper() == HttpMethods.POST:
+            raise ValueError('http_method must be a string with the value GET or SET')
+
+        self._update_settings(http_method=http_method.upper())
+
+    @property
+    def http_method(self):
+        return self._settings.http_method
+
+    def _decode(self, content):
+        if self.response_mode == ResponseModes.OBJECT:
+            return QueryResult.from_bytes(content, self._json_loads)
+        return self._json_loads(content)
+
+    def _signer(self, hmac_key, method, url):
+        signer = self._signers.get((hmac_key, method, url))
+        if signer is None:
+            signer = self._signers[(hmac_key, method, url)] = signature.Signer(hmac_key, method, url)
+        return signer
+
+    def _signed_query_string(self, method, url, api_params, trace=None, settings=None):
+        settings = settings or self._settings
+        api_params = signature.add_oauth_entries_to_fields_dict(settings.secret, api_params)
+        # The parameters are quoted once, for the signature and for the query string
+        encoded = signature.EncodedParams(api_params)
+        encoded.add('oauth_signature', self._signer(settings.hmac_key, method, url).sign_encoded(encoded))
+        if trace is not None:
+            trace.lap(metrics.SIGN)
+
+        query_string = encoded.wire()
+        if trace is not None:
+            trace.lap(metrics.ENCODE)
+        return query_string
+
+    def _signed_url_and_payload(self, url, api_params, trace=None, settings=None):
+        signed_url = url + '?' + self._signed_query_string(HttpMethods.POST, url, dict(format='json'), trace, settings)
+        payload = signature.EncodedParams(api_params).canonical().encode('ascii')
+        if trace is not None:
+            trace.lap(metrics.ENCODE)
+
+        return signed_url, payload
+
+    @staticmethod
+    def _assemble_quoted_pairs(kv_pairs):
+        return signature.EncodedParams(kv_pairs).canonical()
+
+    @staticmethod
+    def _query_params(query, params):
+        if type(query) is tuple:
+            validation.assert_email(query[0])
+            validation.assert_ip(query[1])
+            query = '+'.join(query)
+        params['query'] = query
+        return params
+
+    @classmethod
+    def _flag_params(cls, flag, query, fraud_code=None):
+        flags = ['fraud', 'neutral', 'good']
+        if flag not in flags:
+            raise ValueError(validation.Messages.FLAG_NOT_ALLOWED_FORMAT.format(', '.join(flags), flag))
+
+        validation.assert_email(query)
+
+        params = dict(flag=flag, query=query)
+
+        if flag == 'fraud':
+            codes = cls.FRAUD_CODES
+            if type(fraud_code) is not int:
+                raise ValueError(
+                    validation.Messages.FRAUD_CODE_RANGE_FORMAT.format(
+                        len(codes), ', '.join(codes.values()), fraud_code)
+                )
+            if fraud_code not in range(1, len(codes) + 1):
+                fraud_code = 9
+            params['fraudcodeID'] = fraud_code
+
+        return params
+
+
+def _resolve_transport(transport):
+    if transport == Transports.AUTO:
+        try:
+            import anyio  # noqa: F401
+            import h2  # noqa: F401
+            import httpcore  # noqa: F401
+        except ImportError:
+            return Transports.HTTP1
+        return Transports.HTTP2
+    if transport not in (Transports.HTTP1, Transports.HTTP2, Transports.H2C):
+        raise ValueError('transport must be one of {}. {} is given.'.format(
+            ', '.join(repr(value) for value in (Transports.HTTP1, Transports.HTTP2, Transports.H2C, Transports.AUTO)),
+            transport))
+    return transport
+
+
+class _AdapterClass(object):
+    """Class attribute resolving to :class:`emailage.pooling.PinnedTlsAdapter`, which needs `requests` to be defined"""
+
+    def __get__(self, instance, owner):
+        from emailage.pooling import PinnedTlsAdapter
+        return PinnedTlsAdapter
+
+
+class EmailageClient(_BaseClient):
+    """ Primary proxy to the Emailage API for end-users of the package
+
+        The HTTP stack is loaded, and the session created, when the first request is sent.
+    """
+    Adapter = _AdapterClass()
 
     def __init__(
         self,
@@ -82,7 +269,22 @@ class EmailageClient:
         sandbox=False,
         tls_version=TlsVersions.TLSv1_2,
         timeout=None,
-        http_method='GET'
+        http_method='GET',
+        cache=None,
+        pool_connections=10,
+        pool_maxsize=10,
+        pool_block=False,
+        tcp_keepalive_idle=None,
+        retry_policy=None,
+        circuit_breaker=None,
+        rate_limiter=None,
+        rate_limit_timeout=None,
+        json_backend=json_backends.STDLIB,
+        response_mode=ResponseModes.DICT,
+        metrics=None,
+        coalesce=False,
+        transport=Transports.HTTP1,
+        hedging=None
     ):
         """ Creates an instance of the EmailageClient using the specified credentials and environment
 
@@ -93,6 +295,39 @@ class EmailageClient:
             :param tls_version: (Optional) Uses TLS version 1.2 by default (TlsVersions.TLSv1_2 | TlsVersions.TLSv1_1)
             :param timeout: (Optional) The timeout to be used for sent requests
             :param http_method: (Optional) The HTTP method (GET or POST) to be used for sending requests
+            :param cache: (Optional) Cache for responses of queries sent with `use_cache=True`
+            :param pool_connections: (Optional) Number of host connection pools to keep, 10 by default
+            :param pool_maxsize:
+                (Optional) Connections kept open for reuse per host, 10 by default. Size it to the number of threads
+                sharing the client; connections opened beyond it are discarded after use
+            :param pool_block: (Optional) Wait for a free connection instead of opening one beyond `pool_maxsize`
+            :param tcp_keepalive_idle:
+                (Optional) Seconds of inactivity after which TCP keep-alive probes are sent on pooled connections
+            :param retry_policy: (Optional) Retries queries which fail with a transient error, freshly signed each time
+            :param circuit_breaker: (Optional) Fails requests fast while the API is unhealthy
+            :param rate_limiter: (Optional) Throttles requests before they are sent; may be shared between clients
+            :param rate_limit_timeout:
+                (Optional) Maximum seconds a request waits for the rate limiter before RateLimitExceeded is raised;
+                requests wait as long as needed by default
+            :param json_backend:
+                (Optional) Decoder of the responses: 'json' (default), 'orjson', 'ujson', 'auto' for the fastest
+                installed one, or a function decoding bytes
+            :param response_mode:
+                (Optional) ResponseModes.DICT returns responses as dicts (default); ResponseModes.OBJECT returns compact
+                :class:`emailage.response.QueryResult` objects keeping the common fields, and decoding the full
+                document again on first access
+            :param metrics: (Optional) Registry recording the latency of every stage of the requests, statuses,
+                retries and bytes; may be shared between clients
+            :param coalesce:
+                (Optional) Threads querying what an in-flight query of the client already asks wait for and share
+                its response instead of sending their own; the key is the one of the cache
+            :param transport:
+                (Optional) Transports.HTTP1 (default) sends requests with `requests`; Transports.HTTP2 multiplexes
+                concurrent requests over a few connections, negotiated through ALPN with a fallback to HTTP/1.1, and
+                requires the optional `httpcore[asyncio,http2]` dependency (``pip install emailage-official[http2]``)
+            :param hedging:
+                (Optional) Sends a second attempt of the queries which are slower than usual and keeps the first
+                response; may be shared between clients
 
             :type secret: str
             :type token: str
@@ -100,6 +335,21 @@ class EmailageClient:
             :type tls_version: see :class:`TlsVersions`
             :type timeout: float
             :type http_method: see :class:`HttpMethods`
+            :type cache: see :class:`emailage.cache.ResponseCache`
+            :type pool_connections: int
+            :type pool_maxsize: int
+            :type pool_block: bool
+            :type tcp_keepalive_idle: int
+            :type retry_policy: see :class:`emailage.retry.RetryPolicy`
+            :type circuit_breaker: see :class:`emailage.retry.CircuitBreaker`
+            :type rate_limiter: see :class:`emailage.ratelimit.TokenBucket`
+            :type rate_limit_timeout: float
+            :type json_backend: str | callable
+            :type response_mode: see :class:`ResponseModes`
+            :type metrics: see :class:`emailage.metrics.MetricsRegistry`
+            :type coalesce: bool
+            :type transport: see :class:`Transports`
+            :type hedging: see :class:`emailage.hedging.HedgingPolicy`
 
             :Example:
 
@@ -116,37 +366,83 @@ class EmailageClient:
             ...                         'consumer_token', sandbox=True, timeout=300)
             >>> fraud_report = client.query(('useremail@example.co.uk', '192.168.1.1'), urid='some_unique_identifier')
 
-        """
-        self.secret, self.token, self.sandbox = secret, token, sandbox
-        self.timeout = timeout
-        self.hmac_key = token + '&'
-        self.session = None
-        self.domain = None
-        self.set_api_domain((sandbox and ApiDomains.sandbox or ApiDomains.production), tls_version)
-        self._http_method = http_method.upper()
+            :Example:
 
-    def set_credentials(self, secret, token):
-        """ Explicitly set the authentication credentials to be used when generating a request in the current session.
-            Useful when you want to change credentials after initial creation of the client.
+            >>> from emailage.cache import ResponseCache
+            >>> from emailage.client import EmailageClient
+            >>> client = EmailageClient('consumer_secret', 'consumer_token', cache=ResponseCache(ttl=600))
+            >>> fraud_report = client.query('useremail@example.co.uk', use_cache=True)
 
-            :param secret: Consumer secret, e.g. SID or API key
-            :param token: Consumer token
-            :return: None
+            :Example:
+
+            >>> from emailage.client import EmailageClient
+            >>> from emailage.ratelimit import TokenBucket
+            >>> contract = TokenBucket(rate=20, capacity=5)
+            >>> client = EmailageClient('consumer_secret', 'consumer_token', rate_limiter=contract)
+            >>> other_client = EmailageClient('other_secret', 'other_token', rate_limiter=contract)
+
+            :Example:
+
+            >>> from emailage.client import EmailageClient
+            >>> from emailage.metrics import MetricsRegistry
+            >>> client = EmailageClient('consumer_secret', 'consumer_token', metrics=MetricsRegistry())
+            >>> client.response_hooks.append(lambda trace, response: print(trace.endpoint, trace.stages))
+            >>> fraud_report = client.query('useremail@example.co.uk')
+            /emailagevalidator/ {'sign': 2.1e-05, 'encode': 6e-06, 'network': 0.31, 'decode': 4.2e-05}
+
+            :Example:
+
+            >>> from emailage.client import EmailageClient, Transports
+            >>> client = EmailageClient('consumer_secret', 'consumer_token', transport=Transports.HTTP2, pool_maxsize=2)
+            >>> responses = client.query_many(emails, max_workers=64)
 
         """
-        self.secret = secret
-        self.token = token
-        self.hmac_key = token + '&'
+        self._init_settings(secret, token, http_method)
+        self.sandbox = sandbox
+        self.timeout = timeout
+        self.cache = cache
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.rate_limiter = rate_limiter
+        self.rate_limit_timeout = rate_limit_timeout
+        self._json_loads = json_backends.get_loads(json_backend)
+        self.response_mode = response_mode
+        self.metrics = metrics
+        self.singleflight = SingleFlight() if coalesce else None
+        self.hedging = hedging
+        self.request_hooks = []
+        self.response_hooks = []
+        self._signers = {}
+        self.transport = _resolve_transport(transport)
+        self._session = None
+        self._adapter_options = {}
+        self.pool_options = dict(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                 pool_block=pool_block, tcp_keepalive_idle=tcp_keepalive_idle)
+        self.set_api_domain((sandbox and ApiDomains.sandbox or ApiDomains.production), tls_version)
 
-    def set_api_domain(self, domain, tls_version=TlsVersions.TLSv1_2):
+    def set_api_domain(self, domain, tls_version=TlsVersions.TLSv1_2, pool_connections=None, pool_maxsize=None,
+                       pool_block=None, tcp_keepalive_idle=None):
         """ Explicitly set the API domain to use for a session of the client, typically used in testing scenarios
 
+            The session and the connection pools of the domains used before are kept, so that switching back and
+            forth does not reconnect; the pool of a domain is only replaced when its TLS version or pool options change.
+            Requests in flight complete against the former domain. With an HTTP/2 transport, `pool_maxsize` bounds the
+            connections per host, each carrying many concurrent requests, and `pool_connections` is not used.
+
             :param domain: API domain to use for the session
             :param tls_version: (Optional) Uses TLS version 1.2 by default (TlsVersions.TLSv1_2 | TlsVersions.TLSv1_1)
+            :param pool_connections: (Optional) Number of host connection pools to keep; unchanged if not given
+            :param pool_maxsize: (Optional) Connections kept open for reuse per host; unchanged if not given
+            :param pool_block: (Optional) Wait for a free connection when the pool is exhausted; unchanged if not given
+            :param tcp_keepalive_idle: (Optional) Seconds before TCP keep-alive probes start; unchanged if not given
             :return: None
 
             :type domain: str see :class: `ApiDomains`
             :type tls_version: see :class: `TlsVersions`
+            :type pool_connections: int
+            :type pool_maxsize: int
+            :type pool_block: bool
+            :type tcp_keepalive_idle: int
 
             :Example:
 
@@ -164,51 +460,105 @@ class EmailageClient:
             >>> client.set_api_domain('https://testing.emailage.com')
             >>> client.domain
             'https://testing.emailage.com'
-        """
-        self.session = Session()
-        self.session.headers.update({
-            'Content-Type': 'application/json'
-        })
-        self.domain = domain
-        self.session.mount(self.domain, EmailageClient.Adapter(tls_version))
-
-    def set_http_method(self, http_method):
-        """ Explicitly set the Http method (GET or POST) through which you will be sending the request. This method
-            will be used for any future calls made with this instance of the client until another method is specified
-
-            :param http_method: HttpMethod to use for sending requests
-            :return: None
-
-            :type http_method: str see :class: `HttpMethods`
 
             :Example:
 
-            >>> from emailage.client import EmailageClient, HttpMethods
+            >>> from emailage.client import EmailageClient
             >>> client = EmailageClient('consumer_secret', 'consumer_token')
-            >>> client.set_http_method(HttpMethods.POST)
-            >>> client.http_method
-            'POST'
+            >>> client.set_api_domain('https://testing.emailage.com', pool_maxsize=32, pool_block=True)
+            >>> client.pool_stats()
+            PoolStats(in_use=0, idle=0, created=0, discarded=0)
         """
-        if not http_method:
-            raise TypeError('http_method must be a string with the value GET or SET')
-
-        if not http_method.upper() == HttpMethods.GET and not http_method.upper() == HttpMethods.POST:
-            raise ValueError('http_method must be a string with the value GET or SET')
-
-        self._http_method = http_method.upper()
+        overrides = dict(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                         pool_block=pool_block, tcp_keepalive_idle=tcp_keepalive_idle)
+        with self._settings_lock:
+            self.pool_options.update((name, value) for name, value in overrides.items() if value is not None)
+            adapter_options = (tls_version, tuple(sorted(self.pool_options.items())))
+            # Until the session is created on first use, the options are only recorded
+            if self.transport != Transports.HTTP1:
+                # One HTTP/2 session holds the connections of every domain; a replaced session is closed once the
+                # requests in flight on it have completed
+                if self._adapter_options.get(None) != adapter_options:
+                    self._adapter_options[None] = adapter_options
+                    if self._session is not None:
+                        replaced, self._session = self._session, self._create_http2_session(adapter_options)
+                        replaced.close(wait=True)
+            elif self._adapter_options.get(domain) != adapter_options:
+                self._adapter_options[domain] = adapter_options
+                if self._session is not None:
+                    self._mount(domain, self._create_adapter(adapter_options))
+            self._settings = self._settings._replace(domain=domain)
 
     @property
-    def http_method(self):
-        return self._http_method
+    def session(self):
+        """ :return: `requests.Session`, or :class:`emailage.http2.Http2Session` with an HTTP/2 transport, sending
+            the requests of the client; created on first use
+        """
+        session = self._session
+        if session is None:
+            with self._settings_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+                session = self._session
+        return session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+
+    def _create_session(self):
+        if self.transport != Transports.HTTP1:
+            return self._create_http2_session(self._adapter_options[None])
+        from requests import Session
+        session = Session()
+        session.headers.update({
+            'Content-Type': 'application/json'
+        })
+        for domain, adapter_options in self._adapter_options.items():
+            session.mount(domain, self._create_adapter(adapter_options))
+        return session
+
+    @staticmethod
+    def _create_adapter(adapter_options):
+        tls_version, pool_options = adapter_options
+        return EmailageClient.Adapter(tls_version, **dict(pool_options))
+
+    def _create_http2_session(self, adapter_options):
+        from emailage.http2 import Http2Session
+        tls_version, pool_options = adapter_options
+        return Http2Session(tls_version, prior_knowledge=self.transport == Transports.H2C, **dict(pool_options))
+
+    def _mount(self, prefix, adapter):
+        # Same ordering as Session.mount, applied to a copy swapped in at once, since other threads may be
+        # looking up adapters; a replaced adapter is left open for the requests in flight on it
+        adapters = OrderedDict(self._session.adapters)
+        adapters[prefix] = adapter
+        for key in [key for key in adapters if len(key) < len(prefix)]:
+            adapters[key] = adapters.pop(key)
+        self._session.adapters = adapters
+
+    def pool_stats(self):
+        """ Live statistics of the connection pool used for the API domain
+
+            :return: connections in use, idle, created and discarded since the domain was set
+            :rtype: :class:`emailage.pooling.PoolStats`
+        """
+        if self.transport != Transports.HTTP1:
+            return self.session.pool_stats
+        return self.session.get_adapter(self.domain).pool_stats
 
-    def request(self, endpoint, **params):
+    def request(self, endpoint, deadline=None, **params):
         """ Base method to generate requests for the Emailage validator and flagging APIs
 
             :param endpoint: API endpoint to send the request ( '' | '/flag' )
+            :param deadline:
+                (Optional) Seconds, or :class:`emailage.deadline.Deadline`, within which the request must complete,
+                retries included; :class:`emailage.deadline.DeadlineExceeded` is raised once it has passed
             :param params: keyword-argument list of parameters to send with the request
             :return: JSON dict of the response generated by the API
 
             :type endpoint: str
+            :type deadline: float | :class:`emailage.deadline.Deadline`
             :type params: kwargs
 
             :Example:
@@ -219,7 +569,9 @@ class EmailageClient:
             >>> response['query']['email']
             'user20180830001%40domain20180830001.com'
         """
-        url = self.domain + '/emailagevalidator' + endpoint + '/'
+        settings = self._settings
+        deadline = deadlines.effective(deadline)
+        url = settings.domain + '/emailagevalidator' + endpoint + '/'
         api_params = dict(
             format='json',
             **params
@@ -229,56 +581,149 @@ class EmailageClient:
         if self.timeout is not None and 'timeout':
             request_params['timeout'] = self.timeout
 
-        if self.http_method == HttpMethods.GET:
-            response = self._perform_get_request(url, api_params, request_params)
+        # Instrumentation is skipped entirely unless a registry or a hook is set
+        trace = None
+        if self.metrics is not None or self.request_hooks or self.response_hooks:
+            for hook in self.request_hooks:
+                hook(endpoint, api_params)
+            trace = metrics.RequestTrace('/emailagevalidator' + endpoint + '/', settings.http_method)
+
+        # Only queries are idempotent; a flag is sent once
+        if self.hedging is not None and endpoint == '':
+            def send(attempt_trace, on_start):
+                attempt_params = dict(request_params, on_start=on_start)
+                return self._send(url, dict(api_params), attempt_params, attempt_trace, settings, deadline)
+
+            def attempt():
+                return self.hedging.run(send, trace, deadline)
         else:
-            response = self._perform_post_request(url, api_params, request_params)
-
-        if not response:
-            raise ValueError('No response received for request')
-
-        # Explicit encoding is necessary because the API returns a Byte Order Mark at the beginning of the contents
-        json_data = response.content.decode(encoding='utf_8_sig')
-        return json.loads(json_data)
-
-    def _perform_get_request(self, url, api_params, request_params=None):
-
-        api_params = signature.add_oauth_entries_to_fields_dict(self.secret, api_params)
-        api_params['oauth_signature'] = signature.create(HttpMethods.GET, url, api_params, self.hmac_key)
-
-        params_qs = _url_encode_dict(api_params)
+            def attempt():
+                return self._send(url, dict(api_params), request_params, trace, settings, deadline)
+
+        try:
+            try:
+                if self.retry_policy is not None and endpoint == '':
+                    response = self.retry_policy.run(attempt, None if trace is None else trace.count_retry, deadline)
+                else:
+                    response = attempt()
+            except Exception:
+                # Timeouts capped by the deadline are reported as its expiry
+                if deadline is not None:
+                    deadline.check('the response arrived')
+                raise
+
+            # A response which arrived late is dropped rather than decoded
+            if deadline is not None:
+                deadline.check('decoding')
+            if not response:
+                raise ErrorResponse('No response received for request', getattr(response, 'status_code', None))
+
+            if trace is None:
+                return self._decode(response.content)
+            trace.mark()
+            decoded = self._decode(response.content)
+            trace.lap(metrics.DECODE)
+        except Exception as exc:
+            if trace is not None:
+                self._finish_trace(trace, None, exc)
+            raise
+        self._finish_trace(trace, response)
+        return decoded
+
+    def _finish_trace(self, trace, response, error=None):
+        trace.finish(error)
+        if self.metrics is not None:
+            self.metrics.record(trace)
+        for hook in self.response_hooks:
+            hook(trace, response)
+
+    def _send(self, url, api_params, request_params, trace=None, settings=None, deadline=None):
+        if deadline is not None:
+            deadline.check('sending')
+            request_params = self._deadline_request_params(request_params, deadline)
+        if trace is not None:
+            trace.mark()
+        if self.rate_limiter is not None:
+            timeout = self.rate_limit_timeout if deadline is None else deadline.cap(self.rate_limit_timeout)
+            if not self.rate_limiter.acquire(timeout=timeout):
+                if deadline is not None:
+                    deadline.check('a request token became available')
+                raise RateLimitExceeded('No request token became available within {} seconds'
+                                        .format(self.rate_limit_timeout))
+            if trace is not None:
+                trace.lap(metrics.THROTTLE)
+            if deadline is not None:
+                request_params = self._deadline_request_params(request_params, deadline)
+
+        breaker = self.circuit_breaker
+        if breaker is None:
+            return self._perform_request(url, api_params, request_params, trace, settings)
+
+        breaker.before_request()
+        try:
+            response = self._perform_request(url, api_params, request_params, trace, settings)
+        except RequestCancelled:
+            breaker.release()
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_response(response)
+        return response
+
+    def _deadline_request_params(self, request_params, deadline):
+        # requests bounds every socket operation by the remaining time. A read timeout fails every stream of an HTTP/2
+        # connection, so the HTTP/2 session keeps the timeout of the client and stops waiting at the deadline instead
+        if self.transport != Transports.HTTP1:
+            return dict(request_params, deadline=deadline)
+        return dict(request_params, timeout=deadline.cap(request_params.get('timeout')))
+
+    def _perform_request(self, url, api_params, request_params, trace=None, settings=None):
+        # The HTTP/2 session abandons requests itself; over HTTP/1.1 the socket of the connection is shut down
+        if self.transport == Transports.HTTP1 and 'on_start' in request_params:
+            request_params = dict(request_params)
+            from emailage.pooling import CancelScope
+            with CancelScope(request_params.pop('on_start')):
+                return self._perform_request(url, api_params, request_params, trace, settings)
+        settings = settings or self._settings
+        if settings.http_method == HttpMethods.GET:
+            return self._perform_get_request(url, api_params, request_params, trace, settings)
+        return self._perform_post_request(url, api_params, request_params, trace, settings)
+
+    def _perform_get_request(self, url, api_params, request_params=None, trace=None, settings=None):
+        params_qs = self._signed_query_string(HttpMethods.GET, url, api_params, trace, settings)
         request_params = request_params or {}
 
         res = self.session.get(url, params=params_qs, **request_params)
+        if trace is not None:
+            trace.lap(metrics.NETWORK)
+            trace.count_response(res, len(params_qs))
         return res
 
-    def _perform_post_request(self, url, api_params, request_params=None):
-        signature_fields = dict(format='json')
-
-        signature_fields = signature.add_oauth_entries_to_fields_dict(self.secret, signature_fields)
-
-        signature_fields['oauth_signature'] = signature.create(HttpMethods.POST, url, signature_fields, self.hmac_key)
-        url = url + '?' + _url_encode_dict(signature_fields)
-
-        payload = self._assemble_quoted_pairs(api_params).encode('utf_8')
+    def _perform_post_request(self, url, api_params, request_params=None, trace=None, settings=None):
+        url, payload = self._signed_url_and_payload(url, api_params, trace, settings)
 
         res = self.session.post(url, data=payload, **request_params)
+        if trace is not None:
+            trace.lap(metrics.NETWORK)
+            trace.count_response(res, len(url) + len(payload))
         return res
 
-    @staticmethod
-    def _assemble_quoted_pairs(kv_pairs):
-        return '&'.join(map(lambda pair: '='.join([safety_quote(pair[0]),
-                                                   safety_quote(pair[1])]),
-                            sorted(kv_pairs.items())))
-
-    def query(self, query, **params):
+    def query(self, query, use_cache=False, deadline=None, **params):
         """ Base query method providing support for email, IP address, and optional additional parameters
 
             :param query: RFC2822-compliant Email, RFC791-compliant IP, or both
+            :param use_cache: (Optional) Serve the response from the cache of the client when a fresh one is stored
+            :param deadline:
+                (Optional) Seconds, or :class:`emailage.deadline.Deadline`, within which the query must complete,
+                retries and waits for a coalesced query included; the earliest enclosing
+                :class:`emailage.deadline.time_budget` applies as well
             :param params: keyword-argument form for parameters such as urid, first_name, last_name, etc.
             :return: JSON dict of the response generated by the API
 
             :type query: str | (str, str)
+            :type use_cache: bool
+            :type deadline: float | :class:`emailage.deadline.Deadline`
             :type params: kwargs
 
             :Example:
@@ -294,13 +739,32 @@ class EmailageClient:
             >>> response_json = client.query(('test@example.com', '209.85.220.41'))
             >>> # Pass a User Defined Record ID (URID) as an optional parameter
             >>> response_json = client.query('test@example.com', urid='My record ID for test@example.com')
+            >>> # Give up after 300 ms, raising emailage.deadline.DeadlineExceeded
+            >>> response_json = client.query('test@example.com', deadline=0.3)
         """
-        if type(query) is tuple:
-            validation.assert_email(query[0])
-            validation.assert_ip(query[1])
-            query = '+'.join(query)
-        params['query'] = query
-        return self.request('', **params)
+        params = self._query_params(query, params)
+        deadline = deadlines.effective(deadline)
+        request_params = params if deadline is None else dict(params, deadline=deadline)
+        cache = self.cache if use_cache else None
+        if cache is None and self.singleflight is None:
+            return self.request('', **request_params)
+
+        key, tag = cache_key(query, params)
+        if cache is not None:
+            response = cache.get(key)
+            if response is not None:
+                return response
+
+        def fetch(request_params):
+            response = self.request('', **request_params)
+            if cache is not None:
+                cache.put(key, response, tag)
+            return response
+
+        if self.singleflight is None:
+            return fetch(request_params)
+        # Only the wait of this caller is bounded, the coalesced call goes on for the others
+        return self.singleflight.do(key, lambda: fetch(params), None if deadline is None else deadline.remaining())
 
     def query_email(self, email, **params):
         """Query a risk score information for the provided email address.
@@ -371,6 +835,33 @@ class EmailageClient:
         validation.assert_ip(ip)
         return self.query((email, ip), **params)
 
+    def query_many(self, items, max_workers=10, **common_params):
+        """ Run many queries concurrently over the session of this client
+
+            A failing item does not stop the batch: the exception it raised, e.g. a ValueError for an invalid
+            address, is reported in its result instead.
+
+            :param items: emails, IPs, (email, IP) tuples, or dicts holding 'query' and per-item parameters
+            :param max_workers: (Optional) Number of requests in flight at once, 10 by default
+            :param common_params: (Optional) keyword-argument form for parameters sent with every item
+            :return: list of :class:`emailage.batch.BatchResult` in the order of `items`
+
+            :type items: iterable
+            :type max_workers: int
+            :type common_params: kwargs
+
+            :Example:
+
+            >>> from emailage.client import EmailageClient
+            >>> client = EmailageClient('My account SID', 'My auth token', sandbox=True)
+            >>> results = client.query_many(['test@example.com', ('test@example.com', '209.85.220.41'),
+            ...                              {'query': 'other@example.com', 'urid': 'record-3'}],
+            ...                             max_workers=4, user_email='me@example.com')
+            >>> responses = [result.response for result in results if result.ok]
+        """
+        from emailage import batch
+        return batch.run_queries(self, items, max_workers, common_params)
+
     def flag(self, flag, query, fraud_code=None):
         """ Base method used to flag an email address as fraud, good, or neutral
 
@@ -394,26 +885,13 @@ class EmailageClient:
             >>> response_json = client.flag('neutral', 'test@example.com')
 
         """
-        flags = ['fraud', 'neutral', 'good']
-        if flag not in flags:
-            raise ValueError(validation.Messages.FLAG_NOT_ALLOWED_FORMAT.format(', '.join(flags), flag))
-
-        validation.assert_email(query)
-
-        params = dict(flag=flag, query=query)
-
-        if flag == 'fraud':
-            codes = self.FRAUD_CODES
-            if type(fraud_code) is not int:
-                raise ValueError(
-                    validation.Messages.FRAUD_CODE_RANGE_FORMAT.format(
-                        len(codes), ', '.join(codes.values()), fraud_code)
-                )
-            if fraud_code not in range(1, len(codes) + 1):
-                fraud_code = 9
-            params['fraudcodeID'] = fraud_code
+        params = self._flag_params(flag, query, fraud_code)
 
-        return self.request('/flag', **params)
+        try:
+            return self.request('/flag', **params)
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(cache_key(query, params)[1])
 
     def flag_as_fraud(self, query, fraud_code):
         """Mark an email address as fraud.
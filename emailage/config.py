@@ -0,0 +1,63 @@
+"""Picklable client settings, for handing a client to other processes"""
+import os
+
+from emailage.client import EmailageClient
+
+
+class ClientConfig(object):
+    """ Settings of an :class:`emailage.client.EmailageClient` which can be pickled and sent to other processes
+
+        The client, and its connection pool, is built lazily on first use in each process and never pickled, so a
+        config can be passed to `multiprocessing` or `concurrent.futures.ProcessPoolExecutor` workers.
+
+        :Example:
+
+        >>> from concurrent.futures import ProcessPoolExecutor
+        >>> from emailage.config import ClientConfig
+        >>> config = ClientConfig('consumer_secret', 'consumer_token', sandbox=True, timeout=10)
+        >>> def score(email):
+        ...     return config.client.query(email)
+        >>> with ProcessPoolExecutor() as executor:
+        ...     responses = list(executor.map(score, ['a@example.com', 'b@example.com']))
+    """
+
+    def __init__(self, secret, token, domain=None, **client_options):
+        """ :param secret: Consumer secret, e.g. SID or API key.
+            :param token: Consumer token.
+            :param domain: (Optional) API domain passed to `set_api_domain`, e.g. to target a stub server
+            :param client_options: keyword arguments of :class:`emailage.client.EmailageClient`; they must be picklable
+
+            :type secret: str
+            :type token: str
+            :type domain: str
+        """
+        self.secret = secret
+        self.token = token
+        self.domain = domain
+        self.client_options = client_options
+        self._client = None
+        self._pid = None
+
+    def create_client(self):
+        """ :return: a new :class:`emailage.client.EmailageClient` with these settings """
+        client = EmailageClient(self.secret, self.token, **self.client_options)
+        if self.domain is not None:
+            client.set_api_domain(self.domain)
+        return client
+
+    @property
+    def client(self):
+        """The client of the current process, created on first use"""
+        # A client inherited through fork would share its sockets with the parent
+        if self._client is None or self._pid != os.getpid():
+            self._client = self.create_client()
+            self._pid = os.getpid()
+        return self._client
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_client'] = state['_pid'] = None
+        return state
+
+    def __repr__(self):
+        return 'ClientConfig(<credentials>, domain={!r}, **{!r})'.format(self.domain, self.client_options)
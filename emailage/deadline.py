@@ -0,0 +1,150 @@
+"""Per-call deadlines and time budgets scoped to a block of code"""
+import threading
+
+try:
+    import contextvars
+except ImportError:  # pragma: no cover (Python < 3.7)
+    contextvars = None
+
+from emailage._clock import now as _now
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a call runs out of its time budget; the work still in flight for it is abandoned"""
+
+
+class Deadline(object):
+    """ Point in time by which a call must have completed, shared by everything the call does
+
+        A client checks the deadline before signing, throttling and sending each attempt, caps the timeouts of the
+        network calls and of the waits for the rate limiter and for retries with the time remaining, and raises
+        :class:`DeadlineExceeded` once it has passed. One deadline may be shared by several calls to give them a
+        common budget.
+
+        :Example:
+
+        >>> from emailage.client import EmailageClient
+        >>> from emailage.deadline import Deadline
+        >>> client = EmailageClient('consumer_secret', 'consumer_token')
+        >>> deadline = Deadline(0.3)
+        >>> fraud_report = client.query('useremail@example.co.uk', deadline=deadline)
+        >>> deadline.remaining() > 0
+        True
+    """
+    __slots__ = ('expires_at', '_clock')
+
+    def __init__(self, seconds, clock=_now):
+        """ :param seconds: Time budget from now
+            :param clock: (Optional) Monotonic function returning the current time in seconds
+
+            :type seconds: float
+        """
+        self._clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self):
+        """ :return: seconds left before the deadline, 0 once it has passed """
+        return max(0.0, self.expires_at - self._clock())
+
+    @property
+    def expired(self):
+        return self._clock() >= self.expires_at
+
+    def check(self, stage):
+        """ Raises :class:`DeadlineExceeded` if the deadline has passed
+
+            :param stage: what was about to be done, for the error message
+        """
+        if self.expired:
+            raise DeadlineExceeded('Deadline exceeded before {}'.format(stage))
+
+    def cap(self, timeout):
+        """ :param timeout: timeout in seconds, a (connect, read) tuple of timeouts as `requests` takes, or None
+            :return: `timeout` reduced to the time remaining
+        """
+        remaining = self.remaining()
+        if isinstance(timeout, tuple):
+            return tuple(remaining if part is None else min(part, remaining) for part in timeout)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def __repr__(self):
+        return 'Deadline(remaining={:.3f})'.format(self.remaining())
+
+
+class _ThreadLocalVar(object):
+    """The part of `contextvars.ContextVar` used here, for the interpreters which lack it"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self):
+        return getattr(self._local, 'value', None)
+
+    def set(self, value):
+        token = self.get()
+        self._local.value = value
+        return token
+
+    def reset(self, token):
+        self._local.value = token
+
+
+if contextvars is not None:
+    _current = contextvars.ContextVar('emailage_deadline', default=None)
+else:  # pragma: no cover (Python < 3.7)
+    _current = _ThreadLocalVar()
+
+
+def current_deadline():
+    """ :return: the :class:`Deadline` of the innermost enclosing :class:`time_budget`, or None """
+    return _current.get()
+
+
+def effective(deadline=None):
+    """ :param deadline: :class:`Deadline`, seconds from now, or None
+        :return: the earliest of `deadline` and the deadline of the enclosing :class:`time_budget`, or None
+    """
+    enclosing = _current.get()
+    if deadline is None:
+        return enclosing
+    if not isinstance(deadline, Deadline):
+        deadline = Deadline(deadline)
+    if enclosing is not None and enclosing.expires_at < deadline.expires_at:
+        return enclosing
+    return deadline
+
+
+class time_budget(object):
+    """ Gives the client calls made within a block a common deadline
+
+        Budgets nest: a call gets the earliest of its own deadline and those of the enclosing blocks. The budget
+        follows the context of the caller, so it applies to the coroutines of an asyncio task as well as to a
+        thread; it does not reach threads started within the block, to which the deadline has to be passed.
+
+        :Example:
+
+        >>> from emailage.client import EmailageClient
+        >>> from emailage.deadline import DeadlineExceeded, time_budget
+        >>> client = EmailageClient('consumer_secret', 'consumer_token')
+        >>> try:
+        ...     with time_budget(0.3):
+        ...         fraud_report = client.query_email_and_ip_address('useremail@example.co.uk', '209.85.220.41')
+        ... except DeadlineExceeded:
+        ...     fraud_report = None
+    """
+
+    def __init__(self, seconds):
+        """ :param seconds: Time budget of the block, or a :class:`Deadline` to apply within it
+
+            :type seconds: float | Deadline
+        """
+        self.seconds = seconds
+        self._token = None
+
+    def __enter__(self):
+        deadline = effective(self.seconds)
+        self._token = _current.set(deadline)
+        return deadline
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current.reset(self._token)
@@ -0,0 +1,368 @@
+"""Hedged requests: a second attempt of a query which is slower than usual, raced against the first one"""
+import heapq
+import itertools
+import os
+import threading
+
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from emailage import metrics
+from emailage._clock import now as _now
+from emailage.deadline import DeadlineExceeded
+
+
+HedgeStats = namedtuple('HedgeStats', ['requests', 'hedged', 'won', 'throttled', 'delay'])
+HedgeStats.__doc__ = """ Snapshot of the counters of a :class:`HedgingPolicy`
+
+    - `requests`: hedgeable calls run
+    - `hedged`: calls for which a second attempt was sent
+    - `won`: hedged calls answered by the second attempt first
+    - `throttled`: calls slower than the delay which were not hedged because of `max_hedge_ratio`
+    - `delay`: current seconds after which a call is hedged
+"""
+
+
+class _Attempt(object):
+    """One attempt of a hedged call, and the ways to cancel it"""
+    __slots__ = ('trace', 'started_at', 'response', 'error', 'cancelled', '_lock', '_cancels')
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.started_at = None
+        self.response = None
+        self.error = None
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._cancels = []
+
+    def run(self, send):
+        self.started_at = _now()
+        try:
+            self.response = send(self.trace, self.on_start)
+        except Exception as exc:
+            self.error = exc
+
+    @property
+    def usable(self):
+        if self.error is not None or self.cancelled or self.response is None:
+            return False
+        return self.response.status_code < 500 and self.response.status_code != 429
+
+    def on_start(self, cancel):
+        """Registers a function aborting the request of the attempt once it is in flight"""
+        with self._lock:
+            if not self.cancelled:
+                self._cancels.append(cancel)
+                return
+        cancel()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            cancels, self._cancels = self._cancels, []
+        for cancel in cancels:
+            cancel()
+
+
+class _Call(object):
+    """The attempts of one hedged call, and which of them answered first"""
+
+    def __init__(self, send, trace):
+        self.send = send
+        self.trace = trace
+        self.changed = threading.Condition()
+        self.attempts = []
+        self.completed = []
+        self.winner = None
+        self.settled = False
+
+    def add(self):
+        """ :return: a new attempt; call with :attr:`changed` held once the call may be hedged """
+        trace = None if self.trace is None else metrics.RequestTrace(self.trace.endpoint, self.trace.method)
+        attempt = _Attempt(trace)
+        self.attempts.append(attempt)
+        return attempt
+
+    @property
+    def pending(self):
+        return len(self.attempts) - len(self.completed)
+
+    def run(self, attempt, record_latency):
+        attempt.run(self.send)
+        usable = attempt.usable
+        if usable:
+            record_latency(_now() - attempt.started_at)
+        with self.changed:
+            self.completed.append(attempt)
+            losers = []
+            if usable and self.winner is None:
+                self.winner = attempt
+                losers = [other for other in self.attempts if other is not attempt]
+            self.changed.notify_all()
+        for loser in losers:
+            loser.cancel()
+
+    def outcome(self, deadline):
+        """ :return: the attempt with the first usable response, else the first to complete, else None once the
+            deadline has passed
+        """
+        with self.changed:
+            while self.winner is None and self.pending:
+                remaining = None if deadline is None else deadline.remaining()
+                if remaining == 0:
+                    break
+                self.changed.wait(remaining)
+            self.settled = True
+            outcome = self.winner
+            if outcome is None and not self.pending and not (deadline is not None and deadline.expired):
+                outcome = self.completed[0]
+        for attempt in self.attempts:
+            if attempt is not outcome:
+                attempt.cancel()
+        return outcome
+
+    def expire(self):
+        """Cancels the attempts of a call whose deadline has passed"""
+        with self.changed:
+            attempts = [] if self.settled else list(self.attempts)
+        for attempt in attempts:
+            attempt.cancel()
+
+
+class _Timer(object):
+    """One thread running the functions which the calls of a policy schedule, such as sending their hedge"""
+
+    def __init__(self):
+        self._changed = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._closed = False
+        thread = threading.Thread(target=self._run, name='emailage-hedging')
+        thread.daemon = True
+        thread.start()
+
+    def schedule(self, at, func):
+        """ Runs `func` once the `_now()` clock reaches `at` """
+        with self._changed:
+            heapq.heappush(self._queue, (at, next(self._sequence), func))
+            if self._queue[0][2] is func:
+                self._changed.notify()
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while True:
+                    if self._closed:
+                        return
+                    wait = self._queue[0][0] - _now() if self._queue else None
+                    if wait is not None and wait <= 0:
+                        func = heapq.heappop(self._queue)[2]
+                        break
+                    self._changed.wait(wait)
+            func()
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._queue = []
+            self._changed.notify()
+
+
+class HedgingPolicy(object):
+    """ Races a second, freshly signed, attempt against a query which has not been answered within the usual time
+
+        The delay before hedging is the `percentile` of the latencies of the recent attempts, clamped between
+        `min_delay` and `max_delay`; until `min_samples` latencies are known it is `max_delay`. The first attempt runs
+        on the calling thread, and only the hedges on the threads of the policy. The first usable response wins, and
+        the other attempt is cancelled: with HTTP/1.1 its connection is closed, with the HTTP/2 transport its response
+        is read and dropped on the event loop of the transport.
+
+        The hedge goes out on another pooled connection with HTTP/1.1, since the first attempt holds its own; with
+        HTTP/2 it is multiplexed on the same connection.
+
+        Hedges are paid for by a budget growing by `max_hedge_ratio` per call up to `burst`, so that at most that
+        share of the calls is sent twice however slow the API gets. Hedges go through the rate limiter and the
+        circuit breaker of the client like any attempt. Only queries are hedged; flags are sent once.
+
+        A policy may be shared by the clients calling the same API.
+
+        :Example:
+
+        >>> from emailage.client import EmailageClient
+        >>> from emailage.hedging import HedgingPolicy
+        >>> hedging = HedgingPolicy(percentile=0.95, max_hedge_ratio=0.05)
+        >>> client = EmailageClient('consumer_secret', 'consumer_token', hedging=hedging)
+        >>> fraud_report = client.query_email_and_ip_address('useremail@example.co.uk', '209.85.220.41')
+        >>> hedging.stats
+        HedgeStats(requests=1, hedged=0, won=0, throttled=0, delay=1.0)
+    """
+
+    def __init__(self, percentile=0.95, min_delay=0.005, max_delay=1.0, max_hedge_ratio=0.05, burst=10,
+                 window=1000, min_samples=50, max_workers=64):
+        """ :param percentile: Latency percentile, between 0 and 1, after which a call is hedged
+            :param min_delay: Lower bound in seconds of the delay before hedging
+            :param max_delay: Upper bound in seconds of the delay before hedging
+            :param max_hedge_ratio: Maximum share of the calls which are hedged, over time
+            :param burst: (Optional) Maximum number of hedges saved up by the budget
+            :param window: (Optional) Number of recent latencies the percentile is computed over
+            :param min_samples: (Optional) Latencies needed before the percentile is used
+            :param max_workers: (Optional) Threads sending the hedges
+
+            :type percentile: float
+            :type min_delay: float
+            :type max_delay: float
+            :type max_hedge_ratio: float
+            :type burst: float
+            :type window: int
+            :type min_samples: int
+            :type max_workers: int
+        """
+        if not 0 < percentile < 1:
+            raise ValueError('percentile must be between 0 and 1. {} is given.'.format(percentile))
+        if not 0 <= max_hedge_ratio <= 1:
+            raise ValueError('max_hedge_ratio must be between 0 and 1. {} is given.'.format(max_hedge_ratio))
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_hedge_ratio = max_hedge_ratio
+        self.burst = max(1, burst)
+        self.window = window
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self._setup()
+
+    def _setup(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._timer = None
+        self._latencies = deque(maxlen=self.window)
+        self._samples_since_refresh = 0
+        self._delay = self.max_delay
+        self._budget = 0.0
+        self._requests = self._hedged = self._won = self._throttled = 0
+
+    def __getstate__(self):
+        # The latencies, budget and threads stay in the process which measured them
+        state = self.__dict__.copy()
+        for name in ['_pid', '_lock', '_executor', '_timer', '_latencies', '_samples_since_refresh', '_delay',
+                     '_budget', '_requests', '_hedged', '_won', '_throttled']:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setup()
+
+    @property
+    def delay(self):
+        """Seconds after which a call is hedged"""
+        return self._delay
+
+    def record_latency(self, seconds):
+        """ Adds the latency of an attempt which got a usable response """
+        with self._lock:
+            self._latencies.append(seconds)
+            self._samples_since_refresh += 1
+            # Sorting the window for every call would cost more than the calls it hedges
+            if len(self._latencies) >= self.min_samples and self._samples_since_refresh >= max(1, self.window // 20):
+                self._samples_since_refresh = 0
+                ordered = sorted(self._latencies)
+                latency = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+                self._delay = min(self.max_delay, max(self.min_delay, latency))
+
+    def _earn(self):
+        with self._lock:
+            self._requests += 1
+            self._budget = min(self.burst, self._budget + self.max_hedge_ratio)
+
+    def _spend(self):
+        with self._lock:
+            # Tolerates the rounding of the ratios summed, 0.1 added ten times being slightly below 1
+            if self._budget < 1 - 1e-9:
+                self._throttled += 1
+                return False
+            self._budget -= 1
+            self._hedged += 1
+            return True
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _get_timer(self):
+        if self._timer is None:
+            with self._lock:
+                if self._timer is None:
+                    self._timer = _Timer()
+        return self._timer
+
+    def _hedge(self, call, deadline):
+        # Runs on the timer thread once the delay has passed
+        if deadline is not None and deadline.expired:
+            return
+        with call.changed:
+            if call.settled or call.completed or not self._spend():
+                return
+            attempt = call.add()
+        self._get_executor().submit(call.run, attempt, self.record_latency)
+
+    def run(self, send, trace=None, deadline=None):
+        """ Calls `send`, and calls it again from another thread if it has not returned within :attr:`delay`
+
+            :param send: function taking a :class:`emailage.metrics.RequestTrace` or None, and a function which
+                `send` may call with a function cancelling its request; it returns the response
+            :param trace: (Optional) trace of the call, to which the trace of the winning attempt is added
+            :param deadline: (Optional) :class:`emailage.deadline.Deadline` at which both attempts are cancelled
+            :return: the first usable response; otherwise the outcome of the first attempt to complete
+        """
+        # The threads of the policy do not survive a fork
+        if self._pid != os.getpid():
+            self._setup()
+        self._earn()
+        call = _Call(send, trace)
+        first = call.add()
+        timer = self._get_timer()
+        now = _now()
+        delay = self._delay if deadline is None else deadline.cap(self._delay)
+        timer.schedule(now + delay, lambda: self._hedge(call, deadline))
+        if deadline is not None:
+            timer.schedule(now + deadline.remaining(), call.expire)
+
+        call.run(first, self.record_latency)
+        winner = call.outcome(deadline)
+        if len(call.attempts) > 1:
+            won = winner is not None and winner is not first
+            if won:
+                with self._lock:
+                    self._won += 1
+            if trace is not None:
+                trace.count_hedge(won)
+        if winner is None:
+            raise DeadlineExceeded('Deadline exceeded while waiting for the response')
+
+        if trace is not None:
+            trace.add(winner.trace)
+        if winner.error is not None:
+            raise winner.error
+        return winner.response
+
+    @property
+    def stats(self):
+        """ :return: :class:`HedgeStats` snapshot of the counters and the current delay """
+        with self._lock:
+            return HedgeStats(self._requests, self._hedged, self._won, self._throttled, self._delay)
+
+    def close(self):
+        """ Stops the threads once the hedges in flight complete """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.close()
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,209 @@
+"""HTTP/2 transport of :class:`emailage.client.EmailageClient`, multiplexing concurrent requests over few connections
+
+Requires the optional `httpcore[asyncio,http2]` dependency (``pip install emailage-official[http2]``).
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+
+import httpcore
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout, Timeout
+from requests.structures import CaseInsensitiveDict
+
+from emailage.client import TlsVersions, _create_ssl_context
+from emailage.deadline import DeadlineExceeded
+from emailage.pooling import PoolStats, keepalive_socket_options
+from emailage.retry import RequestCancelled
+
+
+class Http2Response(object):
+    """The parts of a `requests.Response` which the client, its retry policy and its hooks use"""
+    __slots__ = ('status_code', 'content', 'headers', 'http_version')
+
+    def __init__(self, response):
+        self.status_code = response.status
+        self.content = response.content
+        self.headers = CaseInsensitiveDict((name.decode('latin-1'), value.decode('latin-1'))
+                                           for name, value in response.headers)
+        self.http_version = response.extensions['http_version'].decode('ascii')
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def __bool__(self):
+        return self.ok
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return '<Http2Response [{} {}]>'.format(self.status_code, self.http_version)
+
+
+def _timeout(timeout):
+    # `requests` takes either one timeout or a (connect, read) tuple
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return {'connect': connect, 'read': read, 'write': None, 'pool': None}
+    return dict.fromkeys(['connect', 'read', 'write', 'pool'], timeout)
+
+
+_loop_lock = threading.Lock()
+_loop = None
+_loop_pid = None
+
+
+def _event_loop():
+    """ :return: the event loop of the current process running the requests of every session, started on first use """
+    global _loop, _loop_pid
+    # The thread of the loop does not survive a fork
+    if _loop is None or _loop_pid != os.getpid():
+        with _loop_lock:
+            if _loop is None or _loop_pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='emailage-http2')
+                thread.daemon = True
+                thread.start()
+                _loop, _loop_pid = loop, os.getpid()
+    return _loop
+
+
+class Http2Session(object):
+    """ Session sending the requests of a client over HTTP/2, with the `get` and `post` methods of `requests.Session`
+
+        Over TLS, HTTP/2 is negotiated through ALPN and servers which do not offer it are spoken to in HTTP/1.1; the
+        TLS version is pinned like :class:`emailage.client.EmailageClient.Adapter` does. With `prior_knowledge`, plain
+        HTTP servers are spoken to in HTTP/2 directly (h2c). Concurrent requests to a host share its connections, up
+        to `pool_maxsize` of them, and errors are raised as the `requests` exceptions retry policies expect.
+
+        The requests of every session run on one background event loop, which the calling threads wait for, so that
+        the streams of a connection are always opened in order. A request whose caller stops waiting for it, at its
+        deadline or because it lost a hedge race, is left to complete on the loop and its response is dropped: the
+        HTTP/2 stack neither resets the stream of a cancelled request nor keeps the header compression state of the
+        connection in step when it is cancelled while writing.
+
+        :Example:
+
+        >>> from emailage.http2 import Http2Session
+        >>> session = Http2Session(pool_maxsize=2)
+        >>> response = session.get('https://api.emailage.com/emailagevalidator/', params='format=json&...')
+        >>> response.http_version
+        'HTTP/2'
+    """
+
+    def __init__(self, tls_version=TlsVersions.TLSv1_2, prior_knowledge=False, pool_connections=10, pool_maxsize=10,
+                 pool_block=True, tcp_keepalive_idle=None):
+        """ :param tls_version: (Optional) Uses TLS version 1.2 by default (TlsVersions.TLSv1_2 | TlsVersions.TLSv1_1)
+            :param prior_knowledge: (Optional) Speak HTTP/2 without negotiation, to plain HTTP servers
+            :param pool_connections: Not used, every host has its own connections
+            :param pool_maxsize: (Optional) Maximum connections per host
+            :param pool_block: Not used, requests always wait for a stream on one of the connections
+            :param tcp_keepalive_idle:
+                (Optional) Seconds of inactivity after which TCP keep-alive probes are sent on the connections
+
+            :type tls_version: see :class:`emailage.client.TlsVersions`
+            :type prior_knowledge: bool
+            :type pool_maxsize: int
+            :type tcp_keepalive_idle: int
+        """
+        self._loop = _event_loop()
+        self._pool = asyncio.run_coroutine_threadsafe(self._create_pool(dict(
+            ssl_context=_create_ssl_context(tls_version),
+            http1=not prior_knowledge,
+            http2=True,
+            max_connections=pool_maxsize,
+            max_keepalive_connections=pool_maxsize,
+            socket_options=keepalive_socket_options(tcp_keepalive_idle) if tcp_keepalive_idle is not None else None)),
+            self._loop).result()
+        # The requests in flight, and the connections opened, are only touched on the event loop
+        self._requests = set()
+        self._created = 0
+
+    @staticmethod
+    async def _create_pool(pool_options):
+        return httpcore.AsyncConnectionPool(**pool_options)
+
+    def get(self, url, params=None, timeout=None, deadline=None, on_start=None):
+        """ :param params: encoded query string
+            :param deadline: (Optional) :class:`emailage.deadline.Deadline` at which the request is abandoned
+            :param on_start: (Optional) function called with a function abandoning the request
+        """
+        return self._send('GET', url + '?' + params if params else url, None, timeout, deadline, on_start)
+
+    def post(self, url, data=None, timeout=None, deadline=None, on_start=None):
+        """ :param data: encoded body
+            :param deadline: (Optional) :class:`emailage.deadline.Deadline` at which the request is abandoned
+            :param on_start: (Optional) function called with a function abandoning the request
+        """
+        return self._send('POST', url, data, timeout, deadline, on_start)
+
+    async def _trace(self, event, info):
+        if event == 'connection.connect_tcp.complete':
+            self._created += 1
+
+    async def _request(self, method, url, content, timeout):
+        task = asyncio.current_task()
+        self._requests.add(task)
+        try:
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            return await self._pool.request(
+                method, url, headers=[(b'Content-Type', b'application/json')], content=content,
+                extensions={'timeout': _timeout(timeout), 'trace': self._trace})
+        finally:
+            self._requests.discard(task)
+
+    def _send(self, method, url, content, timeout, deadline=None, on_start=None):
+        future = asyncio.run_coroutine_threadsafe(self._request(method, url, content, timeout), self._loop)
+        abandoned = concurrent.futures.Future()
+
+        def abandon():
+            try:
+                abandoned.set_result(None)
+            except concurrent.futures.InvalidStateError:
+                pass
+
+        if on_start is not None:
+            on_start(abandon)
+        completed, _ = concurrent.futures.wait([future, abandoned], None if deadline is None else deadline.remaining(),
+                                               return_when=concurrent.futures.FIRST_COMPLETED)
+        if future not in completed:
+            if abandoned in completed:
+                raise RequestCancelled('The request was cancelled')
+            raise DeadlineExceeded('Deadline exceeded while waiting for the response')
+        try:
+            return Http2Response(future.result())
+        except httpcore.ConnectTimeout as exc:
+            raise ConnectTimeout(exc)
+        except httpcore.ReadTimeout as exc:
+            raise ReadTimeout(exc)
+        except httpcore.TimeoutException as exc:
+            raise Timeout(exc)
+        except (httpcore.NetworkError, httpcore.ProtocolError) as exc:
+            raise ConnectionError(exc)
+
+    async def _stats(self):
+        connections = self._pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return PoolStats(len(connections) - idle, idle, self._created, max(0, self._created - len(connections)))
+
+    @property
+    def pool_stats(self):
+        """ :return: :class:`emailage.pooling.PoolStats` of the connections; `in_use` counts the busy ones """
+        return asyncio.run_coroutine_threadsafe(self._stats(), self._loop).result()
+
+    async def _close(self, wait):
+        while wait and self._requests:
+            await asyncio.wait(list(self._requests))
+        await self._pool.aclose()
+
+    def close(self, wait=False):
+        """ Closes the connections
+
+            :param wait: (Optional) Close them in the background, once the requests in flight have completed
+            :type wait: bool
+        """
+        future = asyncio.run_coroutine_threadsafe(self._close(wait), self._loop)
+        if not wait:
+            future.result()
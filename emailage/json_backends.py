@@ -0,0 +1,93 @@
+"""Pluggable decoding of the JSON response bodies of the API
+
+Every backend takes the raw response bytes, which start with a UTF-8 Byte Order Mark. The standard library backend
+is used by default; `orjson` and `ujson` parse the bytes directly, without first decoding them into a str copy.
+`orjson` is given the body after the BOM through a memoryview; `ujson` and custom functions only accept bytes, so
+the body is copied once to strip the BOM, which costs far less than the parsing.
+"""
+import codecs
+import json
+
+
+_BOM = codecs.BOM_UTF8
+_BOM_LENGTH = len(_BOM)
+
+STDLIB = 'json'
+ORJSON = 'orjson'
+UJSON = 'ujson'
+AUTO = 'auto'
+
+
+def _stdlib_loads(content):
+    # Explicit encoding is necessary because the API returns a Byte Order Mark at the beginning of the contents
+    return json.loads(content.decode(encoding='utf_8_sig'))
+
+
+def _orjson_loads_factory():
+    import orjson
+
+    def loads(content):
+        if content.startswith(_BOM):
+            # A memoryview slice skips the BOM without copying the body
+            content = memoryview(content)[_BOM_LENGTH:]
+        return orjson.loads(content)
+    return loads
+
+
+def _ujson_loads_factory():
+    import ujson
+
+    def loads(content):
+        if content.startswith(_BOM):
+            # ujson does not accept a memoryview, so the body is copied without its BOM
+            content = content[_BOM_LENGTH:]
+        return ujson.loads(content)
+    return loads
+
+
+def _custom_loads_factory(custom_loads):
+    def loads(content):
+        if content.startswith(_BOM):
+            # Custom functions are promised bytes, which a memoryview is not, so the body is copied without its BOM
+            content = content[_BOM_LENGTH:]
+        return custom_loads(content)
+    return loads
+
+
+_FACTORIES = {
+    ORJSON: _orjson_loads_factory,
+    UJSON: _ujson_loads_factory,
+}
+
+
+def get_loads(backend=STDLIB):
+    """ Resolves a JSON backend into a function decoding BOM-prefixed response bytes
+
+        :param backend: 'json', 'orjson', 'ujson', 'auto' for the fastest installed one, or a custom function
+            accepting the bytes of a body without its BOM, copied from the response
+        :return: function taking the response bytes and returning the decoded document
+
+        :type backend: str | callable
+
+        :Example:
+
+        >>> from emailage.json_backends import get_loads
+        >>> loads = get_loads('json')
+        >>> loads(b'\\xef\\xbb\\xbf{"responseStatus": {"status": "success"}}')
+        {'responseStatus': {'status': 'success'}}
+    """
+    if callable(backend):
+        return _custom_loads_factory(backend)
+    if backend == STDLIB:
+        return _stdlib_loads
+    if backend == AUTO:
+        for name in (ORJSON, UJSON):
+            try:
+                return _FACTORIES[name]()
+            except ImportError:
+                continue
+        return _stdlib_loads
+    if backend not in _FACTORIES:
+        raise ValueError('json_backend must be one of {}, or a function. {} is given.'.format(
+            ', '.join([STDLIB, ORJSON, UJSON, AUTO]), backend))
+    return _FACTORIES[backend]()
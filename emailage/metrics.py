@@ -0,0 +1,248 @@
+"""Timing of the stages of API calls, with latency histograms and counters exported in the Prometheus text format"""
+import bisect
+import threading
+import time
+
+
+_now = getattr(time, 'perf_counter', time.time)
+
+THROTTLE = 'throttle'
+SIGN = 'sign'
+ENCODE = 'encode'
+NETWORK = 'network'
+DECODE = 'decode'
+
+REQUEST_SECONDS = 'emailage_request_duration_seconds'
+STAGE_SECONDS = 'emailage_stage_duration_seconds'
+RESPONSES = 'emailage_responses_total'
+RETRIES = 'emailage_retries_total'
+HEDGES = 'emailage_hedges_total'
+HEDGES_WON = 'emailage_hedges_won_total'
+ERRORS = 'emailage_errors_total'
+SENT_BYTES = 'emailage_sent_bytes_total'
+RECEIVED_BYTES = 'emailage_received_bytes_total'
+
+_HELP = {
+    REQUEST_SECONDS: 'Duration of API calls, retries and decoding included',
+    STAGE_SECONDS: 'Time spent in each stage of API calls, summed over the attempts of a call',
+    RESPONSES: 'Responses received, by HTTP status',
+    RETRIES: 'Attempts retried after a transient failure',
+    HEDGES: 'Second attempts sent for calls slower than the hedging delay',
+    HEDGES_WON: 'Hedged calls answered by the second attempt first',
+    ERRORS: 'API calls which raised an exception, by exception type',
+    SENT_BYTES: 'Bytes of query strings and bodies sent',
+    RECEIVED_BYTES: 'Bytes of response bodies received',
+}
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestTrace(object):
+    """ Timings and sizes of one API call, handed to the response hooks of the client
+
+        `stages` maps the stage names (throttle, sign, encode, network, decode) to the seconds spent in them, summed
+        over all the attempts of the call.
+    """
+    __slots__ = ('endpoint', 'method', 'stages', 'statuses', 'retries', 'hedges', 'hedges_won', 'bytes_sent',
+                 'bytes_received', 'error', 'duration', '_started_at', '_lap_started_at')
+
+    def __init__(self, endpoint, method):
+        self.endpoint = endpoint
+        self.method = method
+        self.stages = {}
+        self.statuses = []
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.error = None
+        self.duration = None
+        self._started_at = self._lap_started_at = _now()
+
+    def mark(self):
+        """Starts timing the next stage"""
+        self._lap_started_at = _now()
+
+    def lap(self, stage):
+        """Adds the time elapsed since the last mark or lap to `stage`"""
+        now = _now()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._lap_started_at
+        self._lap_started_at = now
+
+    def count_retry(self, retry_number):
+        self.retries += 1
+
+    def count_hedge(self, won):
+        self.hedges += 1
+        if won:
+            self.hedges_won += 1
+
+    def add(self, attempt):
+        """Adds the stages, responses and bytes of the trace of one attempt made for this call"""
+        for stage, seconds in attempt.stages.items():
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.statuses.extend(attempt.statuses)
+        self.bytes_sent += attempt.bytes_sent
+        self.bytes_received += attempt.bytes_received
+
+    def count_response(self, response, bytes_sent):
+        self.statuses.append(response.status_code)
+        self.bytes_sent += bytes_sent
+        self.bytes_received += len(response.content)
+
+    def finish(self, error=None):
+        self.duration = _now() - self._started_at
+        self.error = error
+
+
+class Histogram(object):
+    """Observations counted into buckets of upper bounds `buckets`, plus their sum and count"""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """ :return: list of (upper bound, observations lower than or equal to it), ending with infinity """
+        total, cumulative = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry(object):
+    """ Thread-safe latency histograms and counters of the API calls sent by one or more clients
+
+        :Example:
+
+        >>> from emailage.client import EmailageClient
+        >>> from emailage.metrics import MetricsRegistry
+        >>> metrics = MetricsRegistry()
+        >>> client = EmailageClient('consumer_secret', 'consumer_token', metrics=metrics)
+        >>> fraud_report = client.query('useremail@example.co.uk')
+        >>> print(metrics.to_prometheus())
+        # HELP emailage_request_duration_seconds Duration of API calls, retries and decoding included
+        # TYPE emailage_request_duration_seconds histogram
+        ...
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """ :param buckets: (Optional) Upper bounds in seconds of the histogram buckets
+
+            :type buckets: tuple
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, seconds, **labels):
+        with self._lock:
+            self._observe(name, seconds, labels)
+
+    def increment(self, name, amount=1, **labels):
+        with self._lock:
+            self._increment(name, amount, labels)
+
+    def _observe(self, name, seconds, labels):
+        key = (name, _label_key(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def _increment(self, name, amount, labels):
+        key = (name, _label_key(labels))
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def histogram(self, name, **labels):
+        """ :return: :class:`Histogram` of `name` with exactly `labels`, or None if nothing was observed """
+        return self._histograms.get((name, _label_key(labels)))
+
+    def counter(self, name, **labels):
+        """ :return: value of the counter `name` with exactly `labels`, 0 if it was never incremented """
+        return self._counters.get((name, _label_key(labels)), 0)
+
+    def record(self, trace):
+        """ Records every measurement of a finished :class:`RequestTrace` """
+        endpoint = trace.endpoint
+        with self._lock:
+            for stage, seconds in trace.stages.items():
+                self._observe(STAGE_SECONDS, seconds, dict(endpoint=endpoint, stage=stage))
+            for status in trace.statuses:
+                self._increment(RESPONSES, 1, dict(endpoint=endpoint, status=status))
+            if trace.retries:
+                self._increment(RETRIES, trace.retries, dict(endpoint=endpoint))
+            if trace.hedges:
+                self._increment(HEDGES, trace.hedges, dict(endpoint=endpoint))
+                self._increment(HEDGES_WON, trace.hedges_won, dict(endpoint=endpoint))
+            self._increment(SENT_BYTES, trace.bytes_sent, dict(endpoint=endpoint))
+            self._increment(RECEIVED_BYTES, trace.bytes_received, dict(endpoint=endpoint))
+            if trace.error is not None:
+                self._increment(ERRORS, 1, dict(endpoint=endpoint, error=type(trace.error).__name__))
+            else:
+                self._observe(REQUEST_SECONDS, trace.duration, dict(endpoint=endpoint, method=trace.method))
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def to_prometheus(self):
+        """ :return: every metric in the Prometheus text exposition format """
+        with self._lock:
+            histograms = sorted((key, histogram.cumulative_counts(), histogram.sum, histogram.count)
+                                for key, histogram in self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        described = set()
+
+        def describe(name, metric_type):
+            if name not in described:
+                described.add(name)
+                lines.append('# HELP {} {}'.format(name, _HELP.get(name, name)))
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+
+        for (name, label_key), cumulative, total, count in histograms:
+            describe(name, 'histogram')
+            for bound, bucket_count in cumulative:
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(label_key, [('le', _format_value(bound))]),
+                                                     bucket_count))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(label_key), _format_value(total)))
+            lines.append('{}_count{} {}'.format(name, _format_labels(label_key), count))
+        for (name, label_key), value in counters:
+            describe(name, 'counter')
+            lines.append('{}{} {}'.format(name, _format_labels(label_key), _format_value(value)))
+        return '\n'.join(lines) + '\n'
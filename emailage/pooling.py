@@ -0,0 +1,250 @@
+"""Connection pools which keep statistics about the reuse of their connections"""
+import socket
+import threading
+import weakref
+
+from collections import namedtuple
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from requests.packages.urllib3.poolmanager import PoolManager
+from six.moves import queue
+
+from emailage.client import TlsVersions
+from emailage.retry import RequestCancelled
+
+
+PoolStats = namedtuple('PoolStats', ['in_use', 'idle', 'created', 'discarded'])
+PoolStats.__doc__ = """ Snapshot of the connections of a pool manager
+
+    - `in_use`: connections currently checked out by requests
+    - `idle`: open connections waiting in the pools to be reused
+    - `created`: connections opened since the pool manager was created
+    - `discarded`: connections closed after use because their pool was already full
+"""
+
+
+class PoolStatistics(object):
+    """Thread-safe counters shared by every connection pool of one pool manager"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = weakref.WeakSet()
+        self._in_use = self._created = self._discarded = 0
+
+    def _count(self, in_use=0, created=0, discarded=0):
+        with self._lock:
+            self._in_use += in_use
+            self._created += created
+            self._discarded += discarded
+
+    def _track(self, pool):
+        with self._lock:
+            self._pools.add(pool)
+
+    def snapshot(self):
+        """ :return: :class:`PoolStats` for all the pools of the manager """
+        with self._lock:
+            pools = list(self._pools)
+            in_use, created, discarded = self._in_use, self._created, self._discarded
+        idle = 0
+        for pool in pools:
+            idle_queue = pool.pool
+            if idle_queue is not None:
+                with idle_queue.mutex:
+                    idle += sum(1 for conn in idle_queue.queue if conn is not None)
+        return PoolStats(in_use, idle, created, discarded)
+
+
+_scopes = threading.local()
+
+
+class CancelScope(object):
+    """ Lets other threads cancel the request which the current thread sends through a counting pool within the block
+
+        The request is aborted by shutting down the socket of its connection, which the pool then discards, and
+        :class:`emailage.retry.RequestCancelled` is raised from the block. A request cancelled before its response
+        is awaited is not waited for. Once its connection is back in the pool, cancelling has no effect.
+
+        :Example:
+
+        >>> import threading
+        >>> from emailage.client import EmailageClient
+        >>> from emailage.pooling import CancelScope
+        >>> from emailage.retry import RequestCancelled
+        >>> session = EmailageClient('consumer_secret', 'consumer_token').session
+        >>> scope = CancelScope()
+        >>> threading.Timer(0.1, scope.cancel).start()
+        >>> try:
+        ...     with scope:
+        ...         response = session.get('https://api.emailage.com/emailagevalidator/')
+        ... except RequestCancelled:
+        ...     response = None
+    """
+
+    def __init__(self, on_start=None):
+        """ :param on_start: (Optional) function called with :meth:`cancel` when the block is entered """
+        self._on_start = on_start
+        self._lock = threading.Lock()
+        self._connection = None
+        self._outer = None
+        self.cancelled = False
+
+    def __enter__(self):
+        self._outer = getattr(_scopes, 'current', None)
+        _scopes.current = self
+        if self._on_start is not None:
+            self._on_start(self.cancel)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _scopes.current = self._outer
+        with self._lock:
+            self._connection = None
+            cancelled = self.cancelled
+        if cancelled and exc_type is not None and not issubclass(exc_type, RequestCancelled):
+            raise RequestCancelled('The request was cancelled')
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            # Under the lock, so that a connection given back to the pool is never shut down
+            sock = getattr(self._connection, 'sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except (OSError, socket.error):
+                    pass
+
+    def _attach(self, connection):
+        with self._lock:
+            if self.cancelled:
+                raise RequestCancelled('The request was cancelled')
+            self._connection = connection
+
+    def _detach(self, connection):
+        with self._lock:
+            if self._connection is connection:
+                self._connection = None
+
+
+def _cancellable_connection_class(base_class):
+
+    class CancellableConnection(base_class):
+        def getresponse(self, *args, **kwargs):
+            # The request has been written; the socket is shut down if the request is cancelled from now on
+            scope = getattr(_scopes, 'current', None)
+            if scope is not None:
+                scope._attach(self)
+            return base_class.getresponse(self, *args, **kwargs)
+
+    CancellableConnection.__name__ = 'Cancellable' + base_class.__name__
+    return CancellableConnection
+
+
+def _counting_pool_class(base_class, statistics):
+
+    class CountingQueue(queue.LifoQueue):
+        def put(self, item, block=True, timeout=None):
+            try:
+                queue.LifoQueue.put(self, item, block, timeout)
+            except queue.Full:
+                if item is not None:
+                    statistics._count(discarded=1)
+                raise
+
+    class CountingConnectionPool(base_class):
+        QueueCls = CountingQueue
+        ConnectionCls = _cancellable_connection_class(base_class.ConnectionCls)
+
+        def __init__(self, *args, **kwargs):
+            base_class.__init__(self, *args, **kwargs)
+            statistics._track(self)
+
+        def _new_conn(self):
+            conn = base_class._new_conn(self)
+            statistics._count(created=1)
+            return conn
+
+        def _get_conn(self, timeout=None):
+            conn = base_class._get_conn(self, timeout)
+            statistics._count(in_use=1)
+            return conn
+
+        def _put_conn(self, conn):
+            scope = getattr(_scopes, 'current', None)
+            if scope is not None:
+                scope._detach(conn)
+            statistics._count(in_use=-1)
+            base_class._put_conn(self, conn)
+
+    CountingConnectionPool.__name__ = 'Counting' + base_class.__name__
+    return CountingConnectionPool
+
+
+class CountingPoolManager(PoolManager):
+    """ PoolManager whose connection pools report their activity to :attr:`statistics`
+
+        :Example:
+
+        >>> from emailage.pooling import CountingPoolManager
+        >>> manager = CountingPoolManager(num_pools=2, maxsize=4)
+        >>> manager.statistics.snapshot()
+        PoolStats(in_use=0, idle=0, created=0, discarded=0)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CountingPoolManager, self).__init__(*args, **kwargs)
+        self.statistics = PoolStatistics()
+        self.pool_classes_by_scheme = {
+            'http': _counting_pool_class(HTTPConnectionPool, self.statistics),
+            'https': _counting_pool_class(HTTPSConnectionPool, self.statistics),
+        }
+
+
+def keepalive_socket_options(idle):
+    """ Socket options enabling TCP keep-alive probes once a connection has been idle for `idle` seconds
+
+        Pooled connections which sit idle between bursts are otherwise silently dropped by NAT gateways and load
+        balancers, and have to be reopened with a new TLS handshake.
+
+        :param idle: seconds of inactivity before the first probe is sent
+        :return: list of socket options for urllib3 connections, including its defaults
+
+        :type idle: int
+    """
+    options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1), (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, int(idle)))
+    elif hasattr(socket, 'TCP_KEEPALIVE'):  # macOS
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, int(idle)))
+    return options
+
+
+class PinnedTlsAdapter(HTTPAdapter):
+    """ Transport adapter of :class:`emailage.client.EmailageClient`, pinned to one TLS version and keeping statistics
+        of its connections
+    """
+
+    def __init__(self, tls_version=TlsVersions.TLSv1_2, pool_connections=10, pool_maxsize=10, pool_block=False,
+                 tcp_keepalive_idle=None):
+        self._tls_version = tls_version
+        self._tcp_keepalive_idle = tcp_keepalive_idle
+        self.poolmanager = None
+        super(PinnedTlsAdapter, self).__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                               pool_block=pool_block)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self._tcp_keepalive_idle is not None:
+            pool_kwargs['socket_options'] = keepalive_socket_options(self._tcp_keepalive_idle)
+        self.poolmanager = CountingPoolManager(
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            ssl_version=self._tls_version,
+            **pool_kwargs)
+
+    @property
+    def pool_stats(self):
+        """ :return: :class:`PoolStats` of the connections opened through this adapter """
+        return self.poolmanager.statistics.snapshot()
@@ -0,0 +1,129 @@
+"""Client-side throttling of the requests sent to the API"""
+import threading
+import time
+
+from emailage._clock import now as _now
+
+
+class RateLimitExceeded(Exception):
+    """Raised when no request token could be acquired within the allowed time"""
+
+
+class TokenBucket(object):
+    """ Thread-safe token bucket refilled at `rate` tokens per second and holding at most `capacity` tokens
+
+        One token is spent per request. A full bucket absorbs a burst of `capacity` requests, after which requests
+        are admitted at the sustained `rate`. The same bucket can be shared by any number of threads and clients.
+
+        :Example:
+
+        >>> from emailage.ratelimit import TokenBucket
+        >>> bucket = TokenBucket(rate=50, capacity=10)
+        >>> bucket.acquire(blocking=False)
+        True
+        >>> bucket.acquire(timeout=0.5)
+        True
+    """
+
+    def __init__(self, rate, capacity=None, clock=_now, sleep=time.sleep):
+        """ :param rate: Tokens added per second, i.e. the sustained number of requests per second
+            :param capacity: (Optional) Maximum number of stored tokens, i.e. the burst size; `rate` by default
+            :param clock: (Optional) Function returning the current time in seconds
+            :param sleep: (Optional) Function used to wait for tokens
+
+            :type rate: float
+            :type capacity: float
+        """
+        if rate <= 0:
+            raise ValueError('rate must be a positive number. {} is given.'.format(rate))
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        if self.capacity < 1:
+            raise ValueError('capacity must be at least 1. {} is given.'.format(capacity))
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated_at = clock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens=1):
+        """ Takes `tokens` tokens if they are available right now
+
+            :return: 0 if the tokens were taken, otherwise the seconds to wait until they are available
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, blocking=True, timeout=None, tokens=1):
+        """ Takes `tokens` tokens, waiting for the bucket to refill if needed
+
+            :param blocking: (Optional) Wait for tokens; return immediately when False
+            :param timeout: (Optional) Maximum seconds to wait for tokens when blocking; no limit by default
+            :param tokens: (Optional) Number of tokens to take, 1 by default
+            :return: True if the tokens were taken, False if none were available in time
+
+            :type blocking: bool
+            :type timeout: float
+            :type tokens: int
+        """
+        if tokens > self.capacity:
+            raise ValueError('Cannot acquire {} tokens from a bucket of capacity {}'.format(tokens, self.capacity))
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return True
+            if not blocking:
+                return False
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining < wait:
+                    if remaining > 0:
+                        self._sleep(remaining)
+                    return self.try_acquire(tokens) == 0
+            self._sleep(wait)
+
+
+class SharedTokenBucket(TokenBucket):
+    """ :class:`TokenBucket` whose tokens are shared by the processes it is handed to
+
+        The bucket state lives in shared memory, so one request budget is enforced across a pool of worker processes.
+        Like any multiprocessing lock, the bucket must reach the workers when they are started, e.g. as an argument
+        of `multiprocessing.Process`, in the `initargs` of a pool, or in the options of a
+        :class:`emailage.config.ClientConfig` given to :func:`emailage.batch.run_queries_in_processes`.
+
+        :Example:
+
+        >>> from emailage.batch import run_queries_in_processes
+        >>> from emailage.config import ClientConfig
+        >>> from emailage.ratelimit import SharedTokenBucket
+        >>> config = ClientConfig('consumer_secret', 'consumer_token', rate_limiter=SharedTokenBucket(rate=50))
+        >>> results = run_queries_in_processes(config, ['a@example.com', 'b@example.com'], processes=4)
+    """
+
+    def __init__(self, rate, capacity=None, clock=_now, sleep=time.sleep):
+        import multiprocessing  # only needed by this class, and slow to import
+
+        super(SharedTokenBucket, self).__init__(rate, capacity, clock, sleep)
+        self._lock = multiprocessing.Lock()
+        self._state = multiprocessing.RawArray('d', [self._tokens, self._updated_at])
+
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            now = self._clock()
+            available = min(self.capacity, self._state[0] + (now - self._state[1]) * self.rate)
+            self._state[1] = now
+            if available >= tokens:
+                self._state[0] = available - tokens
+                return 0
+            self._state[0] = available
+            return (tokens - available) / self.rate
@@ -0,0 +1,103 @@
+"""Compact responses for applications holding many results in memory
+
+A :class:`QueryResult` keeps the raw bytes of the response and the handful of fields most applications read. The
+full document is decoded once to extract those fields and dropped right away; it is decoded again when it is first
+accessed, and only then kept in memory as nested dicts. Results which are never looked into beyond their common fields
+thus cost one decoding, like a dict response, and much less memory.
+"""
+import codecs
+
+from emailage import json_backends
+
+
+_BOM = codecs.BOM_UTF8
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _first_result(document):
+    results = (document.get('query') or {}).get('results') or [{}]
+    return results[0] if isinstance(results[0], dict) else {}
+
+
+class QueryResult(object):
+    """ Response of the API with its common fields as attributes
+
+        :Example:
+
+        >>> from emailage.response import QueryResult
+        >>> result = QueryResult.from_bytes(b'{"query": {"email": "test%40example.com", "results": [{"EAScore": "42",'
+        ...                                 b' "EARiskBand": "Fraud Score 1 to 100", "EAReason": "Low Risk"}]},'
+        ...                                 b' "responseStatus": {"status": "success", "errorCode": "0"}}')
+        >>> result.score, result.band, result.reason
+        (42, 'Fraud Score 1 to 100', 'Low Risk')
+        >>> result['query']['email']
+        'test%40example.com'
+    """
+    __slots__ = ('raw', 'status', 'error_code', 'score', 'band', 'band_id', 'reason', 'reason_id', 'advice',
+                 '_loads', '_document')
+
+    def __init__(self, raw, document, loads=json_backends.get_loads()):
+        """ :param raw: bytes of the response, without Byte Order Mark
+            :param document: decoded response, used to extract the common fields and not retained
+            :param loads: function decoding `raw` when the full document is accessed
+
+            :type raw: bytes
+            :type document: dict
+        """
+        self.raw = raw
+        self._loads = loads
+        self._document = None
+
+        response_status = document.get('responseStatus') or {}
+        self.status = response_status.get('status')
+        self.error_code = response_status.get('errorCode')
+
+        result = _first_result(document)
+        self.score = _int(result.get('EAScore'))
+        self.band = result.get('EARiskBand')
+        self.band_id = _int(result.get('EARiskBandID'))
+        self.reason = result.get('EAReason')
+        self.reason_id = _int(result.get('EAReasonID'))
+        self.advice = result.get('EAAdvice')
+
+    @classmethod
+    def from_bytes(cls, content, loads=json_backends.get_loads()):
+        """ :param content: bytes of the response, as returned by the API
+            :param loads: function decoding BOM-prefixed bytes, see :func:`emailage.json_backends.get_loads`
+            :return: :class:`QueryResult`, whose fields are extracted from a full decoding of `content`
+        """
+        if content.startswith(_BOM):
+            content = content[len(_BOM):]
+        return cls(content, loads(content), loads)
+
+    @property
+    def ok(self):
+        return self.status == 'success'
+
+    def to_dict(self):
+        """ :return: the full response as returned in the default 'dict' response mode, decoded again on first
+            access and kept
+        """
+        if self._document is None:
+            self._document = self._loads(self.raw)
+        return self._document
+
+    def __getitem__(self, key):
+        return self.to_dict()[key]
+
+    def get(self, key, default=None):
+        return self.to_dict().get(key, default)
+
+    def __reduce__(self):
+        # Only the bytes are pickled; the decoding function may be a closure, so the default backend is used
+        return QueryResult.from_bytes, (self.raw,)
+
+    def __repr__(self):
+        return 'QueryResult(status={!r}, score={!r}, band={!r}, reason={!r})'.format(
+            self.status, self.score, self.band, self.reason)
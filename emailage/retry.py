@@ -0,0 +1,221 @@
+"""Retrying of transient failures and fail-fast protection of an unhealthy API"""
+import random
+import threading
+import time
+
+from emailage._clock import now as _now
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit breaker considers the API unhealthy"""
+
+
+class RequestCancelled(Exception):
+    """Raised by a request abandoned by its caller, such as the losing attempt of a hedged query"""
+
+
+class ErrorResponse(ValueError):
+    """ Raised when the API answers with an error status; `status_code` tells retry policies whether it is transient
+
+        :param message: description of the error
+        :param status_code: HTTP status of the response
+    """
+
+    def __init__(self, message, status_code=None):
+        ValueError.__init__(self, message)
+        self.status_code = status_code
+
+    def __reduce__(self):
+        return ErrorResponse, (str(self), self.status_code)
+
+
+class RetryPolicy(object):
+    """ Retries transient failures with exponential backoff and full jitter
+
+        An attempt is retried when it raises a connection error or a timeout, or when the API answers with one of
+        `retry_statuses`, whether the response is returned or raised as an :class:`ErrorResponse`. The delay before retry number n is drawn uniformly from
+        [0, min(backoff_max, backoff_base * 2 ** (n - 1))], so that clients recovering from the same incident do not
+        retry in lockstep.
+
+        :Example:
+
+        >>> from emailage.client import EmailageClient
+        >>> from emailage.retry import RetryPolicy
+        >>> policy = RetryPolicy(max_attempts=4, backoff_base=0.2, total_timeout=5)
+        >>> client = EmailageClient('consumer_secret', 'consumer_token', retry_policy=policy)
+    """
+
+    def __init__(self, max_attempts=3, backoff_base=0.1, backoff_max=5.0, total_timeout=None,
+                 retry_statuses=(429, 500, 502, 503, 504), clock=_now, sleep=time.sleep, rand=random.random):
+        """ :param max_attempts: Maximum number of attempts, the first one included
+            :param backoff_base: Upper bound in seconds of the delay before the first retry
+            :param backoff_max: Upper bound in seconds of the delay before any retry
+            :param total_timeout: (Optional) Seconds after the first attempt beyond which no retry is started
+            :param retry_statuses: HTTP status codes of responses which are retried
+            :param clock: (Optional) Function returning the current time in seconds
+            :param sleep: (Optional) Function used to wait between attempts
+            :param rand: (Optional) Function returning a random float in [0, 1)
+
+            :type max_attempts: int
+            :type backoff_base: float
+            :type backoff_max: float
+            :type total_timeout: float
+            :type retry_statuses: tuple
+        """
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be a positive integer. {} is given.'.format(max_attempts))
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.total_timeout = total_timeout
+        self.retry_statuses = frozenset(retry_statuses)
+        self._clock = clock
+        self._sleep = sleep
+        self._rand = rand
+
+    def backoff(self, retry_number):
+        """ :return: seconds to wait before retry number `retry_number`, starting at 1 """
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (retry_number - 1)))
+        return ceiling * self._rand()
+
+    def is_retryable_exception(self, exc):
+        if isinstance(exc, ErrorResponse):
+            return exc.status_code in self.retry_statuses
+        # Imported here so that the policy can be set up before the HTTP stack is loaded
+        from requests.exceptions import ConnectionError, Timeout
+        return isinstance(exc, (ConnectionError, Timeout))
+
+    def is_retryable_response(self, response):
+        # Decoded results, such as those of flags, carry no status and are final
+        return getattr(response, 'status_code', None) in self.retry_statuses
+
+    def run(self, attempt, on_retry=None, deadline=None):
+        """ Calls `attempt` until it succeeds, fails permanently, or the attempts or time budget are exhausted
+
+            :param attempt: function sending one request and returning its response; it must sign every call afresh
+            :param on_retry: (Optional) function called with the retry number before each retry
+            :param deadline: (Optional) :class:`emailage.deadline.Deadline` after which no retry is started
+            :return: the response of the last attempt; the exception of the last attempt is raised instead, if any
+        """
+        started_at = self._clock()
+        retry_number = 0
+        while True:
+            try:
+                response = attempt()
+            except Exception as exc:
+                if not self.is_retryable_exception(exc) or not self._wait(retry_number + 1, started_at, deadline):
+                    raise
+            else:
+                if not self.is_retryable_response(response) or not self._wait(retry_number + 1, started_at, deadline):
+                    return response
+            retry_number += 1
+            if on_retry is not None:
+                on_retry(retry_number)
+
+    def _wait(self, retry_number, started_at, deadline=None):
+        if retry_number >= self.max_attempts:
+            return False
+        delay = self.backoff(retry_number)
+        if self.total_timeout is not None and self._clock() + delay - started_at > self.total_timeout:
+            return False
+        if deadline is not None and delay >= deadline.remaining():
+            return False
+        self._sleep(delay)
+        return True
+
+
+class CircuitBreaker(object):
+    """ Fails fast while the API is unhealthy and probes it to recover
+
+        After `failure_threshold` consecutive failures (connection errors, timeouts or 5xx responses) the circuit
+        opens and every request fails immediately with :class:`CircuitOpenError`. Once `recovery_timeout` seconds
+        have passed, the circuit is half-open: `half_open_max_calls` probe requests are let through, and the
+        circuit closes again on their success or reopens on their failure.
+
+        A circuit breaker can be shared by several clients which target the same API.
+
+        :Example:
+
+        >>> from emailage.client import EmailageClient
+        >>> from emailage.retry import CircuitBreaker
+        >>> breaker = CircuitBreaker(failure_threshold=5, recovery_timeout=30)
+        >>> client = EmailageClient('consumer_secret', 'consumer_token', circuit_breaker=breaker)
+        >>> breaker.state
+        'closed'
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0, half_open_max_calls=1, clock=_now):
+        """ :param failure_threshold: Consecutive failures which open the circuit
+            :param recovery_timeout: Seconds the circuit stays open before probe requests are let through
+            :param half_open_max_calls: Concurrent probe requests allowed while half-open
+            :param clock: (Optional) Function returning the current time in seconds
+
+            :type failure_threshold: int
+            :type recovery_timeout: float
+            :type half_open_max_calls: int
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probes = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def before_request(self):
+        """ Reserves the right to send a request
+
+            :raises CircuitOpenError: if the circuit is open, or half-open with all its probes in flight
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.OPEN:
+                raise CircuitOpenError('The Emailage API is considered unavailable after {} consecutive failures'
+                                       .format(self._failures))
+            if state == self.HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    raise CircuitOpenError('The Emailage API is being probed for recovery')
+                self._probes += 1
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def release(self):
+        """ Gives back the right reserved by :meth:`before_request` for a request cancelled before its outcome was
+            known, which tells nothing about the health of the API
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+    def record_response(self, response):
+        """ Records the outcome of a request from its response; 5xx statuses count as failures """
+        if response is not None and response.status_code >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
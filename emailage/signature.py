@@ -1,20 +1,20 @@
 """OAuth1 module written according to http://oauth.net/core/1.0/#signing_process"""
 import base64
+import binascii
 import hmac
-import requests  # requests must be loaded so that urllib receives the parse module
+import os
+import re
+import sys
+import threading
 import time
-import urllib
 
 from hashlib import sha1
 from six import b
-from uuid import uuid4
 
-use_parse_quote = not hasattr(urllib, 'quote')
-
-if use_parse_quote:
-    _quote_func = urllib.parse.quote
-else:
-    _quote_func = urllib.quote
+try:
+    from urllib import quote as _quote_func
+except ImportError:
+    from urllib.parse import quote as _quote_func
 
 
 def safety_quote(value):
@@ -25,9 +25,74 @@ def _quote(obj):
     return _quote_func(str(obj), safe='')
 
 
+# Characters every Python version leaves unquoted; '~' is only left alone since Python 3.7
+_is_url_safe = re.compile(r'[A-Za-z0-9_.-]*\Z').match
+
+
+def _quote_value(obj):
+    # Nonces, timestamps and most values match in a fraction of the time quoting takes
+    value = str(obj)
+    if _is_url_safe(value):
+        return value
+    return _quote_func(value, safe='')
+
+
+# Names sent with every request, quoted once and for all
+_QUOTED_KEYS = dict((key, _quote(key)) for key in ['format', 'oauth_consumer_key', 'oauth_nonce', 'oauth_signature',
+                                                    'oauth_signature_method', 'oauth_timestamp', 'oauth_version'])
+
+# Python 3.5+ sends the query string in insertion order, like urllib.parse.urlencode; older versions sort it
+_SORTED_WIRE_ORDER = sys.version_info < (3, 5)
+
+
+class EncodedParams(object):
+    """ Parameters percent-encoded once, from which both the signature base string and the wire form are assembled
+
+        Every name and value is quoted exactly once into a 'name=value' pair; values which are already URL-safe,
+        such as the nonces and timestamps, are used as they are. :meth:`canonical` joins the pairs sorted
+        by name, as signed by OAuth1.0 and sent in POST bodies; :meth:`wire` joins them in the order of the GET query
+        string.
+
+        :Example:
+
+        >>> from emailage.signature import EncodedParams
+        >>> encoded = EncodedParams({'query': 'test+emailage@example.com', 'format': 'json'})
+        >>> encoded.canonical()
+        'format=json&query=test%2Bemailage%40example.com'
+        >>> encoded.add('oauth_signature', 'Xc8k/+A=')
+        >>> encoded.wire()
+        'query=test%2Bemailage%40example.com&format=json&oauth_signature=Xc8k%2F%2BA%3D'
+    """
+    __slots__ = ('_pairs',)
+
+    def __init__(self, params):
+        """ :param params: names and values to encode; values are converted with str()
+
+            :type params: dict
+        """
+        quoted_keys = _QUOTED_KEYS
+        self._pairs = [(key, (quoted_keys.get(key) or _quote(key)) + '=' + _quote_value(value))
+                       for key, value in params.items()]
+
+    def add(self, key, value):
+        """ Appends a parameter, e.g. the signature computed from the others """
+        self._pairs.append((key, (_QUOTED_KEYS.get(key) or _quote(key)) + '=' + _quote_value(value)))
+
+    def canonical(self):
+        """ :return: the pairs sorted by name and joined with '&' """
+        # Names are unique, so the pairs are never compared
+        return '&'.join([pair for _, pair in sorted(self._pairs)])
+
+    def wire(self):
+        """ :return: the pairs joined with '&' in the order of the GET query string """
+        if _SORTED_WIRE_ORDER:
+            return self.canonical()
+        return '&'.join([pair for _, pair in self._pairs])
+
+
 def normalize_query_parameters(params):
     """9.1.1.  Normalize Request Parameters"""
-    return '&'.join(map(lambda pair: '='.join([_quote(pair[0]), _quote(pair[1])]), sorted(params.items())))
+    return EncodedParams(params).canonical()
 
 
 def concatenate_request_elements(method, url, query):
@@ -46,13 +111,118 @@ def encode(digest):
     return base64.b64encode(digest).decode('ascii').rstrip('\n')
 
 
+class NonceGenerator(object):
+    """ Thread-safe source of random nonces drawn from `os.urandom` in batches
+
+        Nonces are lowercase hexadecimal strings, which need no quoting in the query string nor in the base string.
+        The default of 16 random bytes matches the entropy of a version 4 UUID. A forked child discards the nonces
+        drawn by its parent, so that processes never send the same ones.
+
+        :Example:
+
+        >>> from emailage.signature import NonceGenerator
+        >>> next_nonce = NonceGenerator()
+        >>> len(next_nonce())
+        32
+        >>> next_nonce() != next_nonce()
+        True
+    """
+
+    def __init__(self, size=16, batch_size=256, random_bytes=os.urandom):
+        """ :param size: Random bytes per nonce
+            :param batch_size: Nonces drawn at once
+            :param random_bytes: (Optional) Function returning a given number of random bytes, e.g. a seeded one
+                making the nonces deterministic in benchmarks
+
+            :type size: int
+            :type batch_size: int
+        """
+        self.size = size
+        self.batch_size = batch_size
+        self._random_bytes = random_bytes
+        self._lock = threading.Lock()
+        self._nonces = []
+        self._pid = os.getpid()
+
+    def __call__(self):
+        """ :return: a nonce never returned before by this generator, barring random collisions """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._nonces, self._pid = [], os.getpid()
+        # list.pop is atomic, so the lock is only taken to refill
+        try:
+            return self._nonces.pop()
+        except IndexError:
+            pass
+        with self._lock:
+            if not self._nonces:
+                width = 2 * self.size
+                hexadecimal = binascii.hexlify(self._random_bytes(self.size * self.batch_size)).decode('ascii')
+                self._nonces = [hexadecimal[start:start + width] for start in range(0, len(hexadecimal), width)]
+            return self._nonces.pop()
+
+
+class TimestampClock(object):
+    """ Current Unix time in whole seconds, converted to a string once per second
+
+        :Example:
+
+        >>> from emailage.signature import TimestampClock
+        >>> TimestampClock(clock=lambda: 1600000000.75)()
+        '1600000000'
+    """
+
+    def __init__(self, clock=time.time):
+        """ :param clock: (Optional) Function returning the current Unix time in seconds """
+        self._clock = clock
+        # One (expiry, value) tuple, replaced at once, so that threads never see one without the other
+        self._current = (float('-inf'), None)
+
+    def __call__(self):
+        now = self._clock()
+        expires_at, timestamp = self._current
+        if now >= expires_at or now < expires_at - 1:
+            seconds = int(now)
+            timestamp = str(seconds)
+            self._current = (seconds + 1, timestamp)
+        return timestamp
+
+
+_generate_nonce = NonceGenerator()
+_generate_timestamp = TimestampClock()
+
+
+def set_generators(nonce=None, timestamp=None):
+    """ Replaces the functions generating the nonce and the timestamp of the requests which are not given ones
+
+        :param nonce: (Optional) Function without arguments returning a nonce; a :class:`NonceGenerator` if None
+        :param timestamp: (Optional) Function without arguments returning a timestamp; a :class:`TimestampClock`
+            if None
+
+        :Example:
+
+        >>> import itertools
+        >>> from emailage import signature
+        >>> counter = itertools.count()
+        >>> signature.set_generators(nonce=lambda: 'nonce{}'.format(next(counter)), timestamp=lambda: '1600000000')
+        >>> signature.add_oauth_entries_to_fields_dict('secret', {})['oauth_nonce']
+        'nonce0'
+        >>> signature.set_generators()
+    """
+    global _generate_nonce, _generate_timestamp
+    _generate_nonce = nonce or NonceGenerator()
+    _generate_timestamp = timestamp or TimestampClock()
+
+
 def add_oauth_entries_to_fields_dict(secret, params, nonce=None, timestamp=None):
     """ Adds dict entries to the user's params dict which are required for OAuth1.0 signature generation
 
         :param secret: API secret
         :param params: dictionary of values which will be sent in the query
-        :param nonce: (Optional) random string used in signature creation, uuid4() is used if not provided
-        :param timestamp: (Optional) integer-format timestamp, time.time() is used if not provided
+        :param nonce: (Optional) random string used in signature creation, generated if not provided,
+            see :func:`set_generators`
+        :param timestamp: (Optional) integer-format timestamp, the current time if not provided
         :return: dict containing params and the OAuth1.0 fields required before executing signature.create
 
         :type secret: str
@@ -75,9 +245,9 @@ def add_oauth_entries_to_fields_dict(secret, params, nonce=None, timestamp=None)
         1.0
     """
     if nonce is None:
-        nonce = uuid4()
+        nonce = _generate_nonce()
     if timestamp is None:
-        timestamp = int(time.time())
+        timestamp = _generate_timestamp()
 
     params['oauth_consumer_key'] = secret
     params['oauth_nonce'] = nonce
@@ -120,3 +290,52 @@ def create(method, url, params, hmac_key):
     base_string = concatenate_request_elements(method, url, query)
     digest = hmac_sha1(base_string, hmac_key)
     return encode(digest)
+
+
+class Signer(object):
+    """ Creates OAuth1.0 signatures for one hmac key and one (method, url) pair
+
+        The keyed HMAC-SHA1 state and the quoted method and URL part of the base string are computed once; every
+        signature starts from a copy of them. The signatures are identical to the ones returned by :func:`create`.
+
+        :Example:
+
+        >>> from emailage.signature import Signer
+        >>> signer = Signer('kd94hf93k423kf44&pfkkdhi9sl3r4s00', 'GET', 'http://photos.example.net/photos')
+        >>> signer.sign(dict(oauth_consumer_key='dpf43f3p2l4k3l03', oauth_token='nnch734d00sl2jdk',
+        ...                  oauth_signature_method='HMAC-SHA1', oauth_timestamp=1191242096,
+        ...                  oauth_nonce='kllo9940pd9333jh', oauth_version=1.0, file='vacation.jpg', size='original'))
+        'tR3+Ty81lMeYAr/Fid0kMTYa/WM='
+    """
+
+    def __init__(self, hmac_key, method, url):
+        """ :param hmac_key: for Emailage users, this is your consumer token with an '&' (ampersand) appended
+            :param method: HTTP method that will be used to send the requests ( 'GET' | 'POST' )
+            :param url: API domain and endpoint up to the ?
+
+            :type hmac_key: str
+            :type method: str
+            :type url: str
+        """
+        self._keyed_hmac = hmac.new(b(hmac_key), digestmod=sha1)
+        self._base_string_prefix = b(concatenate_request_elements(method, url, ''))
+
+    def sign(self, params):
+        """ :param params: user-provided query string parameters and the OAuth1.0 parameters
+            :return: str value used for oauth_signature
+
+            :type params: dict
+        """
+        return self.sign_encoded(EncodedParams(params))
+
+    def sign_encoded(self, encoded):
+        """ :param encoded: user-provided query string parameters and the OAuth1.0 parameters, already encoded
+            :return: str value used for oauth_signature
+
+            :type encoded: :class:`EncodedParams`
+        """
+        query = encoded.canonical()
+        digest = self._keyed_hmac.copy()
+        digest.update(self._base_string_prefix)
+        digest.update(b(_quote(query)))
+        return encode(digest.digest())
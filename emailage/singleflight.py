@@ -0,0 +1,91 @@
+"""Coalescing of identical calls made while one of them is in flight"""
+import threading
+
+from collections import namedtuple
+
+from emailage.deadline import DeadlineExceeded
+
+
+FlightStats = namedtuple('FlightStats', ['calls', 'coalesced', 'in_flight'])
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Runs one call per key at a time; threads asking for a key already in flight wait for and share its outcome
+
+        The result, or the exception, of the call is handed to every thread which asked for the key while it was in
+        flight, so shared results must not be mutated. Nothing is remembered once the call completes; combine with
+        :class:`emailage.cache.ResponseCache` to also reuse completed results.
+
+        :Example:
+
+        >>> from emailage.singleflight import SingleFlight
+        >>> flights = SingleFlight()
+        >>> flights.do('test@example.com', lambda: 'response')
+        'response'
+        >>> flights.stats
+        FlightStats(calls=1, coalesced=0, in_flight=0)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(self, key, func, timeout=None):
+        """ Calls `func` unless a call for `key` is already in flight, in which case its outcome is awaited
+
+            :param key: hashable identity of the call
+            :param func: function without arguments making the call
+            :param timeout: (Optional) Maximum seconds to await the call; the call itself is not bounded, and goes on
+                for the other callers when this one gives up
+            :return: the result of the call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._executed += 1
+            else:
+                self._coalesced += 1
+
+        if leader:
+            if timeout is None:
+                self._run(key, call, func)
+            else:
+                # The first caller waits like the others, so that its timeout does not decide the outcome of theirs
+                thread = threading.Thread(target=self._run, args=(key, call, func), name='emailage-singleflight')
+                thread.daemon = True
+                thread.start()
+
+        if not call.done.wait(timeout):
+            raise DeadlineExceeded('Deadline exceeded while awaiting the call in flight for the same key')
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _run(self, key, call, func):
+        try:
+            call.result = func()
+        except Exception as exc:
+            call.error = exc
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    @property
+    def stats(self):
+        """ :return: calls made, calls coalesced into one in flight, and keys currently in flight """
+        with self._lock:
+            return FlightStats(self._executed, self._coalesced, len(self._calls))
@@ -0,0 +1,205 @@
+"""Persistent cache of query responses in a SQLite file, shared by the processes of one host"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+from emailage.cache import CacheStats
+from emailage.response import QueryResult
+
+
+_JSON = 'json'
+_QUERY_RESULT = 'query_result'
+
+_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS responses ('
+    ' key TEXT PRIMARY KEY,'
+    ' tag TEXT,'
+    ' kind TEXT NOT NULL,'
+    ' value BLOB NOT NULL,'
+    ' expires_at REAL NOT NULL,'
+    ' accessed_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS responses_tag ON responses (tag)',
+    'CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)',
+]
+
+
+def _encode(value):
+    if isinstance(value, QueryResult):
+        return _QUERY_RESULT, sqlite3.Binary(value.raw)
+    return _JSON, sqlite3.Binary(json.dumps(value, separators=(',', ':')).encode('utf_8'))
+
+
+def _decode(kind, value):
+    if kind == _QUERY_RESULT:
+        return QueryResult.from_bytes(bytes(value))
+    return json.loads(bytes(value).decode('utf_8'))
+
+
+class _ThreadConnection(object):
+    """Connection of one thread, closed once the thread has ended and its thread-local data is dropped"""
+    __slots__ = ('connection', 'pid', '__weakref__')
+
+    def __init__(self, connection, pid):
+        self.connection = connection
+        self.pid = pid
+
+
+def _close_connection(lock, connections, connection, pid):
+    with lock:
+        connections.discard(connection)
+    # A connection opened before a fork is left to the process which opened it
+    if os.getpid() == pid:
+        connection.close()
+
+
+class SQLiteResponseCache(object):
+    """ Cache of API responses in a SQLite file, with TTL expiry and LRU eviction, which survives restarts
+
+        The file can be shared by the threads and processes of one host: it is opened in write-ahead-log mode, each
+        thread and process uses its own connection, closed when the thread ends, and nothing is loaded into memory
+        when the cache is opened.
+        It has the interface of :class:`emailage.cache.ResponseCache` and plugs into `EmailageClient(cache=...)`.
+
+        Expiry uses wall-clock time, so that entries stay valid across restarts. The number of entries is brought
+        back to `max_entries` every `eviction_interval` writes of a process, so it may exceed it in between. The hit,
+        miss, eviction and expiration counters are those of the current instance.
+
+        :Example:
+
+        >>> from emailage.client import EmailageClient
+        >>> from emailage.sqlite_cache import SQLiteResponseCache
+        >>> cache = SQLiteResponseCache('/var/cache/emailage/responses.sqlite3', ttl=24 * 3600, max_entries=1000000)
+        >>> client = EmailageClient('consumer_secret', 'consumer_token', cache=cache)
+        >>> fraud_report = client.query('useremail@example.co.uk', use_cache=True)
+    """
+
+    def __init__(self, path, ttl=300, max_entries=10000, eviction_interval=100, timeout=30.0, clock=time.time):
+        """ :param path: Path of the SQLite file, created if needed
+            :param ttl: Seconds a response stays valid after it was stored
+            :param max_entries: Maximum number of stored responses; the least recently used ones are evicted first
+            :param eviction_interval: (Optional) Writes between two enforcements of `max_entries`
+            :param timeout: (Optional) Seconds to wait for a lock held by another connection
+            :param clock: (Optional) Function returning the current wall-clock time in seconds
+
+            :type path: str
+            :type ttl: float
+            :type max_entries: int
+            :type eviction_interval: int
+            :type timeout: float
+        """
+        if max_entries < 1:
+            raise ValueError('max_entries must be a positive integer. {} is given.'.format(max_entries))
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.eviction_interval = max(1, eviction_interval)
+        self.timeout = timeout
+        self._clock = clock
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._writes = 0
+        self._hits = self._misses = self._evictions = self._expirations = 0
+
+        with self._connection() as connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self):
+        local = getattr(self._local, 'connection', None)
+        # A connection must not be used across a fork
+        if local is None or local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            local = self._local.connection = _ThreadConnection(connection, os.getpid())
+            with self._lock:
+                self._connections.add(connection)
+            # Thread pools come and go, such as those of `query_many`; their connections go with their threads
+            weakref.finalize(local, _close_connection, self._lock, self._connections, connection, local.pid)
+        return local.connection
+
+    def _count(self, **counters):
+        with self._lock:
+            for name, amount in counters.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get(self, key):
+        """ :return: the cached response for `key`, or None if there is no fresh entry """
+        connection = self._connection()
+        row = connection.execute('SELECT kind, value, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self._count(_misses=1)
+            return None
+        kind, value, expires_at = row
+        now = self._clock()
+        if expires_at <= now:
+            connection.execute('DELETE FROM responses WHERE key = ? AND expires_at <= ?', (key, now))
+            self._count(_misses=1, _expirations=1)
+            return None
+        connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+        self._count(_hits=1)
+        return _decode(kind, value)
+
+    def put(self, key, value, tag=None):
+        """ Stores `value` under `key`
+
+            :param value: response dict, or :class:`emailage.response.QueryResult`
+            :param tag: (Optional) value passed to :meth:`invalidate` to drop this entry
+        """
+        kind, encoded = _encode(value)
+        now = self._clock()
+        self._connection().execute(
+            'INSERT OR REPLACE INTO responses (key, tag, kind, value, expires_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)', (key, tag, kind, encoded, now + self.ttl, now))
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.eviction_interval == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """ Drops the expired entries, then the least recently used ones beyond `max_entries` """
+        connection = self._connection()
+        expired = connection.execute('DELETE FROM responses WHERE expires_at <= ?', (self._clock(),)).rowcount
+        excess = len(self) - self.max_entries
+        evicted = 0
+        if excess > 0:
+            evicted = connection.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at LIMIT ?)',
+                (excess,)).rowcount
+        self._count(_expirations=expired, _evictions=evicted)
+
+    def invalidate(self, tag):
+        """ Drops every entry stored with `tag`
+
+            :return: number of dropped entries
+        """
+        return self._connection().execute('DELETE FROM responses WHERE tag = ?', (tag,)).rowcount
+
+    def clear(self):
+        """ Drops every entry; the counters are kept """
+        self._connection().execute('DELETE FROM responses')
+
+    @property
+    def stats(self):
+        """ :return: :class:`emailage.cache.CacheStats` snapshot of the counters and the current size """
+        size = len(self)
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, self._expirations, size)
+
+    def close(self):
+        """ Closes the connections of every thread; the cache reopens one if it is used afterwards """
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
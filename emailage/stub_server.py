@@ -0,0 +1,492 @@
+"""Local stand-in for the Emailage API, for load, latency and failure testing without the sandbox
+
+The stub serves ``/emailagevalidator/`` and ``/emailagevalidator/flag/`` over plain HTTP/1.1, and over HTTP/2 with
+prior knowledge (h2c) when the `h2` package is installed. It checks the OAuth1 signature of every request with
+:mod:`emailage.signature`, and answers BOM-prefixed JSON shaped like the responses of the API. Scores are derived
+from the queried email, so the same query always gets the same response.
+
+Latency, server errors, 429 throttling and dropped connections can be injected to exercise the retry, circuit
+breaker, pooling and caching behaviour of the client:
+
+:Example:
+
+    >>> from emailage.client import EmailageClient
+    >>> from emailage.stub_server import StubServer
+    >>> with StubServer('consumer_secret', 'consumer_token', latency=0.02, latency_sigma=0.5) as stub:
+    ...     client = EmailageClient('consumer_secret', 'consumer_token')
+    ...     client.set_api_domain(stub.url)
+    ...     client.query('test@example.com')['query']['results'][0]['EARiskBand']
+    'Fraud Score 101 to 300'
+
+From the command line::
+
+    $ emailage-stub --secret consumer_secret --token consumer_token --port 8080 --latency 0.05 --rate-limit 200
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import unquote
+
+from emailage import signature
+from emailage.ratelimit import TokenBucket
+
+
+QUERY_PATH = '/emailagevalidator/'
+FLAG_PATH = '/emailagevalidator/flag/'
+
+DROPPED = 'dropped'
+AUTHENTICATION_FAILURES = 'authentication_failures'
+
+_HTTP2_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+
+_RISK_BANDS = [
+    (100, 1, 'Fraud Score 1 to 100', 1, 'Lower Fraud Risk'),
+    (300, 2, 'Fraud Score 101 to 300', 1, 'Lower Fraud Risk'),
+    (600, 3, 'Fraud Score 301 to 600', 2, 'Moderate Fraud Risk'),
+    (799, 4, 'Fraud Score 601 to 799', 3, 'Review'),
+    (899, 5, 'Fraud Score 800 to 899', 4, 'Higher Fraud Risk'),
+    (999, 6, 'Fraud Score 900 to 999', 5, 'Fraud Review'),
+]
+_REASONS = [
+    (1, 'Fraud Level X'), (2, 'Email does not exist'), (3, 'Domain does not exist'), (4, 'Risky Domain'),
+    (5, 'Risky Country'), (6, 'Risky Email Name'), (7, 'Numeric Email'), (8, 'Limited History for Email'),
+    (9, 'Email Recently Created'), (10, 'Email linked to High Risk Account'), (11, 'Good Level X'),
+    (12, 'Low Risk Domain'), (13, 'Email Created X Years Ago'), (14, 'Email Created at least X Years Ago'),
+]
+
+_SUCCESS_STATUS = {'status': 'success', 'errorCode': '0', 'description': ''}
+
+
+def _parse_pairs(encoded):
+    """Decodes `a=1&b=2` strings percent-encoded by the client; `+` is kept as is, like the API does"""
+    params = {}
+    for pair in encoded.split('&'):
+        if pair:
+            name, _, value = pair.partition('=')
+            params[unquote(name)] = unquote(value)
+    return params
+
+
+def _failed_status(error_code, description):
+    return {'status': 'failed', 'errorCode': error_code, 'description': description}
+
+
+def score_result(email, ip=''):
+    """ :return: the result entry of a query, derived deterministically from `email` """
+    score = int(hashlib.sha1(email.lower().encode('utf_8')).hexdigest()[:8], 16) % 1000
+    for ceiling, band_id, band, advice_id, advice in _RISK_BANDS:
+        if score <= ceiling:
+            break
+    reason_id, reason = _REASONS[score % len(_REASONS)]
+    return {
+        'email': email,
+        'ipaddress': ip,
+        'eName': '',
+        'status': 'Verified',
+        'fraudRisk': '{} {}'.format(score, advice.split(' ')[0]),
+        'EAScore': str(score),
+        'EAReason': reason,
+        'EAReasonID': str(reason_id),
+        'EAStatusID': '4',
+        'EAAdvice': advice,
+        'EAAdviceID': str(advice_id),
+        'EARiskBand': band,
+        'EARiskBandID': str(band_id),
+    }
+
+
+def _respond(stub, method, target, host, body):
+    """ Answers one request, whatever the HTTP version it came with
+
+        :return: tuple of (status, BOM-prefixed JSON body, extra headers), or None to drop the request
+    """
+    path, _, query_string = target.partition('?')
+
+    delay = stub.draw_latency()
+    if delay:
+        time.sleep(delay)
+
+    headers = {}
+    outcome = stub.draw_failure()
+    if outcome == DROPPED:
+        stub.count(DROPPED)
+        return None
+    if outcome == 429:
+        status, document = 429, {'responseStatus': _failed_status('429', 'Too Many Requests')}
+        headers['Retry-After'] = str(int(math.ceil(stub.retry_after())))
+    elif outcome is not None:
+        status, document = outcome, {'responseStatus': _failed_status(str(outcome), 'Internal Server Error')}
+    elif path not in (QUERY_PATH, FLAG_PATH):
+        status, document = 404, {'responseStatus': _failed_status('404', 'Not Found')}
+    else:
+        signed_params = _parse_pairs(query_string)
+        error = stub.authenticate(method, 'http://' + host + path, signed_params)
+        if error is not None:
+            stub.count(AUTHENTICATION_FAILURES)
+            status, document = 200, {'responseStatus': error}
+        else:
+            params = _parse_pairs(body) if method == 'POST' else signed_params
+            status = 200
+            document = stub.flag_response(params) if path == FLAG_PATH else stub.query_response(params)
+
+    stub.count(status)
+    return status, json.dumps(document).encode('utf_8_sig'), headers
+
+
+class _StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The status line, headers and body are written separately; without TCP_NODELAY every response waits for a
+    # delayed ACK
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.server.stub.count_connection()
+        if self.connection.recv(len(_HTTP2_PREFACE), socket.MSG_PEEK) == _HTTP2_PREFACE:
+            return _Http2Connection(self.server.stub, self.connection).serve()
+        BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def log_message(self, *args):
+        if self.server.stub.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, *args)
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf_8') if length else ''
+        response = _respond(self.server.stub, self.command, self.path, self.headers.get('Host', ''), body)
+        if response is None:
+            self.close_connection = True
+            return
+
+        status, body, headers = response
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Http2Connection(object):
+    """HTTP/2 with prior knowledge over one socket; every stream is answered on its own thread"""
+
+    def __init__(self, stub, sock):
+        import h2.config
+        import h2.connection
+
+        self.stub = stub
+        self.sock = sock
+        self.connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False,
+                                                                               header_encoding='utf_8'))
+        # Guards the connection state and the writes to the socket; notified when the peer opens its windows
+        self.lock = threading.Condition()
+        self.requests = {}
+
+    def _flush(self):
+        data = self.connection.data_to_send()
+        if data:
+            self.sock.sendall(data)
+
+    def serve(self):
+        import h2.events
+        import h2.exceptions
+
+        with self.lock:
+            self.connection.initiate_connection()
+            self._flush()
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except socket.error:
+                data = b''
+            if not data:
+                return
+            with self.lock:
+                try:
+                    events = self.connection.receive_data(data)
+                except h2.exceptions.ProtocolError:
+                    # h2 has queued a GOAWAY frame
+                    self._flush()
+                    return
+                for event in events:
+                    if isinstance(event, h2.events.RequestReceived):
+                        self.requests[event.stream_id] = (dict(event.headers), bytearray())
+                    elif isinstance(event, h2.events.DataReceived):
+                        self.requests[event.stream_id][1].extend(event.data)
+                        self.connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.WindowUpdated):
+                        self.lock.notify_all()
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        self._flush()
+                        return
+                self._flush()
+            for event in events:
+                if isinstance(event, h2.events.StreamEnded):
+                    worker = threading.Thread(target=self._answer, args=(event.stream_id,))
+                    worker.daemon = True
+                    worker.start()
+
+    def _answer(self, stream_id):
+        import h2.errors
+        import h2.exceptions
+
+        with self.lock:
+            headers, body = self.requests.pop(stream_id)
+        response = _respond(self.stub, headers.get(':method'), headers.get(':path', ''),
+                            headers.get(':authority', ''), body.decode('utf_8'))
+        try:
+            with self.lock:
+                if response is None:
+                    self.connection.reset_stream(stream_id, h2.errors.ErrorCodes.INTERNAL_ERROR)
+                    return self._flush()
+                status, body, extra_headers = response
+                self.connection.send_headers(stream_id, [
+                    (':status', str(status)),
+                    ('content-type', 'application/json; charset=utf-8'),
+                    ('content-length', str(len(body)))] + [(name.lower(), value) for name, value in extra_headers.items()])
+                while body:
+                    while self.connection.local_flow_control_window(stream_id) < 1:
+                        self.lock.wait()
+                    size = min(len(body), self.connection.local_flow_control_window(stream_id),
+                               self.connection.max_outbound_frame_size)
+                    self.connection.send_data(stream_id, body[:size], end_stream=size == len(body))
+                    body = body[size:]
+                    self._flush()
+        except (h2.exceptions.ProtocolError, socket.error):
+            # The stream was reset or the connection closed while the response was prepared
+            pass
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # Clients close the connections of the requests they cancel, such as the losing attempts of hedged queries
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+class StubServer(object):
+    """ Threaded HTTP server answering like the Emailage API for one set of credentials
+
+        Every request is first delayed by the latency drawn for it, then may fail: it is dropped with probability
+        `drop_rate`, throttled with 429 when `rate_limit` is exceeded or with probability `throttle_rate`, or
+        answered with a 500 or 503 with probability `error_rate`. Requests with a wrong consumer key or signature
+        get an authentication error response, like from the API.
+    """
+
+    def __init__(self, secret, token, host='127.0.0.1', port=0, latency=0.0, latency_sigma=0.0, error_rate=0.0,
+                 drop_rate=0.0, rate_limit=None, throttle_rate=0.0, seed=None, verbose=False):
+        """ :param secret: Consumer secret the requests must be sent with
+            :param token: Consumer token the requests must be signed with
+            :param host: (Optional) Interface to listen on, the loopback one by default
+            :param port: (Optional) Port to listen on; a free one is picked by default
+            :param latency: (Optional) Median seconds before each request is answered, or a function returning them
+            :param latency_sigma:
+                (Optional) Shape of the log-normal latency distribution; 0 for a constant latency, 0.5 to 1 for the
+                long tail of real networks
+            :param error_rate: (Optional) Fraction of requests answered with a 500 or 503
+            :param drop_rate: (Optional) Fraction of connections closed without any response
+            :param rate_limit: (Optional) Requests per second beyond which 429 is answered
+            :param throttle_rate: (Optional) Fraction of requests answered with 429 regardless of the rate
+            :param seed: (Optional) Seed of the random draws, for reproducible runs
+            :param verbose: (Optional) Log every request to stderr
+
+            :type secret: str
+            :type token: str
+            :type latency: float | callable
+            :type latency_sigma: float
+            :type error_rate: float
+            :type drop_rate: float
+            :type rate_limit: float
+            :type throttle_rate: float
+        """
+        self.secret = secret
+        self.hmac_key = token + '&'
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.throttle_rate = throttle_rate
+        self.verbose = verbose
+        self._bucket = TokenBucket(rate_limit) if rate_limit else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        self._connections = 0
+        self._signers = {}
+        self._thread = None
+
+        self.httpd = _ThreadingHTTPServer((host, port), _StubHandler)
+        self.httpd.stub = self
+
+    @property
+    def url(self):
+        """The domain to pass to `EmailageClient.set_api_domain`"""
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """Serves in a background daemon thread"""
+        # A short poll interval keeps stop() quick
+        self._thread = threading.Thread(target=self.httpd.serve_forever, kwargs=dict(poll_interval=0.05))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        """ :return: dict of the responses sent by status, plus `dropped` and `authentication_failures` counts """
+        with self._lock:
+            return dict(self._stats)
+
+    def count(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def count_connection(self):
+        with self._lock:
+            self._connections += 1
+
+    @property
+    def connections(self):
+        """Number of connections accepted so far"""
+        with self._lock:
+            return self._connections
+
+    def draw_latency(self):
+        if callable(self.latency):
+            return self.latency()
+        if not self.latency or not self.latency_sigma:
+            return self.latency
+        with self._lock:
+            return self._random.lognormvariate(math.log(self.latency), self.latency_sigma)
+
+    def draw_failure(self):
+        """ :return: None to answer normally, `DROPPED`, or the HTTP status to fail with """
+        with self._lock:
+            draw = self._random.random()
+            server_error = self._random.choice([500, 503])
+        if draw < self.drop_rate:
+            return DROPPED
+        draw -= self.drop_rate
+        if draw < self.throttle_rate:
+            return 429
+        draw -= self.throttle_rate
+        if draw < self.error_rate:
+            return server_error
+        if self._bucket is not None and self._bucket.try_acquire():
+            return 429
+        return None
+
+    def retry_after(self):
+        return 1 / self._bucket.rate if self._bucket is not None else 1
+
+    def authenticate(self, method, url, params):
+        """ :return: None if `params` are signed for these credentials, otherwise the failed responseStatus """
+        if params.get('oauth_consumer_key') != self.secret:
+            return _failed_status('3001', 'Authentication Error: The consumer key is not valid.')
+        received_signature = params.pop('oauth_signature', None)
+        with self._lock:
+            signer = self._signers.get((method, url))
+            if signer is None:
+                signer = self._signers[(method, url)] = signature.Signer(self.hmac_key, method, url)
+        if received_signature != signer.sign(params):
+            return _failed_status('3001', 'Authentication Error: The signature does not match the expected value.')
+        return None
+
+    def query_response(self, params):
+        query = params.get('query', '')
+        email, ip = query, ''
+        if '@' not in query:
+            email, ip = '', query
+        elif '+' in query and '@' not in query.rsplit('+', 1)[1]:
+            email, ip = query.rsplit('+', 1)
+        return {
+            'query': {
+                'email': query,
+                'queryType': 'EmailAgeVerification' if email else 'IPVerification',
+                'count': 1,
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'lang': 'en-US',
+                'responseCount': 1,
+                'results': [score_result(email or ip, ip)],
+            },
+            'responseStatus': dict(_SUCCESS_STATUS),
+        }
+
+    def flag_response(self, params):
+        query = {'email': params.get('query', ''), 'flag': params.get('flag', '')}
+        if 'fraudcodeID' in params:
+            query['fraudcodeID'] = params['fraudcodeID']
+        return {'query': query, 'responseStatus': dict(_SUCCESS_STATUS)}
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='emailage-stub', description='Local stand-in for the Emailage API.')
+    parser.add_argument('--secret', required=True, help='consumer secret the clients use')
+    parser.add_argument('--token', required=True, help='consumer token the clients use')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='median latency in seconds')
+    parser.add_argument('--latency-sigma', type=float, default=0.0, help='shape of the log-normal latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of 500 and 503 responses')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='fraction of dropped connections')
+    parser.add_argument('--rate-limit', type=float, help='requests per second beyond which 429 is answered')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of 429 responses')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    stub = StubServer(args.secret, args.token, host=args.host, port=args.port, latency=args.latency,
+                      latency_sigma=args.latency_sigma, error_rate=args.error_rate, drop_rate=args.drop_rate,
+                      rate_limit=args.rate_limit, throttle_rate=args.throttle_rate, seed=args.seed,
+                      verbose=args.verbose)
+    print('Serving the Emailage API stub on {}'.format(stub.url), file=sys.stderr)
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.httpd.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""Submission of flags in the background, off the latency path of the caller"""
+import atexit
+import logging
+import threading
+import weakref
+
+from collections import OrderedDict, namedtuple
+
+from emailage._clock import now as _now
+from emailage.retry import RetryPolicy
+
+
+logger = logging.getLogger(__name__)
+
+
+FlagRequest = namedtuple('FlagRequest', ['flag', 'query', 'fraud_code'])
+
+SubmitterStats = namedtuple('SubmitterStats', ['submitted', 'deduplicated', 'sent', 'retries', 'dead_lettered',
+                                               'pending'])
+
+
+class QueueFullError(Exception):
+    """Raised when a flag could not be queued because the queue stayed full for the allowed time"""
+
+
+class FlagRejected(Exception):
+    """ Reported to the dead-letter callback when the API answers a flag with an error status
+
+        :param response: the response of the API
+    """
+
+    def __init__(self, message, response):
+        super(FlagRejected, self).__init__(message)
+        self.response = response
+
+
+def _close_at_exit(reference):
+    submitter = reference()
+    if submitter is not None:
+        submitter.close()
+
+
+class _Pending(object):
+    __slots__ = ('request', 'due_at')
+
+    def __init__(self, request, due_at):
+        self.request = request
+        self.due_at = due_at
+
+
+def _dedup_key(query):
+    return query.strip().lower()
+
+
+class FlagSubmitter(object):
+    """ Queues flags and sends them from background threads, so that callers do not wait for the API
+
+        :meth:`flag` validates its arguments, queues the flag and returns immediately. A queued flag is held for
+        `flush_interval` seconds, during which further flags of the same email replace it, so that one request
+        carries the latest flag of the window. Worker threads then send it with the client through `retry_policy`,
+        which retries connection errors and timeouts; re-sending a flag is harmless since it sets the same state
+        again. A flag which still fails, fails permanently or is rejected by the API is handed to `on_dead_letter`
+        together with the error. Errors of the callback are logged and do not stop the workers.
+
+        Flags of one email are never sent concurrently, so they reach the API in the order they were queued.
+        :meth:`close` sends what is still queued; unless `flush_at_exit` is False, it is also called when the
+        interpreter exits.
+
+        :Example:
+
+        >>> from emailage.client import EmailageClient
+        >>> from emailage.submitter import FlagSubmitter
+        >>> client = EmailageClient('consumer_secret', 'consumer_token')
+        >>> submitter = FlagSubmitter(client, workers=4, on_dead_letter=lambda request, error: log.error(request))
+        >>> submitter.flag('fraud', 'test@example.com', fraud_code=8)
+        >>> submitter.close()
+    """
+
+    def __init__(self, client, workers=2, max_queue_size=10000, flush_interval=1.0, retry_policy=None,
+                 on_dead_letter=None, flush_at_exit=True, clock=_now):
+        """ :param client: client sending the flags
+            :param workers: (Optional) Number of flags sent concurrently
+            :param max_queue_size: (Optional) Maximum number of queued flags not yet sent
+            :param flush_interval: (Optional) Seconds a flag is held to absorb later flags of the same email
+            :param retry_policy: (Optional) Retries of failing flags; 3 attempts by default
+            :param on_dead_letter: (Optional) Function called with the :class:`FlagRequest` and the error of every
+                flag which could not be sent
+            :param flush_at_exit: (Optional) Send the queued flags when the interpreter exits
+            :param clock: (Optional) Function returning the current time in seconds
+
+            :type client: :class:`emailage.client.EmailageClient`
+            :type workers: int
+            :type max_queue_size: int
+            :type flush_interval: float
+            :type retry_policy: :class:`emailage.retry.RetryPolicy`
+            :type flush_at_exit: bool
+        """
+        if max_queue_size < 1:
+            raise ValueError('max_queue_size must be a positive integer. {} is given.'.format(max_queue_size))
+        self.client = client
+        self.max_queue_size = max_queue_size
+        self.flush_interval = flush_interval
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.on_dead_letter = on_dead_letter
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending = OrderedDict()
+        self._in_flight = set()
+        self._flushing = 0
+        self._closed = False
+        self._submitted = self._deduplicated = self._sent = self._retries = self._dead_lettered = 0
+
+        self._workers = [threading.Thread(target=self._work, name='emailage-flag-{}'.format(number))
+                         for number in range(workers)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+        if flush_at_exit:
+            # A weak reference, so that closed submitters and their clients are not kept until the interpreter exits
+            atexit.register(_close_at_exit, weakref.ref(self))
+
+    def flag(self, flag, query, fraud_code=None, block=True, timeout=None):
+        """ Queues a flag, see :meth:`emailage.client.EmailageClient.flag`
+
+            :param flag: type of flag you wish to associate with the identifier ( 'fraud' | 'good' | 'neutral' )
+            :param query: Email to be flagged
+            :param fraud_code: (Optional) Required if flag is 'fraud'
+            :param block: (Optional) Wait for room in a full queue; raise :class:`QueueFullError` at once when False
+            :param timeout: (Optional) Maximum seconds to wait for room in the queue; no limit by default
+
+            :type flag: str
+            :type query: str
+            :type fraud_code: int
+        """
+        # Invalid flags fail in the caller rather than in the dead-letter callback
+        self.client._flag_params(flag, query, fraud_code)
+        request = FlagRequest(flag, query, fraud_code)
+        key = _dedup_key(query)
+
+        with self._changed:
+            if self._closed:
+                raise RuntimeError('Cannot queue a flag on a closed FlagSubmitter')
+            queued = self._pending.get(key)
+            if queued is not None:
+                queued.request = request
+                self._deduplicated += 1
+                return
+
+            deadline = None if timeout is None else self._clock() + timeout
+            while len(self._pending) >= self.max_queue_size:
+                remaining = None if deadline is None else deadline - self._clock()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise QueueFullError('{} flags are already queued'.format(len(self._pending)))
+                self._changed.wait(remaining)
+                if self._closed:
+                    raise RuntimeError('Cannot queue a flag on a closed FlagSubmitter')
+            self._pending[key] = _Pending(request, self._clock() + self.flush_interval)
+            self._submitted += 1
+            self._changed.notify_all()
+
+    def flag_as_fraud(self, query, fraud_code, **options):
+        """Queues a fraud flag, see :meth:`flag`"""
+        self.flag('fraud', query, fraud_code, **options)
+
+    def flag_as_good(self, query, **options):
+        """Queues a good flag, see :meth:`flag`"""
+        self.flag('good', query, **options)
+
+    def remove_flag(self, query, **options):
+        """Queues the removal of a flag, see :meth:`flag`"""
+        self.flag('neutral', query, **options)
+
+    def _next(self):
+        """ :return: (key, request) of the next flag to send, or None once closed and drained """
+        with self._changed:
+            while True:
+                now = self._clock()
+                wait = None
+                for key, pending in self._pending.items():
+                    if key in self._in_flight:
+                        continue
+                    if self._flushing or pending.due_at <= now:
+                        del self._pending[key]
+                        self._in_flight.add(key)
+                        self._changed.notify_all()
+                        return key, pending.request
+                    wait = pending.due_at - now
+                    break
+                if self._closed and not self._pending:
+                    return None
+                self._changed.wait(wait)
+
+    def _work(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            key, request = job
+            try:
+                self._send(request)
+            except Exception:
+                # A worker which died would leave the queue, and close() with it, waiting forever
+                logger.exception('Could not send %r', request)
+            finally:
+                with self._changed:
+                    self._in_flight.discard(key)
+                    self._changed.notify_all()
+
+    def _send(self, request):
+        try:
+            response = self.retry_policy.run(lambda: self.client.flag(request.flag, request.query, request.fraud_code),
+                                             lambda retry_number: self._count(_retries=1))
+            response_status = response.get('responseStatus') or {}
+        except Exception as exc:
+            return self._dead_letter(request, exc)
+
+        if response_status.get('status') != 'success':
+            return self._dead_letter(request, FlagRejected('Flag rejected with error code {}: {}'.format(
+                response_status.get('errorCode'), response_status.get('description')), response))
+        return self._count(_sent=1)
+
+    def _dead_letter(self, request, error):
+        self._count(_dead_lettered=1)
+        if self.on_dead_letter is not None:
+            try:
+                self.on_dead_letter(request, error)
+            except Exception:
+                logger.exception('The dead-letter callback failed for %r', request)
+
+    def _count(self, **counters):
+        with self._lock:
+            for name, amount in counters.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def flush(self, timeout=None):
+        """ Sends every queued flag now, without waiting for the end of its window, and waits until they are sent
+
+            :param timeout: (Optional) Maximum seconds to wait; no limit by default
+            :return: True if every flag was sent or dead-lettered in time
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._changed:
+            self._flushing += 1
+            self._changed.notify_all()
+            try:
+                while self._pending or self._in_flight:
+                    remaining = None if deadline is None else deadline - self._clock()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._changed.wait(remaining)
+                return True
+            finally:
+                self._flushing -= 1
+
+    def close(self, timeout=None):
+        """ Stops accepting flags, sends the queued ones and stops the workers
+
+            :param timeout: (Optional) Maximum seconds to wait for the queued flags; no limit by default
+            :return: True if every flag was sent or dead-lettered in time
+        """
+        with self._changed:
+            if self._closed and not self._pending and not self._in_flight:
+                return True
+            self._closed = True
+            self._changed.notify_all()
+        drained = self.flush(timeout)
+        if drained:
+            for worker in self._workers:
+                worker.join()
+        return drained
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def stats(self):
+        """ :return: flags queued, merged into a queued flag of the same email, sent, retried, dead-lettered and
+            currently queued or in flight
+        """
+        with self._lock:
+            return SubmitterStats(self._submitted, self._deduplicated, self._sent, self._retries,
+                                  self._dead_lettered, len(self._pending) + len(self._in_flight))
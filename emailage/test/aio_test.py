@@ -0,0 +1,135 @@
+"""Unit tests for the asyncio client, served by a local aiohttp application."""
+import asyncio
+import json
+import unittest
+
+try:
+    from aiohttp import web
+    from emailage.aio import AsyncEmailageClient, AsyncSingleFlight
+except ImportError:  # pragma: no cover (optional dependency)
+    web = None
+
+from emailage.client import HttpMethods
+from emailage.deadline import DeadlineExceeded, time_budget
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class AsyncClientTest(unittest.IsolatedAsyncioTestCase):
+
+    _http_method = HttpMethods.GET
+
+    async def asyncSetUp(self):
+        self.email = 'test+emailage@example.com'
+        self.ip = '1.234.56.7'
+        self.received = []
+        self.delay = 0
+
+        async def handler(request):
+            body = await request.text()
+            self.received.append((request.method, request.path, dict(request.query), body))
+            await asyncio.sleep(self.delay)
+            return web.Response(body=json.dumps({'success': [True]}).encode('utf_8_sig'))
+
+        app = web.Application()
+        app.router.add_route('*', '/emailagevalidator/', handler)
+        app.router.add_route('*', '/emailagevalidator/flag/', handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        self.subj = AsyncEmailageClient('secret', 'token', http_method=self._http_method)
+        self.subj.set_api_domain('http://127.0.0.1:{}'.format(port))
+
+    async def asyncTearDown(self):
+        await self.subj.close()
+        await self.runner.cleanup()
+
+    async def test_query__returns(self):
+        """Parses the BOM-prefixed response body as JSON"""
+        self.assertEqual(await self.subj.query((self.email, self.ip), urid='1234567890'), {'success': [True]})
+
+    async def test_query__call(self):
+        """Targets the validator endpoint with signed request params"""
+        await self.subj.query(self.email, urid='1234567890')
+
+        method, path, query, body = self.received[0]
+        self.assertEqual(method, HttpMethods.GET)
+        self.assertEqual(path, '/emailagevalidator/')
+        self.assertEqual(query['query'], self.email)
+        self.assertEqual(query['urid'], '1234567890')
+        self.assertEqual(query['oauth_consumer_key'], 'secret')
+        self.assertIn('oauth_signature', query)
+
+    async def test_flag_as_fraud__call(self):
+        """Flags a supplied address through the flag endpoint"""
+        await self.subj.flag_as_fraud(self.email, 3)
+
+        method, path, query, body = self.received[0]
+        self.assertEqual(path, '/emailagevalidator/flag/')
+        self.assertEqual(query['flag'], 'fraud')
+        self.assertEqual(query['fraudcodeID'], '3')
+
+    async def test_flag__exceptions(self):
+        """Validates arguments before any request is sent"""
+        with self.assertRaises(ValueError):
+            await self.subj.flag_as_fraud(self.email, 'First Party Fraud')
+        with self.assertRaises(ValueError):
+            await self.subj.query_email('test+example.com')
+        self.assertEqual(self.received, [])
+
+    async def test_concurrent_queries_share_one_session(self):
+        """Many in-flight queries reuse the client's pooled session"""
+        results = await asyncio.gather(*[self.subj.query_email(self.email, urid=str(i)) for i in range(20)])
+
+        self.assertEqual(len(results), 20)
+        self.assertEqual(len(self.received), 20)
+
+    async def test_coalesce__identical_queries_share_one_request(self):
+        """Identical queries in flight at once cost one request per unique key"""
+        self.subj.singleflight = AsyncSingleFlight()
+        results = await asyncio.gather(*([self.subj.query(self.email, urid=str(i)) for i in range(10)] +
+                                         [self.subj.query(self.email.upper(), firstname='Johann')]))
+
+        self.assertEqual(results, [{'success': [True]}] * 11)
+        self.assertEqual(len(self.received), 2)
+        self.assertEqual(self.subj.singleflight.stats.coalesced, 9)
+
+    async def test_deadline__cancels_the_request(self):
+        """A query still in flight at its deadline is cancelled"""
+        self.delay = 0.5
+        started_at = asyncio.get_running_loop().time()
+        with self.assertRaises(DeadlineExceeded):
+            await self.subj.query(self.email, deadline=0.05)
+        with self.assertRaises(DeadlineExceeded):
+            with time_budget(0.05):
+                await self.subj.query(self.email)
+        self.assertLess(asyncio.get_running_loop().time() - started_at, 0.5)
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class AsyncClientPostTest(AsyncClientTest):
+
+    _http_method = HttpMethods.POST
+
+    async def test_query__call(self):
+        """Sends the user params in the body and the signature in the URL"""
+        await self.subj.query(self.email, urid='1234567890')
+
+        method, path, query, body = self.received[0]
+        self.assertEqual(method, HttpMethods.POST)
+        self.assertIn('oauth_signature', query)
+        self.assertIn('query=test%2Bemailage%40example.com', body)
+
+    async def test_flag_as_fraud__call(self):
+        """Flags a supplied address through the flag endpoint"""
+        await self.subj.flag_as_fraud(self.email, 3)
+
+        method, path, query, body = self.received[0]
+        self.assertEqual(path, '/emailagevalidator/flag/')
+        self.assertIn('fraudcodeID=3', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
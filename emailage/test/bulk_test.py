@@ -0,0 +1,128 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock, patch
+
+from emailage import bulk
+from emailage.client import EmailageClient
+from emailage.stub_server import StubServer
+
+
+class BulkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.client = Mock(spec=EmailageClient)
+        self.client.cache = None
+        self.client.query.side_effect = lambda query, **params: dict(query=query, params=params)
+        self.client.flag.side_effect = lambda flag, query, fraud_code=None: dict(flag=flag, code=fraud_code)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, contents):
+        path = os.path.join(self.directory, name)
+        with io.open(path, 'w', encoding='utf_8') as stream:
+            stream.write(contents)
+        return path
+
+    def _run(self, *argv):
+        output = os.path.join(self.directory, 'output.jsonl')
+        with patch.object(bulk, 'build_client', return_value=self.client):
+            self.assertEqual(bulk.main(list(argv) + ['-o', output]), 0)
+        with io.open(output, encoding='utf_8') as stream:
+            return sorted((json.loads(line) for line in stream), key=lambda result: result['row'])
+
+    def test_query_csv(self):
+        path = self._write('input.csv', u'customer,ip,order\n'
+                                        u'a@example.com,1.2.3.4,o1\n'
+                                        u'b@example.com,,o2\n'
+                                        u',,o3\n')
+        results = self._run('query', path, '--email-column', 'customer', '--param', 'order=urid', '--workers', '2')
+
+        self.assertEqual([result['row'] for result in results], [1, 2, 3])
+        self.assertEqual(results[0]['response'], dict(query=['a@example.com', '1.2.3.4'], params=dict(urid='o1')))
+        self.assertEqual(results[1]['response']['query'], 'b@example.com')
+        self.assertTrue(results[2]['error'].startswith('ValueError'))
+
+    def test_query_jsonl_keeps_going_after_errors(self):
+        self.client.query.side_effect = [ValueError('bad'), dict(ok=1)]
+        path = self._write('input.jsonl', u'{"email": "a@example.com"}\n\n{"email": "b@example.com"}\n')
+        results = self._run('query', path, '--workers', '1')
+
+        self.assertEqual(results[0]['error'], 'ValueError: bad')
+        self.assertEqual(results[1]['response'], dict(ok=1))
+
+    def test_malformed_records_are_reported_as_failed_rows(self):
+        path = self._write('input.jsonl', u'{"email": "a@example.com"}\n{"email": \n{"email": "b@example.com"}\n')
+        results = self._run('query', path, '--workers', '1')
+
+        self.assertEqual([result['row'] for result in results], [1, 2, 3])
+        self.assertTrue(results[1]['error'].startswith('JSONDecodeError'))
+        self.assertEqual(results[2]['response']['query'], 'b@example.com')
+
+        path = self._write('input.csv', u'email\na@example.com\n{}\nb@example.com\n'.format('x' * 200000))
+        results = self._run('flag', path, '--flag', 'good')
+        self.assertEqual(results[1]['error'], 'Error: field larger than field limit (131072)')
+        self.assertEqual([result['row'] for result in results if 'response' in result], [1, 3])
+
+    def test_query_cache_skips_scored_records_across_runs(self):
+        path = self._write('input.csv', u'email\na@example.com\nb@example.com\n')
+        cache = os.path.join(self.directory, 'cache.sqlite3')
+        argv = ['query', path, '--cache', cache, '--secret', 'secret', '--token', 'token']
+
+        for run in range(2):
+            client = bulk.build_client(bulk.create_parser().parse_args(argv))
+            client.request = Mock(side_effect=lambda endpoint, **params: dict(query=params['query']))
+            self.client = client
+            results = self._run(*argv)
+            self.assertEqual(results[1]['response'], dict(query='b@example.com'))
+            self.assertEqual(client.request.call_count, 2 if run == 0 else 0)
+
+    def test_query_processes_write_in_input_order(self):
+        stub = StubServer('secret', 'token').start()
+        self.addCleanup(stub.stop)
+        path = self._write('input.csv', u'email\n' + u''.join(u'user{}@example.com\n'.format(row) for row in range(30)))
+        output = os.path.join(self.directory, 'output.jsonl')
+
+        self.assertEqual(bulk.main(['query', path, '-o', output, '--processes', '2', '--workers', '2', '--rate', '1000',
+                                    '--secret', 'secret', '--token', 'token', '--domain', stub.url]), 0)
+        with io.open(output, encoding='utf_8') as stream:
+            results = [json.loads(line) for line in stream]
+        self.assertEqual([result['row'] for result in results], list(range(1, 31)))
+        self.assertEqual(results[4]['query'], 'user4@example.com')
+        self.assertEqual(results[4]['response']['responseStatus']['status'], 'success')
+
+    def test_flag_csv(self):
+        path = self._write('chargebacks.csv', u'email,reason\na@example.com,3\nb@example.com,\n')
+        results = self._run('flag', path, '--flag', 'fraud', '--fraud-code-column', 'reason', '--fraud-code', '9')
+
+        self.assertEqual(results[0]['response'], dict(flag='fraud', code=3))
+        self.assertEqual(results[1]['response'], dict(flag='fraud', code=9))
+
+    def test_csv_output(self):
+        stream = io.StringIO()
+        writer = bulk.ResultWriter(stream, bulk.CSV)
+        writer.write(1, ('a@example.com', '1.2.3.4'), response={'score': 1})
+        writer.write(2, 'b@example.com', error=ValueError('bad'))
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(lines[0], 'row,query,error,response')
+        self.assertEqual(lines[1], '1,a@example.com+1.2.3.4,,"{""score"": 1}"')
+        self.assertEqual(lines[2], '2,b@example.com,ValueError: bad,')
+
+    def test_reads_records_lazily(self):
+        def lines():
+            yield u'{"email": "a@example.com"}\n'
+            raise AssertionError('read past the first record')
+
+        records = bulk.read_records(lines(), bulk.JSONL)
+        self.assertEqual(next(records), (1, {'email': 'a@example.com'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from emailage.cache import ResponseCache, cache_key
+from emailage.test.helpers import FakeClock
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    def test_normalizes_query(self):
+        self.assertEqual(cache_key(' Test@Example.COM', {}), cache_key('test@example.com', {}))
+        self.assertEqual(cache_key(('A@b.com', '1.2.3.4'), {})[1], 'a@b.com')
+        self.assertIsNone(cache_key('1.2.3.4', {})[1])
+
+    def test_ignores_urid_and_oauth_fields(self):
+        key, tag = cache_key('test@example.com', {'firstname': 'Johann'})
+        same_key, same_tag = cache_key('test@example.com', {'firstname': 'Johann', 'urid': 'r1',
+                                                            'oauth_nonce': 'n', 'oauth_timestamp': 1})
+        self.assertEqual(key, same_key)
+
+    def test_distinguishes_extra_params(self):
+        self.assertNotEqual(cache_key('test@example.com', {'firstname': 'Johann'}),
+                            cache_key('test@example.com', {'firstname': 'Paulus'}))
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        self.cache = ResponseCache(ttl=10, max_entries=2, clock=self.clock)
+
+    def test_hits_and_misses(self):
+        self.assertIsNone(self.cache.get('k1'))
+        self.cache.put('k1', {'v': 1})
+        self.assertEqual(self.cache.get('k1'), {'v': 1})
+
+        stats = self.cache.stats
+        self.assertEqual((stats.hits, stats.misses, stats.size), (1, 1, 1))
+
+    def test_expires_after_ttl(self):
+        self.cache.put('k1', {'v': 1})
+        self.clock.now += 10
+        self.assertIsNone(self.cache.get('k1'))
+        self.assertEqual(self.cache.stats.expirations, 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('k1', 1)
+        self.cache.put('k2', 2)
+        self.cache.get('k1')
+        self.cache.put('k3', 3)
+
+        self.assertIsNone(self.cache.get('k2'))
+        self.assertEqual(self.cache.get('k1'), 1)
+        self.assertEqual(self.cache.get('k3'), 3)
+        self.assertEqual(self.cache.stats.evictions, 1)
+
+    def test_invalidates_by_tag(self):
+        self.cache.put('k1', 1, tag='test@example.com')
+        self.cache.put('k2', 2, tag='other@example.com')
+
+        self.assertEqual(self.cache.invalidate('test@example.com'), 1)
+        self.assertIsNone(self.cache.get('k1'))
+        self.assertEqual(self.cache.get('k2'), 2)
+        self.assertEqual(self.cache.invalidate('test@example.com'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,13 @@
+import threading
 import unittest
 import urllib
 import requests
 import json
 from mock import Mock
-from emailage import protocols
-from emailage.client import EmailageClient, HttpMethods
+from emailage import protocols, signature
+from emailage.cache import ResponseCache
+from emailage.client import EmailageClient, HttpMethods, ResponseModes
+from emailage.response import QueryResult
 
 
 use_urlparse = hasattr(urllib, 'quote')
@@ -116,6 +119,13 @@ class ClientRequestTest(ClientTest):
         """Parses response body as JSON"""
         self.assertEqual(self._request(), {'success': [True]})
 
+    def test_request__object_mode(self):
+        """Returns a QueryResult decoding the same document in the object response mode"""
+        self.subj.response_mode = ResponseModes.OBJECT
+        response = self._request()
+        self.assertIsInstance(response, QueryResult)
+        self.assertEqual(response.to_dict(), {'success': [True]})
+
 
 class ClientGetRequestTest(ClientRequestTest):
 
@@ -134,6 +144,16 @@ class ClientGetRequestTest(ClientRequestTest):
         self.assertEqual(params['query'][0], 'something')
         self.assertEqual(params['oauth_consumer_key'][0], 'secret')
 
+    def test_request__signature(self):
+        """Signs requests exactly like signature.create, reusing one signer per endpoint"""
+        self._request()
+        self._request()
+        for call_args in self.mocked_session.get.call_args_list:
+            params = dict((key, values[0]) for key, values in _parse_qs(call_args[1]['params']).items())
+            sent_signature = params.pop('oauth_signature')
+            self.assertEqual(sent_signature, signature.create('GET', call_args[0][0], params, 'token&'))
+        self.assertEqual(len(self.subj._signers), 1)
+
 
 class ClientPostRequestTest(ClientRequestTest):
 
@@ -164,6 +184,67 @@ class ClientQueryTest(ClientTest):
         self.r.assert_called_once_with('', urid=1234567890, query='test+emailage@example.com+1.234.56.7')
 
 
+class ClientQueryManyTest(ClientTest):
+
+    def setUp(self):
+        super(ClientQueryManyTest, self).setUp()
+        self.r = self.subj.request = Mock(side_effect=lambda endpoint, **params: {'query': params['query']})
+
+    def test_query_many__ordered(self):
+        """Returns one result per item in input order"""
+        items = ['user{}@example.com'.format(i) for i in range(25)]
+        results = self.subj.query_many(items, max_workers=5)
+
+        self.assertEqual([result.query for result in results], items)
+        self.assertEqual([result.response['query'] for result in results], items)
+        self.assertTrue(all(result.ok for result in results))
+
+    def test_query_many__params(self):
+        """Sends common params with every item and lets per-item params override them"""
+        self.subj.query_many([self.email, {'query': (self.email, self.ip), 'urid': 'item'}], urid='common')
+
+        self.r.assert_any_call('', urid='common', query=self.email)
+        self.r.assert_any_call('', urid='item', query='test+emailage@example.com+1.234.56.7')
+
+    def test_query_many__errors(self):
+        """Reports per-item exceptions without stopping the batch"""
+        results = self.subj.query_many([(self.email, self.ip), ('test+example.com', self.ip), self.email])
+
+        self.assertEqual([result.ok for result in results], [True, False, True])
+        self.assertIsInstance(results[1].error, ValueError)
+        self.assertIsNone(results[1].response)
+        self.assertEqual(self.r.call_count, 2)
+
+
+class ClientCacheTest(ClientTest):
+
+    def setUp(self):
+        super(ClientCacheTest, self).setUp()
+        self.subj.cache = ResponseCache(ttl=60)
+        self.r = self.subj.request = Mock(side_effect=lambda endpoint, **params: {'query': params['query']})
+
+    def test_query__cache_opt_in(self):
+        """Only queries sent with use_cache are served from the cache"""
+        self.subj.query(self.email)
+        self.subj.query(self.email)
+        self.assertEqual(self.r.call_count, 2)
+
+        self.subj.query(self.email, use_cache=True, urid='first')
+        response = self.subj.query(self.email.upper(), use_cache=True, urid='second')
+        self.assertEqual(self.r.call_count, 3)
+        self.assertEqual(response, {'query': self.email})
+        self.assertEqual(self.subj.cache.stats.hits, 1)
+
+    def test_flag__invalidates(self):
+        """Flagging an email drops the cached responses for it and is never cached"""
+        self.subj.query((self.email, self.ip), use_cache=True)
+        self.subj.flag_as_good(self.email)
+        self.subj.flag_as_good(self.email)
+        self.subj.query((self.email, self.ip), use_cache=True)
+
+        self.assertEqual(self.r.call_count, 4)
+
+
 class ClientFlagTest(ClientTest):
 
     def setUp(self):
@@ -249,5 +330,52 @@ class ClientHttpGetFlagTest(ClientFlagTest):
         cls._http_method = HttpMethods.GET
 
 
+class ClientSettingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.subj = EmailageClient('secret1', 'token1')
+        self.sent = []
+        response = RequestsSessionMockup().get_response_mock('{}')
+        self.subj.session = Mock(spec=requests.Session)
+        self.subj.session.get.side_effect = lambda url, params, **kwargs: self.sent.append((url, params)) or response
+
+    def test_settings_are_replaced_atomically(self):
+        settings = self.subj.settings
+        self.subj.set_credentials('secret2', 'token2')
+        self.subj.set_http_method(HttpMethods.POST)
+
+        self.assertEqual(settings, ('secret1', 'token1', 'token1&', 'https://api.emailage.com', 'GET'))
+        self.assertEqual(self.subj.settings, ('secret2', 'token2', 'token2&', 'https://api.emailage.com', 'POST'))
+        self.assertEqual((self.subj.secret, self.subj.token, self.subj.hmac_key), ('secret2', 'token2', 'token2&'))
+
+    def test_requests_never_mix_rotated_credentials(self):
+        stop = threading.Event()
+
+        def rotate():
+            while not stop.is_set():
+                for number in '12':
+                    self.subj.set_credentials('secret' + number, 'token' + number)
+
+        rotator = threading.Thread(target=rotate)
+        rotator.start()
+        try:
+            workers = [threading.Thread(target=lambda: [self.subj.query('test@example.com') for _ in range(50)])
+                       for _ in range(4)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            stop.set()
+            rotator.join()
+
+        self.assertEqual(len(self.sent), 200)
+        for url, query_string in self.sent:
+            params = dict((name, values[0]) for name, values in _parse_qs(query_string).items())
+            token = params['oauth_consumer_key'].replace('secret', 'token') + '&'
+            sent_signature = params.pop('oauth_signature')
+            self.assertEqual(sent_signature, signature.Signer(token, HttpMethods.GET, url).sign(params))
+
+
 if __name__ == '__main__':
     unittest.main()
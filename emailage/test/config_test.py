@@ -0,0 +1,61 @@
+import os
+import pickle
+import unittest
+
+from emailage.batch import imap_processes, run_queries_in_processes
+from emailage.config import ClientConfig
+from emailage.ratelimit import SharedTokenBucket
+from emailage.response import QueryResult
+from emailage.stub_server import StubServer, score_result
+
+
+def _square_task():
+    return lambda number: (os.getpid(), number * number)
+
+
+class ClientConfigTest(unittest.TestCase):
+
+    def test_pickles_without_its_client(self):
+        config = ClientConfig('secret', 'token', domain='http://127.0.0.1:1', timeout=5)
+        client = config.client
+        self.assertIs(config.client, client)
+
+        copy = pickle.loads(pickle.dumps(config))
+        self.assertIsNone(copy._client)
+        self.assertIsNot(copy.client, client)
+        self.assertEqual(copy.client.timeout, 5)
+        self.assertEqual(copy.client.domain, 'http://127.0.0.1:1')
+
+    def test_rebuilds_the_client_after_fork(self):
+        config = ClientConfig('secret', 'token')
+        client = config.client
+        config._pid = -1
+        self.assertIsNot(config.client, client)
+
+    def test_repr_hides_the_credentials(self):
+        self.assertNotIn('token', repr(ClientConfig('secret', 'token', sandbox=True)))
+
+
+class ProcessPoolTest(unittest.TestCase):
+
+    def test_imap_processes__input_order_across_processes(self):
+        results = list(imap_processes(_square_task, range(200), processes=3, chunk_size=7, max_pending=2))
+        self.assertEqual([square for _, square in results], [number * number for number in range(200)])
+        self.assertGreater(len(set(pid for pid, _ in results)), 1)
+        self.assertNotIn(os.getpid(), set(pid for pid, _ in results))
+
+    def test_run_queries_in_processes(self):
+        stub = StubServer('secret', 'token').start()
+        self.addCleanup(stub.stop)
+        config = ClientConfig('secret', 'token', domain=stub.url, response_mode='object',
+                              rate_limiter=SharedTokenBucket(rate=1000))
+        emails = ['user{}@example.com'.format(index) for index in range(40)] + [{'urid': 'no query'}]
+
+        results = run_queries_in_processes(config, emails, processes=2, threads=2, chunk_size=5,
+                                           common_params=dict(urid='r1'))
+
+        self.assertEqual([result.query for result in results], emails)
+        self.assertTrue(all(isinstance(result.response, QueryResult) for result in results[:-1]))
+        self.assertEqual(results[3].response.to_dict()['query']['results'][0], score_result('user3@example.com'))
+        self.assertIsInstance(results[-1].error, KeyError)
+        self.assertEqual(stub.stats(), {200: 40})
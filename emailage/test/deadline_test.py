@@ -0,0 +1,171 @@
+"""Per-call deadlines and time budgets, against the stub server."""
+import threading
+import time
+import unittest
+
+try:
+    import h2  # noqa: F401
+    import httpcore  # noqa: F401
+except ImportError:  # pragma: no cover (optional dependency)
+    httpcore = None
+
+from emailage._clock import now as _now
+from emailage.client import EmailageClient, Transports
+from emailage.deadline import Deadline, DeadlineExceeded, current_deadline, effective, time_budget
+from emailage.ratelimit import TokenBucket
+from emailage.retry import RetryPolicy
+from emailage.stub_server import StubServer
+from emailage.test.helpers import FakeClock
+
+
+SECRET = 'consumer_secret'
+TOKEN = 'consumer_token'
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(100.0)
+        self.deadline = Deadline(0.3, clock=self.clock)
+
+    def test_remaining(self):
+        self.assertAlmostEqual(self.deadline.remaining(), 0.3)
+        self.clock.now += 0.2
+        self.assertAlmostEqual(self.deadline.remaining(), 0.1)
+        self.assertFalse(self.deadline.expired)
+        self.clock.now += 0.2
+        self.assertEqual(self.deadline.remaining(), 0.0)
+        self.assertTrue(self.deadline.expired)
+
+    def test_check(self):
+        self.deadline.check('signing')
+        self.clock.now += 0.3
+        with self.assertRaises(DeadlineExceeded) as raised:
+            self.deadline.check('signing')
+        self.assertIn('before signing', str(raised.exception))
+
+    def test_cap(self):
+        self.assertAlmostEqual(self.deadline.cap(None), 0.3)
+        self.assertAlmostEqual(self.deadline.cap(0.1), 0.1)
+        self.assertAlmostEqual(self.deadline.cap(5), 0.3)
+        connect, read = self.deadline.cap((0.1, 10))
+        self.assertAlmostEqual(connect, 0.1)
+        self.assertAlmostEqual(read, 0.3)
+
+
+class TimeBudgetTest(unittest.TestCase):
+
+    def test_effective(self):
+        self.assertIsNone(effective())
+        self.assertAlmostEqual(effective(5).remaining(), 5, places=2)
+        deadline = Deadline(1)
+        self.assertIs(effective(deadline), deadline)
+
+    def test_budgets_nest(self):
+        self.assertIsNone(current_deadline())
+        with time_budget(1) as outer:
+            self.assertIs(current_deadline(), outer)
+            self.assertIs(effective(5), outer)
+            with time_budget(5) as loose:
+                self.assertIs(loose, outer)
+            with time_budget(0.5) as inner:
+                self.assertIs(current_deadline(), inner)
+                self.assertLess(effective(0.1).expires_at, inner.expires_at)
+            self.assertIs(current_deadline(), outer)
+        self.assertIsNone(current_deadline())
+
+    def test_budgets_are_per_thread(self):
+        seen = []
+        with time_budget(1):
+            worker = threading.Thread(target=lambda: seen.append(current_deadline()))
+            worker.start()
+            worker.join()
+        self.assertEqual(seen, [None])
+
+
+class ClientDeadlineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer(SECRET, TOKEN, latency=0.5, seed=1)
+        self.stub.start()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def _client(self, **options):
+        client = EmailageClient(SECRET, TOKEN, **options)
+        client.set_api_domain(self.stub.url)
+        return client
+
+    def assertExceedsWithin(self, seconds, func, *args, **kwargs):
+        started_at = _now()
+        with self.assertRaises(DeadlineExceeded):
+            func(*args, **kwargs)
+        self.assertLess(_now() - started_at, seconds)
+
+    def test_query_deadline(self):
+        self.assertExceedsWithin(0.3, self._client().query, 'test@example.com', deadline=0.1)
+
+    def test_time_budget(self):
+        client = self._client()
+        with time_budget(0.1):
+            self.assertExceedsWithin(0.3, client.query_email, 'test@example.com')
+        with time_budget(0.1):
+            self.assertExceedsWithin(0.3, client.flag_as_good, 'test@example.com')
+
+    def test_expired_deadline_sends_nothing(self):
+        clock = FakeClock(100.0)
+        deadline = Deadline(0.1, clock=clock)
+        clock.now += 1
+        self.assertExceedsWithin(0.1, self._client().query, 'test@example.com', deadline=deadline)
+        self.assertEqual(self.stub.stats(), {})
+
+    def test_retries_stop_at_the_deadline(self):
+        self.stub.stop()
+        self.stub = StubServer(SECRET, TOKEN, error_rate=1.0, seed=1)
+        self.stub.start()
+        client = self._client(retry_policy=RetryPolicy(max_attempts=100, backoff_base=0.05, backoff_max=0.05))
+
+        started_at = _now()
+        with self.assertRaises((DeadlineExceeded, ValueError)):
+            client.query('test@example.com', deadline=0.2)
+        self.assertLess(_now() - started_at, 0.3)
+        self.assertLess(self.stub.stats()[500], 100)
+
+    def test_rate_limiter_wait_is_capped(self):
+        bucket = TokenBucket(rate=0.1, capacity=1)
+        bucket.acquire()
+        client = self._client(rate_limiter=bucket)
+        self.assertExceedsWithin(0.3, client.query, 'test@example.com', deadline=0.1)
+
+    def test_coalesced_waiters_give_up(self):
+        client = self._client(coalesce=True)
+        leader = threading.Thread(target=client.query, args=('test@example.com',))
+        leader.start()
+        while not client.singleflight.stats.in_flight:
+            time.sleep(0.001)
+        self.assertExceedsWithin(0.3, client.query, 'test@example.com', deadline=0.1)
+        leader.join()
+
+    def test_query_many_inherits_the_budget(self):
+        client = self._client()
+        started_at = _now()
+        with time_budget(0.1):
+            results = client.query_many(['a@example.com', 'b@example.com', 'c@example.com'], max_workers=3)
+        self.assertLess(_now() - started_at, 0.3)
+        for result in results:
+            self.assertIsInstance(result.error, DeadlineExceeded)
+
+    @unittest.skipIf(httpcore is None, 'httpcore[http2] is not installed')
+    def test_http2_request_is_cancelled(self):
+        client = self._client(transport=Transports.H2C)
+        for _ in range(3):
+            self.assertExceedsWithin(0.3, client.query, 'test@example.com', deadline=0.1)
+
+        # The abandoned requests did not fail the connection, which serves the next query
+        self.assertEqual(client.query('test@example.com')['responseStatus']['status'], 'success')
+        self.assertEqual(client.pool_stats().created, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
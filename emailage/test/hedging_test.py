@@ -0,0 +1,237 @@
+"""Hedged queries, with scripted attempts and against the stub server."""
+import pickle
+import threading
+import time
+import unittest
+
+from mock import Mock
+from requests.exceptions import ConnectionError
+
+try:
+    import h2  # noqa: F401
+    import httpcore  # noqa: F401
+except ImportError:  # pragma: no cover (optional dependency)
+    httpcore = None
+
+from emailage import metrics
+from emailage.client import EmailageClient, Transports
+from emailage.deadline import Deadline, DeadlineExceeded
+from emailage.hedging import HedgeStats, HedgingPolicy
+from emailage.metrics import MetricsRegistry
+from emailage.retry import CircuitBreaker
+from emailage.stub_server import StubServer
+
+
+SECRET = 'consumer_secret'
+TOKEN = 'consumer_token'
+
+
+class ScriptedSend(object):
+    """Attempt function whose attempts wait for the given seconds, then return a response or raise an error"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.lock = threading.Lock()
+        self.cancelled = []
+        self.attempts = 0
+
+    def __call__(self, trace, on_start):
+        with self.lock:
+            number = self.attempts
+            self.attempts += 1
+        seconds, outcome = self.outcomes[number]
+        cancelled = threading.Event()
+        on_start(cancelled.set)
+        if cancelled.wait(seconds):
+            self.cancelled.append(number)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return Mock(status_code=outcome, number=number)
+
+
+class HedgingPolicyTest(unittest.TestCase):
+
+    def _policy(self, **options):
+        defaults = dict(max_delay=0.02, max_hedge_ratio=1.0)
+        defaults.update(options)
+        return HedgingPolicy(**defaults)
+
+    def test_fast_calls_are_not_hedged(self):
+        policy = self._policy()
+        send = ScriptedSend((0, 200))
+        self.assertEqual(policy.run(send).number, 0)
+        self.assertEqual(send.attempts, 1)
+        self.assertEqual(policy.stats, HedgeStats(1, 0, 0, 0, 0.02))
+
+    def test_slow_call_is_hedged_and_the_loser_cancelled(self):
+        policy = self._policy()
+        send = ScriptedSend((5, 200), (0, 200))
+        started_at = time.time()
+        self.assertEqual(policy.run(send).number, 1)
+        self.assertLess(time.time() - started_at, 1)
+        self.assertEqual(policy.stats[:4], (1, 1, 1, 0))
+        time.sleep(0.05)
+        self.assertEqual(send.cancelled, [0])
+
+    def test_first_attempt_may_still_win(self):
+        policy = self._policy()
+        send = ScriptedSend((0.05, 200), (5, 200))
+        self.assertEqual(policy.run(send).number, 0)
+        self.assertEqual(policy.stats[:4], (1, 1, 0, 0))
+
+    def test_failed_attempt_waits_for_the_other(self):
+        policy = self._policy()
+        send = ScriptedSend((0.05, ConnectionError('reset')), (0.1, 200))
+        self.assertEqual(policy.run(send).number, 1)
+
+        send = ScriptedSend((0.05, 503), (0.1, 500))
+        self.assertEqual(policy.run(send).status_code, 503)
+
+        send = ScriptedSend((0.05, ConnectionError('reset')), (0.1, ConnectionError('refused')))
+        with self.assertRaises(ConnectionError) as raised:
+            policy.run(send)
+        self.assertEqual(str(raised.exception), 'reset')
+
+    def test_first_attempt_runs_on_the_calling_thread(self):
+        policy = self._policy(max_delay=0.05, max_workers=1)
+        threads = []
+
+        def send(trace, on_start):
+            threads.append(threading.current_thread())
+            time.sleep(0.02)
+            return Mock(status_code=200)
+
+        callers = [threading.Thread(target=policy.run, args=(send,)) for _ in range(8)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        # Busy callers do not queue behind each other, so none of them is hedged
+        self.assertEqual(set(threads), set(callers))
+        self.assertEqual(policy.stats.hedged, 0)
+
+    def test_hedge_rate_is_capped(self):
+        policy = self._policy(max_delay=0.001, max_hedge_ratio=0.1, burst=1)
+        for _ in range(50):
+            policy.run(ScriptedSend((0.005, 200), (0.005, 200)))
+        stats = policy.stats
+        self.assertEqual(stats.requests, 50)
+        self.assertEqual(stats.hedged, 5)
+        self.assertEqual(stats.throttled, 45)
+
+    def test_delay_follows_the_latency_percentile(self):
+        policy = HedgingPolicy(percentile=0.9, min_delay=0.005, max_delay=1.0, window=100, min_samples=50)
+        self.assertEqual(policy.delay, 1.0)
+        for millisecond in range(1, 101):
+            policy.record_latency(millisecond / 1000.0)
+        self.assertAlmostEqual(policy.delay, 0.091)
+
+        for _ in range(100):
+            policy.record_latency(0.0001)
+        self.assertEqual(policy.delay, 0.005)
+
+    def test_deadline_cancels_both_attempts(self):
+        policy = self._policy()
+        send = ScriptedSend((5, 200), (5, 200))
+        with self.assertRaises(DeadlineExceeded):
+            policy.run(send, deadline=Deadline(0.1))
+        time.sleep(0.05)
+        self.assertEqual(sorted(send.cancelled), [0, 1])
+
+    def test_winner_trace_is_added(self):
+        policy = self._policy()
+        trace = metrics.RequestTrace('/emailagevalidator/', 'GET')
+
+        def send(attempt_trace, on_start):
+            attempt_trace.count_response(Mock(status_code=200, content=b'{}'), 10)
+            return Mock(status_code=200)
+        policy.run(send, trace)
+        self.assertEqual((trace.statuses, trace.bytes_sent, trace.hedges), ([200], 10, 0))
+
+    def test_pickle(self):
+        policy = self._policy(percentile=0.99)
+        policy.run(ScriptedSend((0, 200)))
+        copy = pickle.loads(pickle.dumps(policy))
+        self.assertEqual(copy.percentile, 0.99)
+        self.assertEqual(copy.stats, HedgeStats(0, 0, 0, 0, 0.02))
+
+    def test_arguments_are_checked(self):
+        with self.assertRaises(ValueError):
+            HedgingPolicy(percentile=95)
+        with self.assertRaises(ValueError):
+            HedgingPolicy(max_hedge_ratio=2)
+
+
+class ClientHedgingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer(SECRET, TOKEN, latency=0.2, seed=1)
+        self.stub.start()
+        self.policy = HedgingPolicy(max_delay=0.02, max_hedge_ratio=1.0)
+        self.registry = MetricsRegistry()
+
+    def tearDown(self):
+        self.stub.stop()
+        self.policy.close()
+
+    def _client(self, **options):
+        client = EmailageClient(SECRET, TOKEN, hedging=self.policy, metrics=self.registry, **options)
+        client.set_api_domain(self.stub.url)
+        return client
+
+    def test_queries_are_hedged_with_fresh_signatures(self):
+        client = self._client()
+        response = client.query_email_and_ip_address('test@example.com', '209.85.220.41')
+        self.assertEqual(response['responseStatus']['status'], 'success')
+        self.assertEqual(self.policy.stats.hedged, 1)
+        time.sleep(0.25)
+        # Both attempts passed the signature check of the stub
+        self.assertEqual(self.stub.stats(), {200: 2})
+        self.assertEqual(self.registry.counter(metrics.HEDGES, endpoint='/emailagevalidator/'), 1)
+        self.assertIn('emailage_hedges_won_total', self.registry.to_prometheus())
+
+    def test_flags_are_not_hedged(self):
+        client = self._client()
+        client.flag_as_good('test@example.com')
+        self.assertEqual(self.policy.stats.requests, 0)
+        self.assertEqual(self.stub.stats(), {200: 1})
+
+    @unittest.skipIf(httpcore is None, 'httpcore[http2] is not installed')
+    def test_http2_loser_is_reset(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        client = self._client(transport=Transports.H2C, circuit_breaker=breaker)
+        for _ in range(3):
+            self.assertEqual(client.query('test@example.com')['responseStatus']['status'], 'success')
+        self.assertEqual(self.policy.stats.hedged, 3)
+        self.assertEqual(client.pool_stats().created, 1)
+        # The cancelled losers are not failures of the API
+        time.sleep(0.05)
+        self.assertEqual(breaker._failures, 0)
+
+    @unittest.skipIf(httpcore is None, 'httpcore[http2] is not installed')
+    def test_http2_concurrent_hedges_keep_the_connection_usable(self):
+        self.stub.stop()
+        self.stub = StubServer(SECRET, TOKEN, latency=0.005, latency_sigma=1.0, seed=3)
+        self.stub.start()
+        self.policy = HedgingPolicy(percentile=0.5, max_hedge_ratio=0.5, min_samples=10)
+        client = self._client(transport=Transports.H2C)
+        errors = []
+
+        def worker(number):
+            for query in range(30):
+                try:
+                    client.query('user{}.{}@example.com'.format(number, query))
+                except Exception as exc:
+                    errors.append(exc)
+        workers = [threading.Thread(target=worker, args=(number,)) for number in range(8)]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+        self.assertEqual(errors, [])
+        self.assertGreater(self.policy.stats.hedged, 10)
+        self.assertEqual(client.pool_stats().created, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
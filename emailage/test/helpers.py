@@ -0,0 +1,16 @@
+"""Helpers shared by the unit tests."""
+
+
+class FakeClock(object):
+    """Clock which only moves when told to, or when something sleeps on it"""
+
+    def __init__(self, now=0.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
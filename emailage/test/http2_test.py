@@ -0,0 +1,140 @@
+"""HTTP/2 transport of the client against the stub server, which speaks h2c."""
+import socket
+import ssl
+import threading
+import time
+import unittest
+
+from requests.exceptions import ConnectionError
+
+try:
+    import h2  # noqa: F401
+    from emailage.http2 import Http2Session
+except ImportError:  # pragma: no cover (optional dependency)
+    Http2Session = None
+
+from emailage.client import EmailageClient, HttpMethods, TlsVersions, Transports, _create_ssl_context
+from emailage.retry import RetryPolicy
+from emailage.stub_server import StubServer
+
+
+SECRET = 'consumer_secret'
+TOKEN = 'consumer_token'
+
+
+@unittest.skipIf(Http2Session is None, 'httpcore[http2] is not installed')
+class Http2TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer(SECRET, TOKEN, latency=0.02, seed=1)
+        self.stub.start()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def _client(self, transport=Transports.H2C, **options):
+        client = EmailageClient(SECRET, TOKEN, transport=transport, **options)
+        client.set_api_domain(self.stub.url)
+        return client
+
+    def _run_threads(self, client, threads, queries):
+        responses = []
+
+        def worker(number):
+            for query in range(queries):
+                responses.append(client.query('user{}.{}@example.com'.format(number, query)))
+        workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+        return responses
+
+    def test_concurrent_queries_share_one_connection(self):
+        for http_method in [HttpMethods.GET, HttpMethods.POST]:
+            client = self._client(http_method=http_method, pool_maxsize=4)
+            responses = self._run_threads(client, 32, 3)
+
+            self.assertEqual(len(responses), 96)
+            for response in responses:
+                self.assertEqual(response['responseStatus']['status'], 'success')
+            stats = client.pool_stats()
+            self.assertEqual(stats.created, 1)
+            self.assertEqual(stats.in_use + stats.idle, 1)
+            client.session.close()
+        self.assertEqual(self.stub.connections, 2)
+        self.assertEqual(self.stub.stats(), {200: 192})
+
+    def test_responses_come_over_http2(self):
+        client = self._client()
+        url, payload = client._signed_url_and_payload(self.stub.url + '/emailagevalidator/',
+                                                      {'format': 'json', 'query': 'test@example.com'})
+        response = client.session.post(url, data=payload)
+        self.assertEqual(response.http_version, 'HTTP/2')
+        self.assertTrue(response)
+
+    def test_negotiation_falls_back_to_http1(self):
+        # Without TLS there is no ALPN, so the HTTP/2 transport speaks HTTP/1.1 to the stub
+        client = self._client(transport=Transports.HTTP2)
+        self.assertEqual(client.query('test@example.com')['responseStatus']['status'], 'success')
+        url, payload = client._signed_url_and_payload(self.stub.url + '/emailagevalidator/',
+                                                      {'format': 'json', 'query': 'test@example.com'})
+        self.assertEqual(client.session.post(url, data=payload).http_version, 'HTTP/1.1')
+
+    def test_session_is_kept_unless_options_change(self):
+        client = self._client()
+        session = client.session
+        client.set_api_domain(self.stub.url)
+        self.assertIs(client.session, session)
+        client.set_api_domain(self.stub.url, pool_maxsize=2)
+        self.assertIsNot(client.session, session)
+
+    def test_replaced_session_is_closed_after_its_requests(self):
+        client = self._client()
+        session = client.session
+        url, payload = client._signed_url_and_payload(self.stub.url + '/emailagevalidator/',
+                                                      {'format': 'json', 'query': 'test@example.com'})
+        responses = []
+        worker = threading.Thread(target=lambda: responses.append(session.post(url, data=payload)))
+        worker.start()
+        while session.pool_stats.in_use == 0 and not responses:
+            time.sleep(0.001)
+        client.set_api_domain(self.stub.url, pool_maxsize=2)
+        worker.join()
+        self.assertEqual(responses[0].status_code, 200)
+        for _ in range(100):
+            if session.pool_stats.idle == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(session.pool_stats, (0, 0, 1, 1))
+
+    def test_tls_version_is_pinned(self):
+        context = _create_ssl_context(TlsVersions.TLSv1_2)
+        self.assertEqual((context.minimum_version, context.maximum_version),
+                         (ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_2))
+        self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+
+    def test_auto_prefers_http2(self):
+        self.assertEqual(EmailageClient(SECRET, TOKEN, transport=Transports.AUTO).transport, Transports.HTTP2)
+
+    def test_unknown_transport_is_rejected(self):
+        with self.assertRaises(ValueError):
+            EmailageClient(SECRET, TOKEN, transport='spdy')
+
+    def test_connection_errors_are_retried(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        listener.close()
+
+        attempts = []
+        client = EmailageClient(SECRET, TOKEN, transport=Transports.H2C,
+                                retry_policy=RetryPolicy(max_attempts=3, sleep=attempts.append))
+        client.set_api_domain('http://127.0.0.1:{}'.format(port))
+        with self.assertRaises(ConnectionError):
+            client.query('test@example.com')
+        self.assertEqual(len(attempts), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import subprocess
+import sys
+import unittest
+
+
+def _run(code):
+    return subprocess.check_output([sys.executable, '-c', code]).decode('utf_8').split()
+
+
+class ImportTest(unittest.TestCase):
+
+    def test_package_import_defers_the_http_stack(self):
+        loaded = _run('import sys, emailage\n'
+                      'print(" ".join(name for name in ["requests", "urllib3", "ssl"] if name in sys.modules) or "-")')
+        self.assertEqual(loaded, ['-'])
+
+    def test_client_defers_the_http_stack_until_the_first_request(self):
+        loaded = _run('import sys\n'
+                      'from emailage.client import EmailageClient\n'
+                      'client = EmailageClient("secret", "token")\n'
+                      'client.set_api_domain("https://testing.emailage.com", pool_maxsize=4)\n'
+                      'print(" ".join(name for name in ["requests", "urllib3", "ssl"] if name in sys.modules) or "-")\n'
+                      'adapter = client.session.get_adapter("https://testing.emailage.com")\n'
+                      'print("requests" in sys.modules, adapter._pool_maxsize)')
+        self.assertEqual(loaded, ['-', 'True', '4'])
+
+    def test_signing_does_not_need_the_http_stack(self):
+        self.assertEqual(_run('import sys, emailage.signature, emailage.stub_server\n'
+                              'print("requests" in sys.modules)'), ['False'])
+
+    def test_protocols_is_loaded_on_first_access(self):
+        self.assertEqual(_run('import emailage, ssl\n'
+                              'from emailage import protocols\n'
+                              'print(protocols.TLSv1_2 == ssl.PROTOCOL_TLSv1_2, emailage.protocols is protocols)'),
+                         ['True', 'True'])
+
+    def test_unknown_attribute(self):
+        import emailage
+        self.assertRaises(AttributeError, getattr, emailage, 'missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
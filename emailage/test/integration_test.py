@@ -5,6 +5,7 @@ import urllib
 import unittest
 
 from emailage.client import ApiDomains, EmailageClient, HttpMethods
+from emailage.stub_server import StubServer
 
 use_urlparse = hasattr(urllib, 'quote')
 
@@ -21,10 +22,13 @@ class IntegrationTest(unittest.TestCase):
         self.api_secret = os.getenv('ENV_SECRET') or 'TEST_SECRET'
         self.api_token = os.getenv('ENV_TOKEN') or 'TEST_TOKEN'
 
+        self.api_domain = os.getenv('ENV_DOMAIN') or ApiDomains.sandbox
         if self.api_secret == 'TEST_SECRET' and self.api_token == 'TEST_TOKEN':
-            raise AssertionError("Ensure you have set valid login credentials in your environment")
+            # Without credentials the tests run against the local stand-in of the API
+            stub = StubServer(self.api_secret, self.api_token).start()
+            self.addCleanup(stub.stop)
+            self.api_domain = stub.url
 
-        self.api_domain = os.getenv('ENV_DOMAIN') or ApiDomains.sandbox
         self.api_user_email = os.getenv('ENV_USER_EMAIL') or 'user.name@emailage.com'
 
         self.client_instance = EmailageClient(self.api_secret, self.api_token)
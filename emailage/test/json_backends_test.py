@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from emailage import json_backends
+from emailage.json_backends import get_loads
+
+
+BODY = u'﻿{"query": {"email": "tést@example.com", "results": [{"EAScore": "42"}]}}'.encode('utf_8')
+EXPECTED = {'query': {'email': u'tést@example.com', 'results': [{'EAScore': '42'}]}}
+
+
+def _installed(module_name):
+    try:
+        __import__(module_name)
+        return True
+    except ImportError:
+        return False
+
+
+class GetLoadsTest(unittest.TestCase):
+
+    def test_stdlib(self):
+        self.assertEqual(get_loads()(BODY), EXPECTED)
+        self.assertEqual(get_loads('json')(BODY[3:]), EXPECTED)
+
+    @unittest.skipUnless(_installed('orjson'), 'orjson is not installed')
+    def test_orjson(self):
+        loads = get_loads('orjson')
+        self.assertEqual(loads(BODY), EXPECTED)
+        self.assertEqual(loads(BODY[3:]), EXPECTED)
+
+    @unittest.skipUnless(_installed('ujson'), 'ujson is not installed')
+    def test_ujson(self):
+        self.assertEqual(get_loads('ujson')(BODY), EXPECTED)
+
+    def test_auto(self):
+        self.assertEqual(get_loads('auto')(BODY), EXPECTED)
+
+    def test_custom_function__receives_bytes_without_bom(self):
+        received = []
+        loads = get_loads(lambda content: received.append(content) or {})
+        loads(BODY)
+        self.assertEqual(received, [BODY[3:]])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_loads('simplejson')
+
+    def test_invalid_document(self):
+        for backend in [json_backends.STDLIB, json_backends.AUTO]:
+            with self.assertRaises(ValueError):
+                get_loads(backend)(b'\xef\xbb\xbf{"query": ')
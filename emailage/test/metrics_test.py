@@ -0,0 +1,147 @@
+import unittest
+
+import requests
+from mock import Mock
+
+from emailage import metrics
+from emailage.client import EmailageClient, HttpMethods
+from emailage.metrics import MetricsRegistry, RequestTrace
+from emailage.retry import RetryPolicy
+
+
+def _response(status_code, content=b'\xef\xbb\xbf{"success":[true]}'):
+    response = Mock(spec=requests.Response)
+    response.status_code = status_code
+    response.content = content
+    response.__bool__ = response.__nonzero__ = Mock(return_value=status_code < 400)
+    return response
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry(buckets=(0.1, 1))
+
+    def test_histogram_buckets(self):
+        for seconds in [0.05, 0.1, 0.5, 2]:
+            self.registry.observe(metrics.REQUEST_SECONDS, seconds, endpoint='/x/')
+
+        histogram = self.registry.histogram(metrics.REQUEST_SECONDS, endpoint='/x/')
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 2.65)
+        self.assertEqual(histogram.cumulative_counts(), [(0.1, 2), (1, 3), (float('inf'), 4)])
+        self.assertIsNone(self.registry.histogram(metrics.REQUEST_SECONDS, endpoint='/y/'))
+
+    def test_counters(self):
+        self.registry.increment(metrics.RESPONSES, endpoint='/x/', status=200)
+        self.registry.increment(metrics.RESPONSES, 2, endpoint='/x/', status='200')
+
+        self.assertEqual(self.registry.counter(metrics.RESPONSES, endpoint='/x/', status=200), 3)
+        self.assertEqual(self.registry.counter(metrics.RESPONSES, endpoint='/x/', status=500), 0)
+
+    def test_to_prometheus(self):
+        self.registry.observe(metrics.STAGE_SECONDS, 0.5, endpoint='/x/', stage='network')
+        self.registry.increment(metrics.RESPONSES, endpoint='/x/', status=429)
+
+        self.assertEqual(self.registry.to_prometheus(), '\n'.join([
+            '# HELP emailage_stage_duration_seconds ' + metrics._HELP[metrics.STAGE_SECONDS],
+            '# TYPE emailage_stage_duration_seconds histogram',
+            'emailage_stage_duration_seconds_bucket{endpoint="/x/",stage="network",le="0.1"} 0',
+            'emailage_stage_duration_seconds_bucket{endpoint="/x/",stage="network",le="1"} 1',
+            'emailage_stage_duration_seconds_bucket{endpoint="/x/",stage="network",le="+Inf"} 1',
+            'emailage_stage_duration_seconds_sum{endpoint="/x/",stage="network"} 0.5',
+            'emailage_stage_duration_seconds_count{endpoint="/x/",stage="network"} 1',
+            '# HELP emailage_responses_total ' + metrics._HELP[metrics.RESPONSES],
+            '# TYPE emailage_responses_total counter',
+            'emailage_responses_total{endpoint="/x/",status="429"} 1',
+        ]) + '\n')
+
+    def test_label_escaping(self):
+        self.registry.increment(metrics.ERRORS, endpoint='/x/', error='a"b\\c\nd')
+        self.assertIn('error="a\\"b\\\\c\\nd"', self.registry.to_prometheus())
+
+    def test_trace_laps_accumulate(self):
+        trace = RequestTrace('/x/', 'GET')
+        trace.lap(metrics.NETWORK)
+        trace.lap(metrics.NETWORK)
+        trace.finish()
+        self.assertEqual(list(trace.stages), [metrics.NETWORK])
+        self.assertGreaterEqual(trace.duration, trace.stages[metrics.NETWORK])
+
+
+class ClientMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.subj = EmailageClient('secret', 'token', sandbox=True, metrics=self.registry,
+                                   retry_policy=RetryPolicy(sleep=lambda seconds: None))
+        self.subj.session = Mock(spec=requests.Session)
+        self.subj.session.get.side_effect = lambda *args, **kwargs: _response(200)
+        self.subj.session.post.side_effect = lambda *args, **kwargs: _response(200)
+
+    def test_get__records_every_stage(self):
+        self.subj.query('test@example.com')
+
+        for stage in [metrics.SIGN, metrics.ENCODE, metrics.NETWORK, metrics.DECODE]:
+            histogram = self.registry.histogram(metrics.STAGE_SECONDS, endpoint='/emailagevalidator/', stage=stage)
+            self.assertEqual(histogram.count, 1, stage)
+        self.assertIsNone(self.registry.histogram(metrics.STAGE_SECONDS, endpoint='/emailagevalidator/',
+                                                  stage=metrics.THROTTLE))
+        self.assertEqual(self.registry.histogram(metrics.REQUEST_SECONDS, endpoint='/emailagevalidator/',
+                                                 method='GET').count, 1)
+        self.assertEqual(self.registry.counter(metrics.RESPONSES, endpoint='/emailagevalidator/', status=200), 1)
+        sent_qs = self.subj.session.get.call_args[1]['params']
+        self.assertEqual(self.registry.counter(metrics.SENT_BYTES, endpoint='/emailagevalidator/'), len(sent_qs))
+        self.assertEqual(self.registry.counter(metrics.RECEIVED_BYTES, endpoint='/emailagevalidator/'), 21)
+
+    def test_post__flag_endpoint(self):
+        self.subj.set_http_method(HttpMethods.POST)
+        self.subj.flag_as_good('test@example.com')
+
+        self.assertEqual(self.registry.histogram(metrics.REQUEST_SECONDS, endpoint='/emailagevalidator/flag/',
+                                                 method='POST').count, 1)
+        self.assertEqual(self.registry.histogram(metrics.STAGE_SECONDS, endpoint='/emailagevalidator/flag/',
+                                                 stage=metrics.ENCODE).count, 1)
+
+    def test_retries_and_statuses(self):
+        self.subj.session.get.side_effect = [_response(503), _response(429), _response(200)]
+        self.subj.query('test@example.com')
+
+        endpoint = '/emailagevalidator/'
+        self.assertEqual(self.registry.counter(metrics.RETRIES, endpoint=endpoint), 2)
+        for status in [503, 429, 200]:
+            self.assertEqual(self.registry.counter(metrics.RESPONSES, endpoint=endpoint, status=status), 1)
+        self.assertEqual(self.registry.histogram(metrics.STAGE_SECONDS, endpoint=endpoint,
+                                                 stage=metrics.NETWORK).count, 1)
+
+    def test_errors(self):
+        self.subj.session.get.side_effect = lambda *args, **kwargs: _response(400)
+        self.assertRaises(ValueError, self.subj.query, 'test@example.com')
+
+        self.assertEqual(self.registry.counter(metrics.ERRORS, endpoint='/emailagevalidator/', error='ErrorResponse'), 1)
+        self.assertIsNone(self.registry.histogram(metrics.REQUEST_SECONDS, endpoint='/emailagevalidator/',
+                                                  method='GET'))
+
+    def test_hooks(self):
+        self.subj.metrics = None
+        requests_seen, traces = [], []
+        self.subj.request_hooks.append(lambda endpoint, params: requests_seen.append((endpoint, params['query'])))
+        self.subj.response_hooks.append(lambda trace, response: traces.append((trace, response.status_code)))
+
+        self.subj.query('test@example.com')
+        self.assertEqual(requests_seen, [('', 'test@example.com')])
+        self.assertEqual(len(traces), 1)
+        trace, status = traces[0]
+        self.assertEqual(status, 200)
+        self.assertEqual(trace.statuses, [200])
+        self.assertIn(metrics.NETWORK, trace.stages)
+
+    def test_disabled__no_trace(self):
+        self.subj.metrics = None
+        self.subj._finish_trace = Mock()
+        self.assertEqual(self.subj.query('test@example.com'), {'success': [True]})
+        self.subj._finish_trace.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Connection reuse of the client against a local keep-alive HTTP server."""
+import json
+import socket
+import threading
+import time
+import unittest
+
+from six.moves import BaseHTTPServer, socketserver
+
+from emailage.client import EmailageClient
+from emailage.pooling import CancelScope
+from emailage.retry import RequestCancelled
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(2 if self.path.startswith('/slow') else 0.01)
+        body = json.dumps({'success': [True]}).encode('utf_8_sig')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class PoolingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.domain = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _client(self, **pool_options):
+        client = EmailageClient('secret', 'token')
+        client.set_api_domain(self.domain, **pool_options)
+        return client
+
+    def _run_threads(self, client, threads, queries):
+        def worker():
+            for _ in range(queries):
+                client.query('test@example.com')
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+
+    def test_reuses_connections(self):
+        client = self._client()
+        for _ in range(5):
+            client.query('test@example.com')
+
+        stats = client.pool_stats()
+        self.assertEqual((stats.in_use, stats.idle, stats.created, stats.discarded), (0, 1, 1, 0))
+
+    def test_undersized_pool_discards_connections(self):
+        client = self._client(pool_maxsize=2)
+        self._run_threads(client, threads=8, queries=3)
+
+        stats = client.pool_stats()
+        self.assertEqual(stats.in_use, 0)
+        self.assertEqual(stats.idle, 2)
+        self.assertGreater(stats.discarded, 0)
+        self.assertEqual(stats.created, stats.idle + stats.discarded)
+
+    def test_blocking_pool_caps_connections(self):
+        client = self._client(pool_maxsize=2, pool_block=True)
+        self._run_threads(client, threads=8, queries=3)
+
+        stats = client.pool_stats()
+        self.assertLessEqual(stats.created, 2)
+        self.assertEqual(stats.discarded, 0)
+
+    def test_pool_options_are_kept_across_domains(self):
+        client = EmailageClient('secret', 'token', pool_maxsize=16, tcp_keepalive_idle=30)
+        client.set_api_domain(self.domain, pool_block=True)
+
+        self.assertEqual(client.pool_options, dict(pool_connections=10, pool_maxsize=16, pool_block=True,
+                                                   tcp_keepalive_idle=30))
+        client.query('test@example.com')
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+                      client.session.get_adapter(self.domain).poolmanager.connection_pool_kw['socket_options'])
+
+    def test_credential_and_domain_changes_keep_the_pool(self):
+        client = self._client()
+        session, adapter = client.session, client.session.get_adapter(self.domain)
+        client.query('test@example.com')
+
+        client.set_credentials('other_secret', 'other_token')
+        client.query('test@example.com')
+        other_domain = self.domain.replace('127.0.0.1', 'localhost')
+        client.set_api_domain(other_domain)
+        client.query('test@example.com')
+        client.set_api_domain(self.domain)
+        client.query('test@example.com')
+
+        self.assertIs(client.session, session)
+        self.assertIs(client.session.get_adapter(self.domain), adapter)
+        self.assertEqual(client.pool_stats().created, 1)
+        self.assertIsNot(client.session.get_adapter(other_domain), adapter)
+
+    def test_changed_pool_options_replace_the_pool(self):
+        client = self._client()
+        adapter = client.session.get_adapter(self.domain)
+        client.set_api_domain(self.domain)
+        self.assertIs(client.session.get_adapter(self.domain), adapter)
+        client.set_api_domain(self.domain, pool_maxsize=4)
+        self.assertIsNot(client.session.get_adapter(self.domain), adapter)
+
+    def test_cancel_scope_closes_the_connection_of_the_request(self):
+        client = self._client()
+        client.query('test@example.com')
+        scope = CancelScope()
+        threading.Timer(0.05, scope.cancel).start()
+        started_at = time.time()
+        with self.assertRaises(RequestCancelled):
+            with scope:
+                client.session.get(self.domain + '/slow')
+        self.assertLess(time.time() - started_at, 1)
+        scope.cancel()
+
+        client.query('test@example.com')
+        stats = client.pool_stats()
+        self.assertEqual((stats.in_use, stats.idle, stats.created), (0, 1, 2))
+
+    def test_cancelled_scope_does_not_wait_for_the_response(self):
+        client = self._client()
+        scope = CancelScope(on_start=lambda cancel: cancel())
+        started_at = time.time()
+        with self.assertRaises(RequestCancelled):
+            with scope:
+                client.session.get(self.domain + '/slow')
+        self.assertLess(time.time() - started_at, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
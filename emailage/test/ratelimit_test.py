@@ -0,0 +1,116 @@
+import multiprocessing
+import threading
+import time
+import unittest
+
+import requests
+from mock import Mock
+
+from emailage.client import EmailageClient
+from emailage.ratelimit import RateLimitExceeded, SharedTokenBucket, TokenBucket
+from emailage.test.helpers import FakeClock
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(rate=10, capacity=3, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_allows_burst_then_rate(self):
+        self.assertEqual([self.bucket.acquire(blocking=False) for _ in range(4)], [True, True, True, False])
+        self.clock.now += 0.1
+        self.assertTrue(self.bucket.acquire(blocking=False))
+        self.assertFalse(self.bucket.acquire(blocking=False))
+
+    def test_refill_is_capped_at_capacity(self):
+        self.clock.now += 100
+        self.assertEqual(sum(self.bucket.acquire(blocking=False) for _ in range(10)), 3)
+
+    def test_blocking_acquire_waits(self):
+        for _ in range(3):
+            self.bucket.acquire()
+        self.assertTrue(self.bucket.acquire())
+        self.assertAlmostEqual(self.clock.now, 0.1)
+
+    def test_acquire_timeout(self):
+        for _ in range(3):
+            self.bucket.acquire()
+        self.assertFalse(self.bucket.acquire(timeout=0.05))
+        self.assertTrue(self.bucket.acquire(timeout=0.05))
+
+    def test_rejects_invalid_settings(self):
+        self.assertRaises(ValueError, TokenBucket, rate=0)
+        self.assertRaises(ValueError, self.bucket.acquire, tokens=4)
+
+    def test_shared_across_threads(self):
+        bucket = TokenBucket(rate=200, capacity=10)
+        acquired = []
+
+        def worker():
+            for _ in range(15):
+                bucket.acquire()
+                acquired.append(time.time())
+
+        started_at = time.time()
+        workers = [threading.Thread(target=worker) for _ in range(4)]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+
+        # 60 tokens: a burst of 10, then 50 at 200 per second
+        self.assertEqual(len(acquired), 60)
+        self.assertGreaterEqual(time.time() - started_at, 0.2)
+
+
+def _acquire_all(bucket, count):
+    for _ in range(count):
+        bucket.acquire()
+
+
+class SharedTokenBucketTest(unittest.TestCase):
+
+    def test_behaves_like_a_token_bucket(self):
+        clock = FakeClock()
+        bucket = SharedTokenBucket(rate=10, capacity=3, clock=clock, sleep=clock.sleep)
+        self.assertEqual([bucket.acquire(blocking=False) for _ in range(4)], [True, True, True, False])
+        clock.now += 0.1
+        self.assertTrue(bucket.acquire(blocking=False))
+
+    def test_shared_across_processes(self):
+        bucket = SharedTokenBucket(rate=200, capacity=10)
+        started_at = time.time()
+        workers = [multiprocessing.Process(target=_acquire_all, args=(bucket, 15)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        # 60 tokens: a burst of 10, then 50 at 200 per second, whatever the number of processes. The bucket refills
+        # within milliseconds afterwards, so only the time taken tells that the processes shared it
+        self.assertEqual([worker.exitcode for worker in workers], [0] * 4)
+        self.assertGreaterEqual(time.time() - started_at, 0.25)
+
+
+class ClientRateLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(rate=1, capacity=1, clock=self.clock, sleep=self.clock.sleep)
+        self.subj = EmailageClient('secret', 'token', sandbox=True, rate_limiter=self.bucket, rate_limit_timeout=0)
+        self.subj.session = Mock(spec=requests.Session)
+        self.subj.session.get.return_value.content = b'{}'
+
+    def test_throttles_before_sending(self):
+        self.subj.query('test@example.com')
+        self.assertRaises(RateLimitExceeded, self.subj.query, 'test@example.com')
+        self.assertEqual(self.subj.session.get.call_count, 1)
+
+        self.clock.now += 1
+        self.subj.query('test@example.com')
+        self.assertEqual(self.subj.session.get.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
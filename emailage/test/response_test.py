@@ -0,0 +1,70 @@
+import json
+import pickle
+import unittest
+
+from emailage.json_backends import get_loads
+from emailage.response import QueryResult
+
+
+DOCUMENT = {
+    'query': {
+        'email': 'test%40example.com',
+        'queryType': 'EmailAgeVerification',
+        'results': [{
+            'email': 'test@example.com',
+            'EAScore': '512',
+            'EAReason': 'Limited History for Email',
+            'EAReasonID': '8',
+            'EARiskBandID': '3',
+            'EARiskBand': 'Fraud Score 301 to 600',
+            'EAAdvice': 'Moderate Fraud Risk',
+        }]
+    },
+    'responseStatus': {'status': 'success', 'errorCode': '0', 'description': ''}
+}
+
+
+class QueryResultTest(unittest.TestCase):
+
+    def setUp(self):
+        self.content = b'\xef\xbb\xbf' + json.dumps(DOCUMENT).encode('utf_8')
+        self.result = QueryResult.from_bytes(self.content)
+
+    def test_common_fields(self):
+        self.assertTrue(self.result.ok)
+        self.assertEqual(self.result.error_code, '0')
+        self.assertEqual(self.result.score, 512)
+        self.assertEqual(self.result.band, 'Fraud Score 301 to 600')
+        self.assertEqual(self.result.band_id, 3)
+        self.assertEqual(self.result.reason, 'Limited History for Email')
+        self.assertEqual(self.result.reason_id, 8)
+        self.assertEqual(self.result.advice, 'Moderate Fraud Risk')
+
+    def test_document_decoded_on_first_access(self):
+        self.assertEqual(self.result.raw, self.content[3:])
+        self.assertIsNone(self.result._document)
+        self.assertEqual(self.result.to_dict(), DOCUMENT)
+        self.assertIs(self.result.to_dict(), self.result.to_dict())
+        self.assertEqual(self.result['query']['queryType'], 'EmailAgeVerification')
+        self.assertIsNone(self.result.get('missing'))
+
+    def test_no_instance_dict(self):
+        with self.assertRaises(AttributeError):
+            self.result.extra = 1
+
+    def test_error_response(self):
+        result = QueryResult.from_bytes(b'{"query": {"email": "x"}, '
+                                        b'"responseStatus": {"status": "failed", "errorCode": "3001"}}')
+        self.assertFalse(result.ok)
+        self.assertEqual(result.error_code, '3001')
+        self.assertIsNone(result.score)
+        self.assertIsNone(result.band)
+
+    def test_pickle(self):
+        result = pickle.loads(pickle.dumps(self.result))
+        self.assertEqual(result.score, 512)
+        self.assertEqual(result.to_dict(), DOCUMENT)
+
+    def test_pickle__custom_backend(self):
+        result = QueryResult.from_bytes(self.result.raw, get_loads(lambda content: json.loads(content.decode())))
+        self.assertEqual(pickle.loads(pickle.dumps(result)).to_dict(), DOCUMENT)
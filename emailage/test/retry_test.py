@@ -0,0 +1,157 @@
+import pickle
+import unittest
+
+import requests
+from mock import Mock
+
+from emailage.client import EmailageClient
+from emailage.retry import CircuitBreaker, CircuitOpenError, ErrorResponse, RetryPolicy
+from emailage.test.helpers import FakeClock
+
+
+def _response(status_code, content=b'{"success":[true]}'):
+    response = Mock(spec=requests.Response)
+    response.status_code = status_code
+    response.content = content
+    response.__bool__ = response.__nonzero__ = Mock(return_value=status_code < 400)
+    return response
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.policy = RetryPolicy(max_attempts=4, backoff_base=1, backoff_max=3, clock=self.clock,
+                                  sleep=self.clock.sleep, rand=lambda: 1.0)
+
+    def test_backoff_is_exponential_and_capped(self):
+        self.assertEqual([self.policy.backoff(n) for n in range(1, 5)], [1, 2, 3, 3])
+
+    def test_backoff_has_full_jitter(self):
+        policy = RetryPolicy(backoff_base=1, rand=lambda: 0.25)
+        self.assertEqual(policy.backoff(3), 1)
+
+    def test_retries_transient_errors(self):
+        attempt = Mock(side_effect=[requests.ConnectionError(), _response(503), _response(200)])
+        on_retry = Mock()
+
+        self.assertEqual(self.policy.run(attempt, on_retry).status_code, 200)
+        self.assertEqual(attempt.call_count, 3)
+        self.assertEqual(self.clock.sleeps, [1, 2])
+        self.assertEqual(on_retry.call_count, 2)
+
+    def test_does_not_retry_permanent_errors(self):
+        attempt = Mock(side_effect=[ValueError(), _response(200)])
+        self.assertRaises(ValueError, self.policy.run, attempt)
+
+        attempt = Mock(return_value=_response(400))
+        self.assertEqual(self.policy.run(attempt).status_code, 400)
+        self.assertEqual(attempt.call_count, 1)
+
+    def test_retries_error_statuses_raised(self):
+        attempt = Mock(side_effect=[ErrorResponse('throttled', 429), ErrorResponse('unavailable', 503), 'flagged'])
+        self.assertEqual(self.policy.run(attempt), 'flagged')
+        self.assertEqual(attempt.call_count, 3)
+
+        attempt = Mock(side_effect=[ErrorResponse('bad request', 400), 'flagged'])
+        self.assertRaises(ErrorResponse, self.policy.run, attempt)
+        self.assertEqual(attempt.call_count, 1)
+
+        copy = pickle.loads(pickle.dumps(ErrorResponse('unavailable', 503)))
+        self.assertEqual((str(copy), copy.status_code), ('unavailable', 503))
+
+    def test_stops_after_max_attempts(self):
+        attempt = Mock(side_effect=requests.Timeout())
+        self.assertRaises(requests.Timeout, self.policy.run, attempt)
+        self.assertEqual(attempt.call_count, 4)
+
+    def test_stops_at_total_time_budget(self):
+        self.policy.total_timeout = 2.5
+        attempt = Mock(return_value=_response(500))
+
+        self.assertEqual(self.policy.run(attempt).status_code, 500)
+        self.assertEqual(attempt.call_count, 2)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10, clock=self.clock)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.breaker.record_response(_response(502))
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(CircuitOpenError, self.breaker.before_request)
+
+    def test_half_open_probe_closes(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.now += 10
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.before_request()
+        self.assertRaises(CircuitOpenError, self.breaker.before_request)
+        self.breaker.record_response(_response(200))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_probe_failure_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.now += 10
+
+        self.breaker.before_request()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_cancelled_requests_count_for_nothing(self):
+        self.breaker.record_failure()
+        self.breaker.release()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        self.clock.now += 10
+        self.breaker.before_request()
+        self.breaker.release()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.before_request()
+
+
+class ClientRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.subj = EmailageClient('secret', 'token', sandbox=True,
+                                   retry_policy=RetryPolicy(clock=self.clock, sleep=self.clock.sleep),
+                                   circuit_breaker=CircuitBreaker(failure_threshold=3, clock=self.clock))
+        self.subj.session = Mock(spec=requests.Session)
+
+    def test_query__retries_with_fresh_signature(self):
+        self.subj.session.get.side_effect = [_response(503), requests.ConnectionError(), _response(200)]
+
+        self.assertEqual(self.subj.query('test@example.com'), {'success': [True]})
+        sent = [call[1]['params'] for call in self.subj.session.get.call_args_list]
+        self.assertEqual(len(set(sent)), 3)
+        self.assertEqual(self.subj.circuit_breaker.state, CircuitBreaker.CLOSED)
+
+    def test_flag__is_not_retried(self):
+        self.subj.session.get.side_effect = [requests.ConnectionError(), _response(200)]
+
+        self.assertRaises(requests.ConnectionError, self.subj.flag_as_good, 'test@example.com')
+        self.assertEqual(self.subj.session.get.call_count, 1)
+
+    def test_open_circuit_fails_fast(self):
+        self.subj.session.get.side_effect = requests.ConnectionError()
+
+        self.assertRaises(requests.ConnectionError, self.subj.query, 'test@example.com')
+        self.assertRaises(CircuitOpenError, self.subj.query, 'test@example.com')
+        self.assertEqual(self.subj.session.get.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
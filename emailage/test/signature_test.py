@@ -1,7 +1,14 @@
+# -*- coding: UTF-8 -*-
 """Samples given according to http://oauth.net/core/1.0/#sig_base_example"""
 from __future__ import print_function
+import os
+import random
+import sys
+import threading
 import unittest
 
+from six.moves.urllib.parse import quote, urlencode
+
 from emailage import signature
 
 
@@ -87,6 +94,151 @@ class SignatureTest(unittest.TestCase):
         result = signature.create(self.method, self.url, self.params, self.hmac_key)
         self.assertEqual(result, 'tR3+Ty81lMeYAr/Fid0kMTYa/WM=')
 
+    def test_signer_matches_create(self):
+        signer = signature.Signer(self.hmac_key, self.method, self.url)
+        self.assertEqual(signer.sign(self.params), 'tR3+Ty81lMeYAr/Fid0kMTYa/WM=')
+        # The pre-keyed state is copied, never consumed
+        self.assertEqual(signer.sign(self.params), 'tR3+Ty81lMeYAr/Fid0kMTYa/WM=')
+
+    def test_signer_matches_create_with_spaces_and_unicode(self):
+        for method in ['GET', 'POST', 'post']:
+            for params in [self.spaces_params_first_name, self.spaces_params_last_name,
+                           {'billcity': u'\u0425\u0430\u043d\u0442\u044b-\u041c\u0430\u043d\u0441\u0438\u0439\u0441\u043a'}]:
+                query_dict = self._add_test_oauth_params_to_request_dict(dict(params))
+                query_dict['query'] = self.test_query_email + '+' + self.test_query_ip
+                signer = signature.Signer(self.hmac_key, method, self.url)
+                self.assertEqual(signer.sign(query_dict),
+                                 signature.create(method, self.url, query_dict, self.hmac_key))
+
+
+def _legacy_sorted_pairs(params):
+    # The three encoders replaced by signature.EncodedParams, which must produce the same bytes
+    return '&'.join(map(lambda pair: '='.join([quote(str(pair[0]), safe=''), quote(str(pair[1]), safe='')]),
+                        sorted(params.items())))
+
+
+def _legacy_query_string(params):
+    if sys.version_info >= (3, 5):
+        return urlencode(params, quote_via=quote)
+    return _legacy_sorted_pairs(params)
+
+
+class EncodedParamsTest(unittest.TestCase):
+
+    PARAMS = [
+        {},
+        {'format': 'json'},
+        {'query': 'test+emailage@example.com+1.2.3.4', 'format': 'json', 'urid': 'r/1 ?&=#%~'},
+        {'firstname': u'Тюмень Johann', 'lastname': 'van der Grift', 'phone': '+1 (480) 555-9163', 'amount': 12.5,
+         'count': 3, 'flag': True, 'empty': '', 'none': None, 'billcity': u'Ханты-Мансийск'},
+        signature.add_oauth_entries_to_fields_dict('consumer_secret', {'query': 'a@b.co', 'zz': 'last', 'AA': 'upper'},
+                                                   nonce='f0e9', timestamp=1600000000),
+    ]
+
+    def test_byte_identical_to_the_legacy_encoders(self):
+        for params in self.PARAMS:
+            encoded = signature.EncodedParams(params)
+            self.assertEqual(encoded.canonical(), _legacy_sorted_pairs(params))
+            self.assertEqual(encoded.wire(), _legacy_query_string(params))
+            self.assertEqual(signature.normalize_query_parameters(params), _legacy_sorted_pairs(params))
+
+    def test_added_signature_comes_last_on_the_wire(self):
+        params = dict(self.PARAMS[4])
+        encoded = signature.EncodedParams(params)
+        encoded.add('oauth_signature', 'a+b/c=')
+        params['oauth_signature'] = 'a+b/c='
+        self.assertEqual(encoded.wire(), _legacy_query_string(params))
+        self.assertEqual(encoded.canonical(), _legacy_sorted_pairs(params))
+
+    def test_url_safe_values_are_kept(self):
+        self.assertEqual(signature._quote_value('f0e9-1600000000_a.b'), 'f0e9-1600000000_a.b')
+        self.assertEqual(signature._quote_value(1.0), '1.0')
+        for value in ['a~b', 'a b', u'Тюмень', '', 'a/b']:
+            self.assertEqual(signature._quote_value(value), signature.safety_quote(value))
+
+    def test_sign_encoded_matches_sign(self):
+        signer = signature.Signer('token&', 'POST', 'https://api.emailage.com/emailagevalidator/')
+        for params in self.PARAMS:
+            self.assertEqual(signer.sign_encoded(signature.EncodedParams(params)), signer.sign(params))
+
+
+class GeneratorsTest(unittest.TestCase):
+
+    def tearDown(self):
+        signature.set_generators()
+
+    def test_nonces_are_unique_and_need_no_quoting(self):
+        next_nonce = signature.NonceGenerator(batch_size=8)
+        nonces = []
+
+        def worker():
+            nonces.extend(next_nonce() for _ in range(500))
+        workers = [threading.Thread(target=worker) for _ in range(4)]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+
+        self.assertEqual(len(set(nonces)), 2000)
+        for nonce in nonces[:50]:
+            self.assertEqual(len(nonce), 32)
+            self.assertEqual(signature.safety_quote(nonce), nonce)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'os.fork is not available')
+    def test_forked_children_draw_their_own_nonces(self):
+        next_nonce = signature.NonceGenerator()
+        parent_nonce = next_nonce()
+        readers = []
+        for _ in range(3):
+            reader, writer = os.pipe()
+            pid = os.fork()
+            if pid == 0:  # pragma: no cover (child)
+                os.close(reader)
+                os.write(writer, next_nonce().encode('ascii'))
+                os._exit(0)
+            os.close(writer)
+            os.waitpid(pid, 0)
+            readers.append(reader)
+
+        nonces = [parent_nonce, next_nonce()]
+        for reader in readers:
+            nonces.append(os.read(reader, 64).decode('ascii'))
+            os.close(reader)
+        self.assertEqual(len(set(nonces)), 5)
+
+    def test_nonces_are_deterministic_with_seeded_bytes(self):
+        def nonces():
+            rand = random.Random(7)
+            next_nonce = signature.NonceGenerator(size=4, batch_size=3,
+                                                  random_bytes=lambda size: bytes(bytearray(rand.getrandbits(8)
+                                                                                            for _ in range(size))))
+            return [next_nonce() for _ in range(7)]
+        self.assertEqual(nonces(), nonces())
+        self.assertEqual(len(set(nonces())), 7)
+
+    def test_timestamp_is_refreshed_every_second(self):
+        now = [1600000000.2]
+        clock = signature.TimestampClock(clock=lambda: now[0])
+        self.assertEqual(clock(), '1600000000')
+        now[0] = 1600000000.9
+        self.assertEqual(clock(), '1600000000')
+        now[0] = 1600000001.0
+        self.assertEqual(clock(), '1600000001')
+        now[0] = 1599999990.5  # the wall clock was set back
+        self.assertEqual(clock(), '1599999990')
+
+    def test_set_generators(self):
+        signature.set_generators(nonce=lambda: 'fixed', timestamp=lambda: '1')
+        params = signature.add_oauth_entries_to_fields_dict('secret', {})
+        self.assertEqual((params['oauth_nonce'], params['oauth_timestamp']), ('fixed', '1'))
+        self.assertEqual(signature.add_oauth_entries_to_fields_dict('secret', {}, nonce='n', timestamp=2)['oauth_nonce'],
+                         'n')
+
+        signature.set_generators()
+        params = signature.add_oauth_entries_to_fields_dict('secret', {})
+        self.assertEqual(len(params['oauth_nonce']), 32)
+        self.assertTrue(params['oauth_timestamp'].isdigit())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,150 @@
+import threading
+import unittest
+
+from mock import Mock
+
+from emailage.cache import ResponseCache
+from emailage.client import EmailageClient
+from emailage.deadline import DeadlineExceeded
+from emailage.singleflight import FlightStats, SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.release = threading.Event()
+        self.calls = []
+
+    def _slow_call(self, result):
+        def call():
+            self.calls.append(result)
+            self.release.wait(5)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return call
+
+    def _run_concurrently(self, key, func, threads):
+        outcomes = []
+
+        def worker():
+            try:
+                outcomes.append(self.flights.do(key, func))
+            except Exception as exc:
+                outcomes.append(exc)
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for worker_thread in workers:
+            worker_thread.start()
+        while self.flights.stats.calls + self.flights.stats.coalesced < threads:
+            threading.Event().wait(0.001)
+        self.release.set()
+        for worker_thread in workers:
+            worker_thread.join()
+        return outcomes
+
+    def test_concurrent_callers_share_one_call(self):
+        outcomes = self._run_concurrently('key', self._slow_call('response'), threads=8)
+
+        self.assertEqual(outcomes, ['response'] * 8)
+        self.assertEqual(self.calls, ['response'])
+        self.assertEqual(self.flights.stats, FlightStats(calls=1, coalesced=7, in_flight=0))
+
+    def test_error_is_shared(self):
+        error = ValueError('No response received for request')
+        outcomes = self._run_concurrently('key', self._slow_call(error), threads=4)
+
+        self.assertEqual(outcomes, [error] * 4)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_waiters_give_up_at_their_timeout(self):
+        leader = threading.Thread(target=self.flights.do, args=('key', self._slow_call('result')))
+        leader.start()
+        while not self.calls:
+            threading.Event().wait(0.001)
+        with self.assertRaises(DeadlineExceeded):
+            self.flights.do('key', self._slow_call('other'), timeout=0.01)
+        self.release.set()
+        leader.join()
+        self.assertEqual(self.calls, ['result'])
+
+    def test_completed_calls_are_not_remembered(self):
+        self.assertEqual(self.flights.do('key', lambda: 1), 1)
+        self.assertEqual(self.flights.do('key', lambda: 2), 2)
+        self.assertEqual(self.flights.stats.calls, 2)
+
+    def test_distinct_keys_do_not_wait(self):
+        self.assertEqual(self.flights.do('first', lambda: self.flights.do('second', lambda: 2)), 2)
+
+
+class ClientCoalesceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.subj = EmailageClient('secret', 'token', coalesce=True)
+
+        def slow_request(endpoint, **params):
+            self.release.wait(5)
+            return {'query': params['query']}
+        self.subj.request = Mock(side_effect=slow_request)
+
+    def _burst(self, queries, **params):
+        workers = [threading.Thread(target=self.subj.query, args=(query,), kwargs=params) for query in queries]
+        for worker_thread in workers:
+            worker_thread.start()
+        flights = self.subj.singleflight
+        while flights.stats.calls + flights.stats.coalesced < len(queries):
+            threading.Event().wait(0.001)
+        self.release.set()
+        for worker_thread in workers:
+            worker_thread.join()
+
+    def test_burst_costs_one_call_per_unique_key(self):
+        self._burst(['test@example.com'] * 6 + ['Test@Example.com ', 'other@example.com'])
+        self.assertEqual(self.subj.request.call_count, 2)
+
+    def test_with_cache(self):
+        self.subj.cache = ResponseCache()
+        self._burst(['test@example.com'] * 4, use_cache=True)
+        self.subj.query('test@example.com', use_cache=True)
+
+        self.assertEqual(self.subj.request.call_count, 1)
+        self.assertEqual(self.subj.cache.stats.hits, 1)
+
+    def test_deadline_of_one_caller_does_not_fail_the_others(self):
+        def request(endpoint, deadline=None, **params):
+            if deadline is not None and not self.release.wait(deadline.remaining()):
+                raise DeadlineExceeded('Deadline exceeded before decoding')
+            self.release.wait(5)
+            return {'query': params['query']}
+        self.subj.request = Mock(side_effect=request)
+        outcomes = {}
+
+        def caller(name, **params):
+            try:
+                outcomes[name] = self.subj.query('test@example.com', **params)
+            except Exception as exc:
+                outcomes[name] = exc
+        hurried = threading.Thread(target=caller, args=('hurried',), kwargs=dict(deadline=0.1))
+        patient = threading.Thread(target=caller, args=('patient',))
+        hurried.start()
+        while not self.subj.singleflight.stats.calls:
+            threading.Event().wait(0.001)
+        patient.start()
+        while not self.subj.singleflight.stats.coalesced:
+            threading.Event().wait(0.001)
+
+        hurried.join()
+        self.assertIsInstance(outcomes['hurried'], DeadlineExceeded)
+        self.release.set()
+        patient.join()
+        self.assertEqual(outcomes['patient'], {'query': 'test@example.com'})
+        self.assertEqual(self.subj.request.call_count, 1)
+
+    def test_leader_gives_up_at_its_timeout(self):
+        with self.assertRaises(DeadlineExceeded):
+            SingleFlight().do('key', lambda: self.release.wait(5), timeout=0.01)
+        self.release.set()
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(EmailageClient('secret', 'token').singleflight)
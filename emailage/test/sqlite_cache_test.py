@@ -0,0 +1,133 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from mock import Mock
+
+from emailage.client import EmailageClient
+from emailage.response import QueryResult
+from emailage.sqlite_cache import SQLiteResponseCache
+from emailage.test.helpers import FakeClock
+
+
+def _fill(path, prefix, count):
+    cache = SQLiteResponseCache(path, ttl=60, max_entries=1000)
+    for i in range(count):
+        cache.put('{}{}'.format(prefix, i), {'v': i})
+    cache.close()
+
+
+class SQLiteResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'responses.sqlite3')
+        self.clock = FakeClock(1600000000.0)
+        self.cache = self._open()
+
+    def _open(self, **options):
+        options.setdefault('ttl', 10)
+        options.setdefault('max_entries', 2)
+        cache = SQLiteResponseCache(self.path, eviction_interval=1, clock=self.clock, **options)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_hits_and_misses(self):
+        self.assertIsNone(self.cache.get('k1'))
+        self.cache.put('k1', {'v': [1, 'é']})
+        self.assertEqual(self.cache.get('k1'), {'v': [1, u'é']})
+
+        stats = self.cache.stats
+        self.assertEqual((stats.hits, stats.misses, stats.size), (1, 1, 1))
+
+    def test_survives_reopening(self):
+        self.cache.put('k1', {'v': 1}, tag='test@example.com')
+        self.cache.close()
+
+        reopened = self._open()
+        self.assertEqual(reopened.get('k1'), {'v': 1})
+        self.assertEqual(reopened.invalidate('test@example.com'), 1)
+
+    def test_expires_after_ttl(self):
+        self.cache.put('k1', {'v': 1})
+        self.clock.now += 10
+        self.assertIsNone(self.cache.get('k1'))
+        self.assertEqual(self.cache.stats.expirations, 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('k1', 1)
+        self.clock.now += 1
+        self.cache.put('k2', 2)
+        self.clock.now += 1
+        self.cache.get('k1')
+        self.clock.now += 1
+        self.cache.put('k3', 3)
+
+        self.assertIsNone(self.cache.get('k2'))
+        self.assertEqual(self.cache.get('k1'), 1)
+        self.assertEqual(self.cache.get('k3'), 3)
+        self.assertEqual(self.cache.stats.evictions, 1)
+
+    def test_invalidates_by_tag(self):
+        self.cache.put('k1', 1, tag='test@example.com')
+        self.cache.put('k2', 2, tag='other@example.com')
+
+        self.assertEqual(self.cache.invalidate('test@example.com'), 1)
+        self.assertIsNone(self.cache.get('k1'))
+        self.assertEqual(self.cache.get('k2'), 2)
+
+    def test_query_result(self):
+        self.cache.put('k1', QueryResult.from_bytes(b'\xef\xbb\xbf{"query": {"results": [{"EAScore": "42"}]}}'))
+        result = self.cache.get('k1')
+        self.assertIsInstance(result, QueryResult)
+        self.assertEqual(result.score, 42)
+
+    def test_shared_by_threads_and_processes(self):
+        cache = self._open(max_entries=1000)
+        threads = [threading.Thread(target=_fill, args=(self.path, 'thread{}-'.format(n), 50)) for n in range(2)]
+        processes = [multiprocessing.Process(target=_fill, args=(self.path, 'process{}-'.format(n), 50))
+                     for n in range(2)]
+        # Forking while other threads are inside SQLite could copy a held lock into the children
+        for worker in processes + threads:
+            worker.start()
+        for worker in threads + processes:
+            worker.join()
+
+        self.assertEqual([process.exitcode for process in processes], [0, 0])
+        self.assertEqual(len(cache), 200)
+        self.assertEqual(cache.get('process1-49'), {'v': 49})
+
+    def test_connections_of_ended_threads_are_closed(self):
+        def use(barrier):
+            barrier.wait()
+            self.cache.get('key')
+        for _ in range(30):
+            barrier = threading.Barrier(8)
+            with ThreadPoolExecutor(8) as executor:
+                for _ in range(8):
+                    executor.submit(use, barrier)
+        # 241 connections if they outlived their threads
+        self.assertLessEqual(len(self.cache._connections), 9)
+        self.cache.close()
+        self.assertEqual(len(self.cache._connections), 0)
+
+    def test_client_skips_cached_queries(self):
+        client = EmailageClient('secret', 'token', cache=self.cache)
+        client.request = Mock(return_value={'query': 'test@example.com'})
+        client.query('test@example.com', use_cache=True)
+
+        restarted = EmailageClient('secret', 'token', cache=self._open())
+        restarted.request = Mock()
+        self.assertEqual(restarted.query('test@example.com', use_cache=True), {'query': 'test@example.com'})
+        restarted.request.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
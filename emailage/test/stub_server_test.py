@@ -0,0 +1,73 @@
+# -*- coding: UTF-8 -*-
+import unittest
+
+import requests
+
+from emailage.client import EmailageClient, HttpMethods
+from emailage.retry import RetryPolicy
+from emailage.stub_server import AUTHENTICATION_FAILURES, DROPPED, StubServer, score_result
+
+
+class StubServerTest(unittest.TestCase):
+
+    def _start(self, **options):
+        self.stub = StubServer('secret', 'token', seed=7, **options).start()
+        self.addCleanup(self.stub.stop)
+
+    def _client(self, http_method=HttpMethods.GET, token='token', **options):
+        client = EmailageClient('secret', token, http_method=http_method, **options)
+        client.set_api_domain(self.stub.url)
+        return client
+
+    def test_query__get_and_post(self):
+        self._start()
+        for http_method in [HttpMethods.GET, HttpMethods.POST]:
+            response = self._client(http_method).query(('test+emailage@example.com', '1.234.56.7'),
+                                                        firstname='Тюмень Johann', urid='r1')
+            self.assertEqual(response['responseStatus'], {'status': 'success', 'errorCode': '0', 'description': ''})
+            self.assertEqual(response['query']['email'], 'test+emailage@example.com+1.234.56.7')
+            self.assertEqual(response['query']['results'][0], score_result('test+emailage@example.com', '1.234.56.7'))
+        self.assertEqual(self.stub.stats(), {200: 2})
+
+    def test_query__same_email_same_score(self):
+        self._start()
+        client = self._client()
+        first = client.query('Test@Example.com')['query']['results'][0]['EAScore']
+        self.assertEqual(client.query('test@example.com')['query']['results'][0]['EAScore'], first)
+
+    def test_flag(self):
+        self._start()
+        response = self._client(HttpMethods.POST).flag_as_fraud('test@example.com', 3)
+        self.assertEqual(response['query'], {'email': 'test@example.com', 'flag': 'fraud', 'fraudcodeID': '3'})
+
+    def test_rejects_wrong_signature(self):
+        self._start()
+        response = self._client(token='other_token').query('test@example.com')
+        self.assertEqual(response['responseStatus']['status'], 'failed')
+        self.assertEqual(response['responseStatus']['errorCode'], '3001')
+        self.assertEqual(self.stub.stats()[AUTHENTICATION_FAILURES], 1)
+
+    def test_error_rate__retried_by_client(self):
+        self._start(error_rate=0.5)
+        client = self._client(retry_policy=RetryPolicy(max_attempts=20, backoff_base=0.001))
+        for _ in range(10):
+            client.query('test@example.com')
+        stats = self.stub.stats()
+        self.assertEqual(stats[200], 10)
+        self.assertGreater(stats.get(500, 0) + stats.get(503, 0), 0)
+
+    def test_rate_limit(self):
+        self._start(rate_limit=5)
+        client = self._client()
+        statuses = [client.session.get(self.stub.url + '/emailagevalidator/').status_code for _ in range(10)]
+        self.assertIn(429, statuses)
+        self.assertEqual(statuses[0], 200)
+
+    def test_drop(self):
+        self._start(drop_rate=1)
+        self.assertRaises(requests.ConnectionError, self._client().query, 'test@example.com')
+        self.assertEqual(self.stub.stats(), {DROPPED: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
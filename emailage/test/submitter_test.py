@@ -0,0 +1,203 @@
+import gc
+import json
+import threading
+import unittest
+import weakref
+
+import requests
+from mock import Mock
+from requests.exceptions import ConnectionError, ReadTimeout
+
+from emailage.client import EmailageClient
+from emailage.retry import ErrorResponse, RetryPolicy
+from emailage.submitter import FlagRejected, FlagRequest, FlagSubmitter, QueueFullError
+
+
+SUCCESS = {'responseStatus': {'status': 'success', 'errorCode': '0', 'description': ''}}
+
+
+class FlagSubmitterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = EmailageClient('secret', 'token')
+        self.client.flag = Mock(return_value=SUCCESS)
+        self.dead_letters = []
+
+    def _submitter(self, **options):
+        options.setdefault('flush_interval', 60)
+        options.setdefault('flush_at_exit', False)
+        options.setdefault('on_dead_letter', lambda request, error: self.dead_letters.append((request, error)))
+        submitter = FlagSubmitter(self.client, retry_policy=RetryPolicy(max_attempts=3, sleep=lambda seconds: None),
+                                  **options)
+        self.addCleanup(submitter.close, 0.2)
+        return submitter
+
+    def test_flag_returns_before_sending(self):
+        sent = threading.Event()
+        self.client.flag.side_effect = lambda *args: sent.wait(5) and SUCCESS
+        submitter = self._submitter(flush_interval=0)
+
+        submitter.flag_as_fraud('test@example.com', 8)
+        self.assertEqual(submitter.stats.pending, 1)
+        sent.set()
+        self.assertTrue(submitter.flush(5))
+        self.client.flag.assert_called_once_with('fraud', 'test@example.com', 8)
+
+    def test_repeated_flags_of_an_email_are_sent_once(self):
+        submitter = self._submitter()
+        submitter.flag_as_fraud('test@example.com', 8)
+        submitter.flag_as_fraud('Test@Example.com', 8)
+        submitter.flag_as_good('test@example.com')
+        submitter.flag_as_good('other@example.com')
+        self.assertEqual(self.client.flag.call_count, 0)
+
+        self.assertTrue(submitter.flush(5))
+        self.assertEqual(sorted(call[0] for call in self.client.flag.call_args_list),
+                         [('good', 'other@example.com', None), ('good', 'test@example.com', None)])
+        self.assertEqual(submitter.stats, (2, 2, 2, 0, 0, 0))
+
+    def test_window_expiry_sends_without_flush(self):
+        sent = threading.Event()
+        self.client.flag.side_effect = lambda *args: sent.set() or SUCCESS
+        submitter = self._submitter(flush_interval=0.05)
+        submitter.remove_flag('test@example.com')
+        self.assertTrue(sent.wait(5))
+
+    def test_retries_then_succeeds(self):
+        self.client.flag.side_effect = [ConnectionError('reset'), ReadTimeout('timed out'), SUCCESS]
+        submitter = self._submitter()
+        submitter.flag_as_good('test@example.com')
+
+        self.assertTrue(submitter.flush(5))
+        self.assertEqual(self.client.flag.call_count, 3)
+        self.assertEqual(submitter.stats.retries, 2)
+        self.assertEqual(submitter.stats.sent, 1)
+        self.assertEqual(self.dead_letters, [])
+
+    def test_error_statuses_are_retried(self):
+        def response(status_code):
+            response = Mock(spec=requests.Response, status_code=status_code, content=json.dumps(SUCCESS).encode())
+            response.__bool__ = response.__nonzero__ = Mock(return_value=status_code < 400)
+            return response
+        client = EmailageClient('secret', 'token')
+        client.session = Mock(spec=requests.Session)
+        client.session.get.side_effect = [response(503), response(429), response(200)]
+        self.client = client
+        submitter = self._submitter()
+        submitter.flag_as_good('test@example.com')
+
+        self.assertTrue(submitter.flush(5))
+        self.assertEqual(client.session.get.call_count, 3)
+        self.assertEqual(submitter.stats.retries, 2)
+        self.assertEqual(submitter.stats.sent, 1)
+        self.assertEqual(self.dead_letters, [])
+
+    def test_dead_letter_after_last_attempt(self):
+        self.client.flag.side_effect = ConnectionError('reset')
+        submitter = self._submitter()
+        submitter.flag_as_fraud('test@example.com', 3)
+
+        self.assertTrue(submitter.flush(5))
+        self.assertEqual(self.client.flag.call_count, 3)
+        self.assertEqual(len(self.dead_letters), 1)
+        self.assertEqual(self.dead_letters[0][0], FlagRequest('fraud', 'test@example.com', 3))
+        self.assertIsInstance(self.dead_letters[0][1], ConnectionError)
+
+    def test_permanent_errors_are_not_retried(self):
+        self.client.flag.side_effect = ErrorResponse('No response received for request', 400)
+        submitter = self._submitter()
+        submitter.flag_as_good('test@example.com')
+
+        self.assertTrue(submitter.flush(5))
+        self.assertEqual(self.client.flag.call_count, 1)
+        self.assertIsInstance(self.dead_letters[0][1], ValueError)
+        self.assertEqual(submitter.stats.retries, 0)
+
+    def test_workers_survive_failing_callbacks_and_responses(self):
+        def on_dead_letter(request, error):
+            raise RuntimeError('dead-letter queue unavailable')
+        self.client.flag.side_effect = [ConnectionError('reset')] * 3 + ['not a dict', SUCCESS]
+        submitter = self._submitter(workers=1, on_dead_letter=on_dead_letter)
+        with self.assertLogs('emailage.submitter') as logs:
+            submitter.flag_as_good('a@example.com')
+            submitter.flag_as_good('b@example.com')
+            submitter.flag_as_good('c@example.com')
+            self.assertTrue(submitter.close(2))
+
+        self.assertEqual(submitter.stats[2:5], (1, 2, 2))
+        self.assertEqual(len(logs.records), 2)
+
+    def test_closed_submitter_is_released(self):
+        submitter = FlagSubmitter(self.client, flush_at_exit=True)
+        self.assertTrue(submitter.close(2))
+        for worker in submitter._workers:
+            worker.join(2)
+        reference = weakref.ref(submitter)
+        del submitter
+        gc.collect()
+        self.assertIsNone(reference())
+
+    def test_dead_letter_on_api_rejection_without_retry(self):
+        rejection = {'responseStatus': {'status': 'failed', 'errorCode': '3001', 'description': 'Authentication Error'}}
+        self.client.flag.return_value = rejection
+        submitter = self._submitter()
+        submitter.flag_as_good('test@example.com')
+
+        self.assertTrue(submitter.flush(5))
+        self.assertEqual(self.client.flag.call_count, 1)
+        error = self.dead_letters[0][1]
+        self.assertIsInstance(error, FlagRejected)
+        self.assertIs(error.response, rejection)
+        self.assertIn('3001', str(error))
+
+    def test_invalid_flags_fail_in_the_caller(self):
+        submitter = self._submitter()
+        self.assertRaises(ValueError, submitter.flag, 'bad', 'test@example.com')
+        self.assertRaises(ValueError, submitter.flag_as_good, 'not an email')
+        self.assertRaises(ValueError, submitter.flag, 'fraud', 'test@example.com')
+        self.assertEqual(submitter.stats.submitted, 0)
+
+    def test_bounded_queue(self):
+        submitter = self._submitter(workers=0, max_queue_size=2)
+        submitter.flag_as_good('a@example.com')
+        submitter.flag_as_good('b@example.com')
+        submitter.flag_as_good('a@example.com')
+
+        self.assertRaises(QueueFullError, submitter.flag_as_good, 'c@example.com', block=False)
+        self.assertRaises(QueueFullError, submitter.flag_as_good, 'c@example.com', timeout=0.01)
+        self.assertFalse(submitter.flush(0.01))
+
+    def test_close_sends_queued_flags_and_stops_accepting(self):
+        submitter = self._submitter(workers=3)
+        for index in range(20):
+            submitter.flag_as_good('user{}@example.com'.format(index))
+
+        self.assertTrue(submitter.close())
+        self.assertEqual(self.client.flag.call_count, 20)
+        self.assertFalse(any(worker.is_alive() for worker in submitter._workers))
+        self.assertRaises(RuntimeError, submitter.flag_as_good, 'late@example.com')
+        self.assertTrue(submitter.close())
+
+    def test_flags_of_one_email_are_not_sent_concurrently(self):
+        release = threading.Event()
+        first_sent = threading.Event()
+
+        def flag(*args):
+            first_sent.set()
+            release.wait(5)
+            return SUCCESS
+        self.client.flag.side_effect = flag
+        submitter = self._submitter(workers=2, flush_interval=0)
+        submitter.flag_as_fraud('test@example.com', 8)
+        self.assertTrue(first_sent.wait(5))
+        submitter.flag_as_good('test@example.com')
+
+        self.assertFalse(submitter.flush(0.1))
+        self.assertEqual(self.client.flag.call_count, 1)
+        release.set()
+        self.assertTrue(submitter.flush(5))
+        self.assertEqual(self.client.flag.call_args_list[1][0], ('good', 'test@example.com', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import time
 import unittest
 
 from emailage import validation
@@ -95,6 +96,22 @@ class ValidationTest(unittest.TestCase):
         self.assertRaises(ValueError, validation.assert_ip, self.correct_email)
         self.assertRaises(ValueError, validation.assert_ip, self.incorrect_email)
 
+    def test_validates_ipv6_forms(self):
+        for entry in ['::', '::1', '1::', '1::2:3:4:5:6', '::ffff:192.168.1.155', '64:ff9b::0.1.2.3',
+                      '1:2:3:4:5:6:7::', '1:2:3:4:5:6:174.70.13.43']:
+            validation.assert_ip(entry)
+
+        for entry in [':::', '1:2:3:4:5:6:7:8:9', '1:2:3:4:5:6:7', '1.2.3.4::', '::256.1.1.1', '1::2::3', '::12345']:
+            self.assertRaises(ValueError, validation.assert_ip, entry)
+
+    def test_validation_is_linear_on_hostile_input(self):
+        """Long dotted hosts used to backtrack exponentially"""
+        started_at = time.time()
+        self.assertRaises(ValueError, validation.assert_email, 'a@' + 'a.' * 100000 + '@')
+        self.assertRaises(ValueError, validation.assert_email, 'a@' + 'a.' * 30 + ' ')
+        self.assertRaises(ValueError, validation.assert_ip, '1:' * 100000)
+        self.assertLess(time.time() - started_at, 1)
+
 
 if __name__ == '__main__':
     unittest.main()
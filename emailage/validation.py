@@ -1,4 +1,8 @@
-"""A module for arguments validation"""
+"""A module for arguments validation
+
+The checks are plain parsers built on string methods and a few precompiled patterns without nested quantifiers,
+so every call runs in time linear in the length of its input, however hostile the input is.
+"""
 
 import re
 
@@ -8,31 +12,105 @@ class Messages(object):
     FLAG_NOT_ALLOWED_FORMAT = "flag must be one of {}. {} is given."
 
 
+_WHITESPACE_RE = re.compile(r'\s')
+_DECIMAL_OCTET = r'(?:25[0-5]|2[0-4][0-9]|1[0-9]{2}|[1-9]?[0-9])'
+_IPV4_RE = re.compile(r'(?:' + _DECIMAL_OCTET + r'\.){3}' + _DECIMAL_OCTET + r'\Z')
+_HEX_GROUP_RE = re.compile(r'[0-9A-Fa-f]{1,4}\Z')
+
+# Longest textual forms, e.g. 'ffff:ffff:ffff:ffff:ffff:ffff:255.255.255.255' for IPv6
+_IPV4_MAX_LENGTH = 15
+_IPV6_MAX_LENGTH = 45
+
+
+def _strip_line_end(value):
+    # The anchored patterns used before also matched in front of a single trailing newline
+    return value[:-1] if value.endswith('\n') else value
+
+
+def is_email(email):
+    """ Checks the shape local-part@domain with a dot inside the domain and no whitespace or extra '@'
+
+        :param email: value to check
+        :return: True if `email` is a valid email address
+
+        :type email: str
+
+        :Example:
+
+        >>> from emailage.validation import is_email
+        >>> is_email('test+emailage@example.com')
+        True
+        >>> is_email('test+example.com')
+        False
+    """
+    email = _strip_line_end(email)
+    local_part, at_sign, domain = email.partition('@')
+    return (bool(local_part) and bool(at_sign) and '@' not in domain and '.' in domain[1:-1] and
+            _WHITESPACE_RE.search(email) is None)
+
+
+def _is_ipv4(ip, allow_zero_first_octet=False):
+    if len(ip) > _IPV4_MAX_LENGTH or not _IPV4_RE.match(ip):
+        return False
+    return allow_zero_first_octet or not ip.startswith('0')
+
+
+def _is_ipv6(ip):
+    if len(ip) > _IPV6_MAX_LENGTH:
+        return False
+    head, double_colon, tail = ip.partition('::')
+    if double_colon:
+        if '::' in tail:
+            return False
+        groups = (head.split(':') if head else []) + (tail.split(':') if tail else [])
+        # An embedded IPv4 address can only close the address, never precede the '::'
+        ipv4_allowed = bool(tail)
+    else:
+        groups = ip.split(':')
+        ipv4_allowed = True
+
+    width = len(groups)
+    if ipv4_allowed and '.' in groups[-1]:
+        if not _is_ipv4(groups.pop(), allow_zero_first_octet=True):
+            return False
+        width += 1
+
+    for group in groups:
+        if not _HEX_GROUP_RE.match(group):
+            return False
+    # '::' stands for at least one group of zeros
+    return width <= 7 if double_colon else width == 8
+
+
+def is_ip(ip):
+    """ Checks for an IPv4 address in dotted-decimal form, or an IPv6 address in full, compressed or mixed form
+
+        :param ip: value to check
+        :return: True if `ip` is a valid IP address
+
+        :type ip: str
+
+        :Example:
+
+        >>> from emailage.validation import is_ip
+        >>> is_ip('1.234.56.7')
+        True
+        >>> is_ip('FE80::0202:B3FF:FE1E:8329')
+        True
+        >>> is_ip('192.168.1.1:443')
+        False
+    """
+    ip = _strip_line_end(ip)
+    if ':' in ip:
+        return _is_ipv6(ip)
+    return _is_ipv4(ip)
+
+
 def assert_email(email):
-    if not re.match(r'^[^@\s]+@([^@\s]+\.)+[^@\s]+$', email):
+    if not is_email(email):
         raise ValueError('{} is not a valid email address.'.format(email))
 
 
 def assert_ip(ip):
-    ipv4_re = r'^([3-9]\d?|2(?:5[0-5]|[0-4]?\d)?|1\d{0,2})((\.([3-9]\d?|2(?:5[0-5]|[0-4]?\d)?|1\d{0,2}|0)){3})$'
-    ipv6_re = r'^(?:(?:[0-9A-Fa-f]{1,4}:){6}' + \
-              '(?:[0-9A-Fa-f]{1,4}:[0-9A-Fa-f]{1,4}|(?:(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\\.){3}' + \
-              '(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5]))|::(?:[0-9A-Fa-f]{1,4}:){5}' + \
-              '(?:[0-9A-Fa-f]{1,4}:[0-9A-Fa-f]{1,4}|(?:(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\\.){3}' + \
-              '(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5]))|(?:[0-9A-Fa-f]{1,4})?::(?:[0-9A-Fa-f]{1,4}:){4}' + \
-              '(?:[0-9A-Fa-f]{1,4}:[0-9A-Fa-f]{1,4}|(?:(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\\.){3}' + \
-              '(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5]))|(?:[0-9A-Fa-f]{1,4}:[0-9A-Fa-f]{1,4})?::' + \
-              '(?:[0-9A-Fa-f]{1,4}:){3}' + \
-              '(?:[0-9A-Fa-f]{1,4}:[0-9A-Fa-f]{1,4}|(?:(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\\.){3}' + \
-              '(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5]))|(?:(?:[0-9A-Fa-f]{1,4}:){,2}[0-9A-Fa-f]{1,4})?::' + \
-              '(?:[0-9A-Fa-f]{1,4}:){2}' + \
-              '(?:[0-9A-Fa-f]{1,4}:[0-9A-Fa-f]{1,4}|(?:(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\\.){3}' + \
-              '(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5]))|(?:(?:[0-9A-Fa-f]{1,4}:){,3}[0-9A-Fa-f]{1,4})?::' + \
-              '[0-9A-Fa-f]{1,4}:(?:[0-9A-Fa-f]{1,4}:[0-9A-Fa-f]{1,4}|(?:(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\\.){3}' + \
-              '(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5]))|(?:(?:[0-9A-Fa-f]{1,4}:){,4}[0-9A-Fa-f]{1,4})?::' + \
-              '(?:[0-9A-Fa-f]{1,4}:[0-9A-Fa-f]{1,4}|(?:(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\\.){3}' + \
-              '(?:[0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5]))|(?:(?:[0-9A-Fa-f]{1,4}:){,5}[0-9A-Fa-f]{1,4})?::' + \
-              '[0-9A-Fa-f]{1,4}|(?:(?:[0-9A-Fa-f]{1,4}:){,6}[0-9A-Fa-f]{1,4})?::)$'
-
-    if not re.match(ipv4_re, ip) and not re.match(ipv6_re, ip):
+    if not is_ip(ip):
         raise ValueError('{} is not a valid IP address.'.format(ip))
@@ -26,7 +26,8 @@ setuptools.setup(
 
     packages=setuptools.find_packages(),
 
-    entry_points={'console_scripts': []},
+    entry_points={'console_scripts': ['emailage-bulk = emailage.bulk:main',
+                                      'emailage-stub = emailage.stub_server:main']},
 
     long_description=DESCRIPTION,
     long_description_content_type='text/markdown',
@@ -48,4 +49,9 @@ setuptools.setup(
     ],
 
     install_requires=open("requirements.txt").readlines(),
+    extras_require={
+        'async': ['aiohttp >= 3.0'],
+        'orjson': ['orjson >= 3.0'],
+        'http2': ['httpcore[asyncio,http2] >= 1.0'],
+    },
 )